@@ -0,0 +1,85 @@
+# This file is part of the HepB Model
+#
+# Helpers for running the model from the benchmark scripts
+#
+#
+
+import json, os, re, shutil, subprocess, sys, tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PROPS = os.path.join(ROOT_DIR, 'data', 'model_props.yaml')
+
+INIT_TIME_RE = re.compile(r'Model init time: ([0-9.eE+-]+)s')
+RUN_TIME_RE = re.compile(r'Model run time: ([0-9.eE+-]+)s')
+INIT_MEMORY_RE = re.compile(r'Model init memory: ([0-9.eE+-]+) MB')
+PEAK_MEMORY_RE = re.compile(r'Peak memory per rank \(MB\): (\[.*\])')
+
+def git_commit() -> str:
+    """ The current git commit of the model, if known
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_model(params:dict, ranks:int=1, props:str=DEFAULT_PROPS, mpirun:str='mpirun', timeout=None,
+              mpirun_args:list=None) -> dict:
+    """Run the model in a new process and return its timings.
+
+        Parameters
+        ----------
+        params : dict
+            model parameters that override the props file
+        ranks : int
+            number of MPI ranks, the model is launched with mpirun when > 1
+        props : str
+            the model props file
+        mpirun : str
+            the MPI launcher command
+        timeout : float
+            seconds before the run is killed
+        mpirun_args : list
+            extra launcher arguments, eg ['--bind-to', 'core']
+
+        Without an output.directory parameter the run writes to a temporary folder,
+        which is removed once the run ends.
+
+        Returns
+        -------
+        dict
+            init_time and run_time in seconds, init_memory (the rank 0 peak RSS 
+            after init) and peak_memory (the peak RSS of each rank at the end) in MB
+    """
+    params = dict(params)
+    temp_dir = None
+    if 'output.directory' not in params:
+        temp_dir = tempfile.mkdtemp(prefix='hepb_bench_')
+        params['output.directory'] = temp_dir
+
+    cmd = [sys.executable, '-m', 'hepb_model', props, json.dumps(params)]
+    if ranks > 1:
+        cmd = [mpirun, '-n', str(ranks)] + list(mpirun_args or []) + cmd
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT_DIR, env.get('PYTHONPATH')]))
+
+    # mpirun forwards its stdin to rank 0, which can stall the run when stdin is not a terminal
+    try:
+        proc = subprocess.run(cmd, env=env, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=timeout)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if proc.returncode != 0:
+        raise RuntimeError(f'Model run failed ({proc.returncode}): {" ".join(cmd)}\n{proc.stderr}')
+
+    init_time = INIT_TIME_RE.search(proc.stdout)
+    run_time = RUN_TIME_RE.search(proc.stdout)
+    init_memory = INIT_MEMORY_RE.search(proc.stdout)
+    peak_memory = PEAK_MEMORY_RE.search(proc.stdout)
+
+    return {'init_time': float(init_time.group(1)) if init_time else None,
+            'run_time': float(run_time.group(1)) if run_time else None,
+            'init_memory': float(init_memory.group(1)) if init_memory else None,
+            'peak_memory': json.loads(peak_memory.group(1)) if peak_memory else None}
@@ -0,0 +1,56 @@
+# This file is part of the HepB Model
+#
+# Benchmark of the index space partition (no SharedGrid) against the grid partition
+#
+# Usage, from the project root:
+#   python3 benchmarks/grid_free.py --widths 300 3000 --ranks 4
+#
+
+import argparse, json
+
+from common import run_model
+
+GRID_HEIGHT = 1000
+
+# space.partition, the first is the original implementation
+PARTITIONS = ['grid', 'index']
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the HepB model init without the SharedGrid')
+    parser.add_argument('--widths', type=int, nargs='+', default=[300, 3000],
+                        help='gridWidth, the grid is width x 1000')
+    parser.add_argument('--ticks', type=int, default=10, help='model runTime')
+    parser.add_argument('--engines', nargs='+', default=['object', 'array'])
+    parser.add_argument('--ranks', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='JSON file for the results')
+    args = parser.parse_args()
+
+    results = []
+    print(f'{"grid":>10} {"engine":>7} {"partition":>9} {"init (s)":>9} {"saved (s)":>9} '
+          f'{"memory (MB)":>11} {"saved (MB)":>10} {"run (s)":>8}')
+    for width in args.widths:
+        for engine in args.engines:
+            baseline = None
+            for partition in PARTITIONS:
+                params = {'gridWidth': width, 'gridHeight': GRID_HEIGHT,
+                          'runTime': args.ticks, 'random.seed': args.seed,
+                          'hepatocyte.engine': engine, 'space.partition': partition}
+                timing = run_model(params, ranks=args.ranks)
+
+                if baseline is None:
+                    baseline = timing
+                saved_time = baseline['init_time'] - timing['init_time']
+                saved_memory = baseline['init_memory'] - timing['init_memory']
+
+                print(f'{width:>5}x{GRID_HEIGHT:<4} {engine:>7} {partition:>9} {timing["init_time"]:>9.2f} {saved_time:>9.2f} '
+                      f'{timing["init_memory"]:>11.1f} {saved_memory:>10.1f} {timing["run_time"]:>8.2f}')
+                results.append(dict(grid_width=width, grid_height=GRID_HEIGHT, engine=engine, partition=partition,
+                                    ticks=args.ticks, ranks=args.ranks, **timing))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
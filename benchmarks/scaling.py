@@ -0,0 +1,175 @@
+# This file is part of the HepB Model
+#
+# Strong and weak scaling benchmark of the model across MPI rank counts
+#
+# Strong scaling runs the same grid on each rank count, weak scaling grows the grid
+# with the rank count (--cells is then per rank).  The results are written to a JSON
+# file with the run information (date, commit, host, launcher), and compared with a
+# baseline results file to flag run time regressions.
+#
+# Usage, from the project root, eg on a workstation:
+#   python3 benchmarks/scaling.py --mode strong --cells 30000 --ranks 1 2 4 --ticks 200
+#   python3 benchmarks/scaling.py --mode weak --cells 100000 --ranks 1 2 4 8 16 --ticks 500
+#
+# benchmarks/results/scaling_baseline.json is a small grid baseline of a single core workstation,
+# which is compared with by the same configuration:
+#   python3 benchmarks/scaling.py --mode strong --cells 30000 --ranks 1 2 --ticks 1000 --repeats 3 \
+#       --baseline benchmarks/results/scaling_baseline.json
+#
+# The run times depend on the machine, so on another machine a baseline is first written with
+# --output instead of --baseline, eg before a change, and the change is then compared with it.
+#
+# or on a cluster, with the launcher of the scheduler:
+#   python3 benchmarks/scaling.py --cells 300000 3000000 --ranks 1 2 4 8 16 --mpirun srun --mpirun-args=--cpu-bind=cores
+#
+
+import argparse, json, os, platform, shlex, socket, sys
+from datetime import datetime
+
+from common import git_commit, run_model, ROOT_DIR
+
+DEFAULT_OUTPUT_DIR = os.path.join(ROOT_DIR, 'benchmarks', 'results')
+
+# The fields that identify a configuration, to match results with the baseline
+CONFIG_FIELDS = ['mode', 'cells', 'ranks', 'ticks', 'engine', 'partition']
+
+def run_info(args) -> dict:
+    """ The information about the machine and the code of the benchmark run
+    """
+    return dict(date=datetime.now().isoformat(timespec='seconds'), commit=git_commit(),
+                host=socket.gethostname(), platform=platform.platform(), python=platform.python_version(),
+                cpus=os.cpu_count(), mpirun=' '.join([args.mpirun] + args.mpirun_args), argv=sys.argv[1:])
+
+def config_key(result:dict) -> tuple:
+    return tuple(result[field] for field in CONFIG_FIELDS)
+
+def scaling_group(result:dict) -> tuple:
+    """ The configuration of a result except the ranks, ie the total cells for strong
+        scaling and the cells per rank for weak scaling
+    """
+    size = result['cells_per_rank'] if result['mode'] == 'weak' else result['cells']
+    return (result['mode'], size, result['ticks'], result['engine'], result['partition'])
+
+def add_efficiency(results:list) -> None:
+    """ Add the speedup and parallel efficiency of each result, relative to the result
+        with the fewest ranks of the same scaling group.  For strong scaling the ideal
+        run time falls with the ranks, for weak scaling it stays the same.
+    """
+    for result in results:
+        reference = min((r for r in results if scaling_group(r) == scaling_group(result)), key=lambda r: r['ranks'])
+        ratio = reference['run_time'] / result['run_time']
+
+        if result['mode'] == 'strong':
+            result['speedup'] = ratio
+            result['efficiency'] = ratio * reference['ranks'] / result['ranks']
+        else:
+            result['speedup'] = ratio * result['ranks'] / reference['ranks']
+            result['efficiency'] = ratio
+
+def compare(results:list, baseline_file:str, tolerance:float) -> list:
+    """ The results whose run time is over the baseline run time of the same configuration
+        by more than the tolerance (a fraction)
+
+        Returns
+        -------
+        list
+            the (result, baseline run time) of each regression
+    """
+    with open(baseline_file) as f:
+        baseline = {config_key(r): r for r in json.load(f)['results']}
+
+    regressions = []
+    for result in results:
+        base = baseline.get(config_key(result))
+        if base is not None and result['run_time'] > base['run_time'] * (1 + tolerance):
+            regressions.append((result, base['run_time']))
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Strong and weak scaling benchmark of the HepB model')
+    parser.add_argument('--mode', choices=['strong', 'weak'], default='strong')
+    parser.add_argument('--cells', type=int, nargs='+', default=[300000],
+                        help='number of cells (per rank for weak scaling), the grid is cells/height x height')
+    parser.add_argument('--grid-height', type=int, default=1000, help='gridHeight')
+    parser.add_argument('--ranks', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--ticks', type=int, default=200, help='model runTime')
+    parser.add_argument('--engines', nargs='+', default=['array'])
+    parser.add_argument('--partitions', nargs='+', default=['grid'])
+    parser.add_argument('--repeats', type=int, default=1, help='runs of each configuration, the fastest is kept')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--mpirun', default='mpirun', help='the MPI launcher command')
+    parser.add_argument('--mpirun-args', type=shlex.split, default=[],
+                        help='extra launcher arguments, as one quoted string')
+    parser.add_argument('--timeout', type=float, help='seconds before a run is killed')
+    parser.add_argument('--output', help='JSON results file, by default results/scaling_<mode>_<date>.json')
+    parser.add_argument('--baseline', help='JSON results file to compare the run times with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='run time increase over the baseline '
+                                                                     'that is a regression, as a fraction')
+    args = parser.parse_args()
+
+    info = run_info(args)
+
+    output = args.output
+    if output is None:
+        output = os.path.join(DEFAULT_OUTPUT_DIR, f'scaling_{args.mode}_{info["date"].replace(":", "-")}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    results = []
+    print(f'{"mode":>6} {"cells":>9} {"ranks":>5} {"engine":>7} {"init (s)":>9} {"run (s)":>8} '
+          f'{"ticks/s":>8} {"Mcell-ticks/s":>13} {"max RSS (MB)":>12}')
+    for cells in args.cells:
+        for ranks in args.ranks:
+            for engine in args.engines:
+                for partition in args.partitions:
+                    total_cells = cells * ranks if args.mode == 'weak' else cells
+                    width = max(1, total_cells // args.grid_height)
+
+                    params = {'gridWidth': width, 'gridHeight': args.grid_height, 'runTime': args.ticks,
+                              'random.seed': args.seed, 'hepatocyte.engine': engine, 'space.partition': partition}
+
+                    timing = None
+                    for _ in range(args.repeats):
+                        t = run_model(params, ranks=ranks, mpirun=args.mpirun, mpirun_args=args.mpirun_args,
+                                      timeout=args.timeout)
+                        if timing is None or t['run_time'] < timing['run_time']:
+                            timing = t
+
+                    grid_cells = width * args.grid_height
+                    result = dict(mode=args.mode, cells=grid_cells, cells_per_rank=grid_cells / ranks, ranks=ranks,
+                                  ticks=args.ticks, engine=engine, partition=partition,
+                                  init_time=timing['init_time'], run_time=timing['run_time'],
+                                  ticks_per_second=args.ticks / timing['run_time'],
+                                  cell_ticks_per_second=grid_cells * args.ticks / timing['run_time'],
+                                  peak_memory=timing['peak_memory'])
+                    if args.mode == 'weak':
+                        result['cells_per_rank'] = cells
+                    results.append(result)
+
+                    max_memory = max(timing['peak_memory']) if timing['peak_memory'] else float('nan')
+                    print(f'{args.mode:>6} {grid_cells:>9} {ranks:>5} {engine:>7} {timing["init_time"]:>9.2f} '
+                          f'{timing["run_time"]:>8.2f} {result["ticks_per_second"]:>8.1f} '
+                          f'{result["cell_ticks_per_second"] / 1e6:>13.2f} {max_memory:>12.1f}', flush=True)
+
+    add_efficiency(results)
+
+    with open(output, 'w') as f:
+        json.dump(dict(run_info=info, results=results), f, indent=2)
+    print(f'Results written to {output}')
+
+    for result in results:
+        print(f'{result["cells"]:>9} cells, {result["ranks"]:>3} ranks: speedup {result["speedup"]:.2f}, '
+              f'efficiency {result["efficiency"]:.2f}')
+
+    if args.baseline is not None:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for result, base_time in regressions:
+            print(f'REGRESSION {result["cells"]} cells, {result["ranks"]} ranks, {result["engine"]}: '
+                  f'{result["run_time"]:.2f}s against {base_time:.2f}s in {args.baseline}')
+
+        if len(regressions) > 0:
+            raise SystemExit(1)
+        print(f'No run time regressions over {100 * args.tolerance:.0f}% against {args.baseline}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# This file is part of the HepB Model
+#
+# Benchmark of the model initialization time by cell count and rank count
+#
+# Each result is appended as one JSON line to the output file, together with the 
+# date and git commit, so the init time can be tracked over time.
+#
+# Usage, from the project root:
+#   python3 benchmarks/startup.py --cells 300000 3000000 --ranks 1 4
+#
+
+import argparse, json, os
+from datetime import datetime
+
+from common import git_commit, run_model, ROOT_DIR
+
+GRID_HEIGHT = 1000
+
+DEFAULT_OUTPUT = os.path.join(ROOT_DIR, 'benchmarks', 'results', 'startup.jsonl')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the HepB model initialization')
+    parser.add_argument('--cells', type=int, nargs='+', default=[300000, 3000000],
+                        help='number of cells, the grid is cells/1000 x 1000')
+    parser.add_argument('--ranks', type=int, nargs='+', default=[1])
+    parser.add_argument('--engines', nargs='+', default=['object', 'array', 'cohort'])
+    parser.add_argument('--partitions', nargs='+', default=['grid', 'index'])
+    parser.add_argument('--repeats', type=int, default=1, help='runs of each configuration')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='JSON lines file the results are appended to')
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+
+    date = datetime.now().isoformat(timespec='seconds')
+    commit = git_commit()
+
+    print(f'{"cells":>9} {"ranks":>5} {"engine":>7} {"partition":>9} {"init (s)":>9} {"us/cell":>8} {"memory (MB)":>11}')
+    with open(args.output, 'a') as f:
+        for cells in args.cells:
+            for ranks in args.ranks:
+                for engine in args.engines:
+                    for partition in args.partitions:
+                        for _ in range(args.repeats):
+                            # A one tick run, to time the initialization
+                            params = {'gridWidth': cells // GRID_HEIGHT, 'gridHeight': GRID_HEIGHT, 'runTime': 1,
+                                      'hepatocyte.engine': engine, 'space.partition': partition}
+                            timing = run_model(params, ranks=ranks)
+
+                            per_cell = 1e6 * timing['init_time'] / cells
+                            print(f'{cells:>9} {ranks:>5} {engine:>7} {partition:>9} {timing["init_time"]:>9.3f} '
+                                  f'{per_cell:>8.2f} {timing["init_memory"]:>11.1f}')
+
+                            result = dict(date=date, commit=commit, cells=cells, ranks=ranks, engine=engine,
+                                          partition=partition, init_time=timing['init_time'],
+                                          init_memory=timing['init_memory'])
+                            f.write(json.dumps(result) + '\n')
+                            f.flush()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# This file is part of the HepB Model
+#
+# Benchmark of the fused tick pipeline against the original implementation
+#
+# Usage, from the project root:
+#   python3 benchmarks/tick_pipeline.py --ticks 200 --cells 300000 3000000
+#
+
+import argparse, json
+
+from common import run_model
+
+GRID_HEIGHT = 1000
+
+# The original implementation shuffled the cells to infect and drew each eclipse time on its own
+ORIGINAL = {'infection.sampler': 'shuffle', 'distributions.buffer.size': 0}
+
+# (tick.pipeline, hepatocyte.scheduling, other parameters), the first is the original implementation
+PIPELINES = [('multipass', 'sweep', ORIGINAL), ('fused', 'sweep', {}), ('fused', 'calendar', {})]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the HepB model tick pipelines')
+    parser.add_argument('--cells', type=int, nargs='+', default=[300000, 3000000],
+                        help='number of cells, the grid is cells/1000 x 1000')
+    parser.add_argument('--ticks', type=int, default=200, help='model runTime')
+    parser.add_argument('--engines', nargs='+', default=['object', 'array'])
+    parser.add_argument('--ranks', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='JSON file for the results')
+    args = parser.parse_args()
+
+    results = []
+    print(f'The speedups are over multipass, sweep with {", ".join(f"{k}: {v}" for k, v in ORIGINAL.items())}')
+    print(f'{"cells":>9} {"engine":>7} {"pipeline":>10} {"scheduling":>10} {"run time (s)":>13} {"speedup":>8}')
+    for cells in args.cells:
+        for engine in args.engines:
+            baseline = None
+            for pipeline, scheduling, other in PIPELINES:
+                params = {'gridWidth': cells // GRID_HEIGHT, 'gridHeight': GRID_HEIGHT,
+                          'runTime': args.ticks, 'random.seed': args.seed,
+                          'hepatocyte.engine': engine, 'tick.pipeline': pipeline,
+                          'hepatocyte.scheduling': scheduling, **other}
+                timing = run_model(params, ranks=args.ranks)
+
+                if baseline is None:
+                    baseline = timing['run_time']
+                speedup = baseline / timing['run_time']
+
+                print(f'{cells:>9} {engine:>7} {pipeline:>10} {scheduling:>10} {timing["run_time"]:>13.2f} {speedup:>8.2f}')
+                results.append(dict(cells=cells, engine=engine, pipeline=pipeline, scheduling=scheduling,
+                                    params=other, ticks=args.ticks, ranks=args.ranks, **timing))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,28 @@
 
-from mpi4py import MPI
-from repast4py.parameters import create_args_parser
-from .hepb_model import run
+import sys
 
 if __name__ == "__main__":
-    parser = create_args_parser()
-    args = parser.parse_args()
+    if len(sys.argv) > 1 and sys.argv[1] == 'sweep':
+        from .sweep import main
+        main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'fanout':
+        from .fanout import main
+        main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'tree':
+        from .scenario_tree import main
+        main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'calibrate':
+        from .calibration import main
+        main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'compile':
+        from .kernels import compile_kernels
+        compile_kernels()
+    else:
+        from mpi4py import MPI
+        from repast4py.parameters import create_args_parser
+        from .hepb_model import run
 
-    run(MPI.COMM_WORLD, args.parameters_file, args.parameters)
+        parser = create_args_parser()
+        args = parser.parse_args()
 
+        run(MPI.COMM_WORLD, args.parameters_file, args.parameters)
@@ -0,0 +1,384 @@
+# This file is part of the HepB Model
+#
+# ABC-SMC calibration of the model parameters to a target viral load time course
+#
+# Usage, from the project root:
+#   python3 -m hepb_model calibrate data/model_props.yaml target.csv priors.yaml --particles 100 --workers 8
+#
+# where target.csv has a tick and a log10 viral load column, and priors.yaml gives
+# the [low, high] range of the uniform prior of each calibrated parameter, eg
+#   viralInfectionRate: [0.005, 0.05]
+#   proportionOfInfectiousVirus: [0.2, 0.8]
+#
+
+import argparse, contextlib, csv, json, math, multiprocessing, os, traceback
+from timeit import default_timer as timer
+
+import numpy as np
+import yaml
+
+from .constants import *
+
+def read_target(target_file:str):
+    """ Read the target (tick, log10 viral load) rows of a CSV file, skipping a header row
+
+        Returns
+        -------
+        ticks : np.ndarray (int64)
+            the target ticks, in order
+        values : np.ndarray (float64)
+            the target log10 viral loads
+    """
+    rows = []
+    with open(target_file, newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 2:
+                continue
+            try:
+                rows.append((int(float(row[0])), float(row[1])))
+            except ValueError:
+                continue   # the header
+
+    rows.sort()
+    return np.array([r[0] for r in rows], dtype=np.int64), np.array([r[1] for r in rows], dtype=np.float64)
+
+def read_priors(priors_file:str) -> dict:
+    """ Read the [low, high] uniform prior range of each calibrated parameter
+    """
+    with open(priors_file) as f:
+        priors = yaml.safe_load(f)
+
+    for name, (low, high) in priors.items():
+        if not low < high:
+            raise ValueError(f'The prior range of {name} is empty: [{low}, {high}]')
+
+    return {name: (float(low), float(high)) for name, (low, high) in priors.items()}
+
+
+class EarlyRejection:
+    """EarlyRejection is a Model observer that scores a run against the target viral
+       load, and ends it as soon as it can no longer be accepted.
+
+       The distance of a run is the root mean square difference of the log10 viral
+       load in the stats (0 for no virus) and the target, over the target ticks.  The
+       sum of the squared differences only grows, so once the sum so far gives a
+       distance over the threshold the run is rejected and stopped.  The run is also
+       stopped after the last target tick, as the later ticks are not scored.
+
+    Attributes
+    ----------
+    threshold : float
+        The acceptance threshold of the distance, inf to score the whole run
+    sum_squares : float
+        The sum of the squared differences at the target ticks so far
+    scored : int
+        The number of target ticks so far
+    rejected : bool
+        If True the run was stopped as its distance exceeds the threshold
+    last_tick : int
+        The last tick that was run
+    """
+
+    def __init__(self, ticks:np.ndarray, values:np.ndarray, threshold:float=math.inf):
+        self.targets = dict(zip(ticks.tolist(), values.tolist()))
+        self.last_target_tick = int(ticks[-1])
+        self.threshold = threshold
+
+        self.sum_squares = 0.0
+        self.scored = 0
+        self.rejected = False
+        self.last_tick = 0
+
+    def update(self, model, tick, susceptible:int, eclipsed:int, infected:int, viral_load) -> bool:
+        self.last_tick = int(tick)
+
+        target = self.targets.get(int(tick))
+        if target is None:
+            return False
+
+        viral_load_log = math.log10(viral_load) if viral_load > 0 else 0.0
+        self.sum_squares += (viral_load_log - target) ** 2
+        self.scored += 1
+
+        if self.sum_squares > self.threshold ** 2 * len(self.targets):
+            self.rejected = True
+            return True
+
+        return self.last_tick >= self.last_target_tick
+
+    def distance(self) -> float:
+        """ The distance of the run, inf if rejected or if the run ended before the last target tick
+        """
+        if self.rejected or self.scored < len(self.targets):
+            return math.inf
+
+        return math.sqrt(self.sum_squares / len(self.targets))
+
+
+def evaluate(task):
+    """ Run the model with a candidate's parameters in a pool worker, with its output to a
+        log file in its output directory, see sweep.run_one()
+
+        Returns
+        -------
+        tuple
+            the candidate index, the distance, if the run was rejected early, the last
+            tick run and the error if any
+    """
+    index, config_file, model_params, ticks, values, threshold = task
+
+    from mpi4py import MPI
+    from . import hepb_model
+
+    instance = model_params[OUTPUT_DIRECTORY]
+    os.makedirs(instance, exist_ok=True)
+
+    rejection = EarlyRejection(ticks, values, threshold)
+    error = None
+    with open(os.path.join(instance, 'run.log'), 'w') as log, contextlib.redirect_stdout(log):
+        try:
+            hepb_model.run(MPI.COMM_SELF, config_file, json.dumps(model_params), observers=[rejection])
+        except Exception:
+            error = traceback.format_exc()
+            log.write(error)
+
+    hepb_model.reset()
+
+    return index, rejection.distance(), rejection.rejected, rejection.last_tick, error
+
+
+class ABCSMC:
+    """ABCSMC calibrates model parameters to a target viral load time course with
+       Approximate Bayesian Computation by Sequential Monte Carlo (Beaumont et al. 2009).
+
+       Generation 0 samples the particles from the uniform priors.  Each later
+       generation proposes particles by perturbing ones of the previous generation
+       with a Gaussian kernel of twice their weighted variance, and accepts those whose
+       distance (see EarlyRejection) is within a threshold, the quantile of the
+       previous generation's distances.  A candidate is run with the threshold, so it
+       stops as soon as it is rejected, instead of running for the whole run time.
+
+    Attributes
+    ----------
+    priors : dict
+        The [low, high] prior range of each calibrated parameter
+    particles : np.ndarray (float64)
+        The parameter values of the current generation, shape (particles, parameters)
+    weights : np.ndarray (float64)
+        The normalized particle weights
+    distances : np.ndarray (float64)
+        The particle distances
+    """
+
+    def __init__(self, config_file:str, base_params:dict, target_file:str, priors:dict, output_dir:str,
+                 num_particles:int=100, quantile:float=0.5, workers:int=1, seed:int=1, max_runs:int=None):
+        """Constructor
+
+        Parameters
+        ----------
+        config_file : str
+            the model props file
+        base_params : dict
+            the model parameters shared by all the runs
+        target_file : str
+            the target viral load, see read_target()
+        priors : dict
+            the [low, high] uniform prior range of each calibrated parameter
+        output_dir : str
+            run k of generation g writes to output_dir/generation_g/run_k, and the
+            particles of generation g are saved to output_dir/generation_g.csv
+        num_particles : int
+            the number of particles accepted in each generation
+        quantile : float
+            the quantile of the distances that is the next threshold
+        workers : int
+            the number of worker processes running the candidates
+        seed : int
+            the seed of the proposals, and of the random.seed of the runs
+        max_runs : int
+            the most runs of a generation, by default 50 per particle
+        """
+        self.config_file = config_file
+        self.base_params = base_params
+
+        with open(config_file) as f:
+            self.run_time = dict(yaml.safe_load(f), **base_params)[RUN_TIME]
+        self.ticks, self.values = read_target(target_file)
+        self.priors = priors
+        self.names = list(priors)
+        self.low = np.array([priors[name][0] for name in self.names])
+        self.high = np.array([priors[name][1] for name in self.names])
+        self.output_dir = output_dir
+        self.num_particles = num_particles
+        self.quantile = quantile
+        self.workers = workers
+        self.max_runs = max_runs if max_runs is not None else 50 * num_particles
+
+        self.rng = np.random.default_rng(seed)
+
+        self.generation = 0
+        self.threshold = math.inf
+        self.particles = None
+        self.weights = None
+        self.distances = None
+
+        # The totals of all the runs, to report the ticks saved by the early rejection
+        self.runs = 0
+        self.ticks_run = 0
+
+    def propose(self, size:int) -> np.ndarray:
+        """ Candidate particles from the priors, or perturbed from the current generation
+        """
+        if self.particles is None:
+            return self.rng.uniform(self.low, self.high, size=(size, len(self.names)))
+
+        candidates = np.empty((0, len(self.names)))
+        while len(candidates) < size:
+            picked = self.rng.choice(len(self.particles), size=size, p=self.weights)
+            perturbed = self.particles[picked] + self.rng.normal(0.0, self.kernel_sd, size=(size, len(self.names)))
+
+            inside = np.all((perturbed >= self.low) & (perturbed <= self.high), axis=1)
+            candidates = np.concatenate((candidates, perturbed[inside]))
+
+        return candidates[:size]
+
+    def run_candidates(self, pool, candidates:np.ndarray, first_index:int) -> list:
+        """ Run the candidates with the current threshold
+
+            Returns
+            -------
+            list
+                the (index, distance, rejected, last tick, error) of each run, in order
+        """
+        generation_dir = os.path.join(self.output_dir, f'generation_{self.generation}')
+
+        tasks = []
+        for k, candidate in enumerate(candidates):
+            index = first_index + k
+            params = dict(self.base_params, **dict(zip(self.names, candidate.tolist())))
+            params['random.seed'] = int(self.rng.integers(1, 2**31 - 1))
+            params[OUTPUT_DIRECTORY] = os.path.join(generation_dir, f'run_{index}')
+            tasks.append((index, self.config_file, params, self.ticks, self.values, self.threshold))
+
+        if pool is None:
+            results = [evaluate(task) for task in tasks]
+        else:
+            results = pool.map(evaluate, tasks)
+
+        for index, distance, rejected, last_tick, error in results:
+            if error is not None:
+                raise RuntimeError(f'Run {index} of generation {self.generation} failed:\n{error}')
+            self.runs += 1
+            self.ticks_run += last_tick
+
+        return sorted(results)
+
+    def run_generation(self, pool) -> None:
+        """ Accept the particles of the next generation, and set the next threshold
+        """
+        accepted = []
+        accepted_distances = []
+        runs = 0
+        start = timer()
+
+        while len(accepted) < self.num_particles:
+            if runs >= self.max_runs:
+                raise RuntimeError(f'Generation {self.generation} accepted {len(accepted)} of {self.num_particles} '
+                                   f'particles in {runs} runs, the threshold {self.threshold} may be too small')
+
+            batch = max(self.workers, self.num_particles - len(accepted))
+            candidates = self.propose(batch)
+            results = self.run_candidates(pool, candidates, runs)
+            runs += len(candidates)
+
+            # A run that ended before the last target tick has an infinite distance, which
+            #   the infinite threshold of generation 0 would otherwise accept
+            for candidate, (_, distance, _, _, _) in zip(candidates, results):
+                if math.isfinite(distance) and distance <= self.threshold and len(accepted) < self.num_particles:
+                    accepted.append(candidate)
+                    accepted_distances.append(distance)
+
+        particles = np.array(accepted)
+
+        if self.particles is None:
+            weights = np.ones(len(particles))
+        else:
+            # The uniform prior density is the same for all the particles inside its range
+            kernel = np.prod(np.exp(-0.5 * ((particles[:, None, :] - self.particles[None, :, :]) / self.kernel_sd) ** 2),
+                             axis=2)
+            weights = 1.0 / (kernel @ self.weights)
+
+        self.particles = particles
+        self.weights = weights / weights.sum()
+        self.distances = np.array(accepted_distances)
+
+        mean = self.weights @ self.particles
+        variance = self.weights @ (self.particles - mean) ** 2
+        self.kernel_sd = np.sqrt(2.0 * variance) + 1e-12 * (self.high - self.low)
+
+        self.write_generation()
+
+        print(f'Generation {self.generation}: threshold {self.threshold:.4g}, {runs} runs in '
+              f'{timer() - start:.1f}s, acceptance {len(accepted) / runs:.2f}, '
+              f'mean {dict(zip(self.names, mean.round(6).tolist()))}', flush=True)
+
+        self.threshold = float(np.quantile(self.distances[np.isfinite(self.distances)], self.quantile))
+        self.generation += 1
+
+    def write_generation(self) -> None:
+        fname = os.path.join(self.output_dir, f'generation_{self.generation}.csv')
+        with open(fname, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.names + ['weight', 'distance'])
+            for particle, weight, distance in zip(self.particles.tolist(), self.weights.tolist(),
+                                                  self.distances.tolist()):
+                writer.writerow(particle + [weight, distance])
+
+    def run(self, generations:int) -> None:
+        """ Run the generations, and report the ticks run against full length runs
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        pool = None
+        if self.workers > 1:
+            # Spawned workers start clean, rather than with a copy of this process
+            pool = multiprocessing.get_context('spawn').Pool(self.workers)
+
+        try:
+            for _ in range(generations):
+                self.run_generation(pool)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        full_ticks = self.runs * self.run_time
+        print(f'Calibration finished {self.runs} runs of {self.ticks_run} ticks, '
+              f'{100 * (1 - self.ticks_run / full_ticks):.0f}% fewer than full length runs')
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m hepb_model calibrate',
+                                     description='Calibrate HepB model parameters to a target viral load with ABC-SMC')
+    parser.add_argument('config_file', help='the model props file')
+    parser.add_argument('target_file', help='CSV of the target tick and log10 viral load')
+    parser.add_argument('priors_file', help='YAML of the [low, high] prior range of each calibrated parameter')
+    parser.add_argument('--params', default='{}', help='JSON model parameters shared by the runs')
+    parser.add_argument('--particles', type=int, default=100, help='number of particles per generation')
+    parser.add_argument('--generations', type=int, default=5, help='number of generations')
+    parser.add_argument('--quantile', type=float, default=0.5, help='distance quantile of the next threshold')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the proposals and of the runs')
+    parser.add_argument('--output', help='the calibration output directory, by default output.directory/calibration')
+    args = parser.parse_args(args)
+
+    base_params = json.loads(args.params)
+
+    output_dir = args.output
+    if output_dir is None:
+        with open(args.config_file) as f:
+            props = dict(yaml.safe_load(f), **base_params)
+        output_dir = os.path.join(props.get(OUTPUT_DIRECTORY, 'output'), 'calibration')
+
+    abc = ABCSMC(args.config_file, base_params, args.target_file, read_priors(args.priors_file),
+                 output_dir, args.particles, args.quantile, args.workers, args.seed)
+    abc.run(args.generations)
@@ -0,0 +1,93 @@
+# This file is part of the HepB Model
+#
+# Binary checkpoints of the model state, to resume a run after a crash
+#
+#
+
+import glob, json, os, re
+import numpy as np
+from mpi4py import MPI
+
+from .hepb_utils import prefixed, unprefixed
+
+CHECKPOINT_PATTERN = re.compile(r'checkpoint_rank(\d+)_tick(\d+)\.npz$')
+
+def checkpoint_fname(directory:str, rank:int, tick:int) -> str:
+    return os.path.join(directory, f'checkpoint_rank{rank}_tick{tick}.npz')
+
+def checkpoint_ticks(directory:str, rank:int) -> list:
+    """ The ticks of the checkpoints of the rank in the directory, in order
+    """
+    ticks = []
+    for fname in glob.glob(os.path.join(directory, f'checkpoint_rank{rank}_tick*.npz')):
+        match = CHECKPOINT_PATTERN.search(fname)
+        if match is not None:
+            ticks.append(int(match.group(2)))
+
+    return sorted(ticks)
+
+def write_checkpoint(directory:str, rank:int, tick:int, states:dict, keep:int=2) -> str:
+    """ Write the state of the model components on this rank at the end of the tick,
+        and remove all but the last keep checkpoints of the rank.
+
+        The file is written to a temporary name and then renamed, so a crash while
+        writing leaves the previous checkpoint intact.
+
+        Parameters
+        ----------
+        directory : str
+            the checkpoint directory
+        rank : int
+            the rank of the states
+        tick : int
+            the tick the states are at the end of
+        states : dict
+            the state dict of each component by name, see the get_state() methods.
+            The np.ndarray values are stored as arrays, the other values as JSON.
+
+        Returns
+        -------
+        str
+            the checkpoint file name
+    """
+    arrays = {}
+    values = {'tick': tick}
+    for component, state in states.items():
+        for name, value in prefixed(component + '.', state).items():
+            if isinstance(value, np.ndarray):
+                arrays[name] = value
+            elif isinstance(value, np.generic):
+                values[name] = value.item()
+            else:
+                values[name] = value
+
+    os.makedirs(directory, exist_ok=True)
+
+    fname = checkpoint_fname(directory, rank, tick)
+    tmp_fname = fname + '.tmp.npz'
+    np.savez(tmp_fname, values=np.array(json.dumps(values)), **arrays)
+    os.replace(tmp_fname, fname)
+
+    for old_tick in checkpoint_ticks(directory, rank)[:-keep]:
+        os.remove(checkpoint_fname(directory, rank, old_tick))
+
+    return fname
+
+def read_checkpoint(directory:str, rank:int, tick:int) -> dict:
+    """ The states written by write_checkpoint(), by component name
+    """
+    with np.load(checkpoint_fname(directory, rank, tick)) as data:
+        state = {name: data[name] for name in data.files if name != 'values'}
+        state.update(json.loads(data['values'].item()))
+
+    components = {name.split('.', 1)[0] for name in state if '.' in name}
+    return {component: unprefixed(component + '.', state) for component in components}
+
+def latest_checkpoint_tick(directory:str, comm:MPI.Intracomm) -> int:
+    """ The last tick that every rank has a checkpoint of, or -1 if there is none
+    """
+    ticks = checkpoint_ticks(directory, comm.Get_rank())
+    all_ticks = comm.allgather(set(ticks))
+
+    common = set.intersection(*all_ticks)
+    return max(common) if len(common) > 0 else -1
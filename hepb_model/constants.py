@@ -12,12 +12,59 @@ CNEP_PLUS__EARLY_FILE = "cnep_plus_early.file"
 RUN = "run.number"
 OUTPUT_DIRECTORY = "output.directory"
 STATS_OUTPUT_FILE = "stats.output.file"
+STATS_FLUSH_INTERVAL = "stats.flush.interval"
+STATS_IN_MEMORY = "stats.in.memory"        # keep the stats in memory, with no stats, props or kinetics files
+STATS_RESULT = "stats.result"              # the run result of get(): done, payload (the encoded stats) or summary
+STATS_RESULT_TICKS = "stats.result.ticks"  # the ticks of the summary result, by default the last tick
+RESULT_DONE = "done"
+RESULT_PAYLOAD = "payload"
+RESULT_SUMMARY = "summary"
 EVENTS_OUTPUT_FILE = "events.output.file"
 PERSONS_OUTPUT_FILE = "persons.output.file"
 NETWORK_OUTPUT_FILE = "network.output.file"
 NEEDLESHARING_OUTPUT_FILE = "needle_sharing.output.file"
+KINETICS_OUTPUT_FILE = "production_kinetics.csv"
 EVENT_FILTERS = "log.events"
 
+HEPATOCYTE_ENGINE = "hepatocyte.engine"   # object (one agent per cell), array (NumPy arrays) or cohort (cell counts)
+ENGINE_OBJECT = "object"
+ENGINE_ARRAY = "array"
+ENGINE_COHORT = "cohort"
+
+SPACE_PARTITION = "space.partition"   # grid (repast4py SharedGrid) or index (column blocks, no grid)
+PARTITION_GRID = "grid"
+PARTITION_INDEX = "index"
+
+HEPATOCYTE_SCHEDULING = "hepatocyte.scheduling"   # calendar (only step cells due this tick) or sweep (step all cells)
+SCHEDULING_CALENDAR = "calendar"
+SCHEDULING_SWEEP = "sweep"
+
+TICK_PIPELINE = "tick.pipeline"   # fused (one pass over the due cells) or multipass (separate count, harvest and step passes)
+PIPELINE_FUSED = "fused"
+PIPELINE_MULTIPASS = "multipass"
+
+INFECT_NEIGHBORS = "infect.neighbors"   # selected cells that are not susceptible infect their neighbors (Mason)
+
+INFECTION_SAMPLER = "infection.sampler"   # hypergeometric (sample the susceptible hits) or shuffle (shuffle all cells)
+SAMPLER_HYPERGEOMETRIC = "hypergeometric"
+SAMPLER_SHUFFLE = "shuffle"
+
+DISTRIBUTIONS_BUFFER_SIZE = "distributions.buffer.size"   # scalar random draws made per block, 0 to draw one at a time
+
+RANK_INVARIANT = "rank.invariant"   # the same trajectory for a seed on any number of ranks
+
+CHECKPOINT_INTERVAL = "checkpoint.interval"   # ticks between checkpoints of the model state, 0 for none
+CHECKPOINT_DIRECTORY = "checkpoint.directory"   # checkpoint folder, by default output.directory/checkpoints
+CHECKPOINT_RESUME = "checkpoint.resume"   # resume from the latest checkpoint in the checkpoint folder
+
+CONVERGENCE_WINDOW = "convergence.window"   # ticks the stats must not change for the run to end early, 0 to always run to runTime
+CONVERGENCE_TOLERANCE = "convergence.tolerance"   # largest relative change of the stats in the window
+CONVERGENCE_FILL = "convergence.fill"   # write the stats rows of the ticks after an early end
+
+PHASE_TIMERS = "phase.timers"   # write the time of each step phase (min/mean/max across ranks) next to the stats file
+
+DEBUG_CHECK_COUNTS = "debug.check.counts"   # recount the cell statuses each tick to check the counters
+
 GRID_HEIGHT = 'gridHeight'
 GRID_WIDTH = 'gridWidth'
 RUN_TIME = 'runTime'
@@ -39,4 +86,9 @@ VIRAL_PROD_CYCLE_POWER_LAW_EXPONENT = 'viralProdCyclePowerLawExponent'
 VIRAL_DEGREDATION_RATE = 'viralDegradationRate'
 VIRAL_INFECTION_RATE = 'viralInfectionRate'
 
+IS_TREATMENT_USED = 'isTreatmentUsed'
+START_OF_TREATMENT_AT = 'startOfTreatmentAt'   # first tick of the treatment
+REDUCE_PRODUCTION_RATE = 'reduceProductionRate'   # fraction of the virus production blocked by the treatment
+REDUCE_PRODUCTION_RATE_CONTROLLER = 'reduceProductionRateController'   # fraction of the remaining reduction reached each day
+
 STEPHOUR = 24 # first day 
\ No newline at end of file
@@ -0,0 +1,129 @@
+# This file is part of the HepB Model
+#
+# Steady state detection, to end a run once nothing changes
+#
+#
+
+import math
+from collections import deque
+
+import numpy as np
+
+from repast4py import parameters
+
+from .constants import *
+from .hepb_utils import printf
+from .model_statistics import Statistics
+
+class ConvergenceMonitor:
+    """ConvergenceMonitor is a Model observer that detects the steady state of a run
+       from the stats aggregates, ie the status counts summed across ranks and the
+       total viral load, and then stops the run.
+
+       The run has converged when, over the last convergence.window ticks, the
+       range (max - min) of each status count is at most convergence.tolerance times
+       the number of cells, and the range of the viral load is at most the tolerance
+       times its mean (or 1 for a mean under 1).  Only the ticks after the last scheduled
+       change of the model are considered, ie the end of the first day and the start
+       of the treatment.  The aggregates are the same on every rank, so all the ranks
+       stop at the same tick.
+
+       With convergence.fill, the stats rows of the remaining ticks are written as if
+       the run had continued: the status counts stay as they are and the viral load
+       follows its degradation with the mean production of the window.
+
+    Attributes
+    ----------
+    window : int
+        The number of ticks over which the aggregates must not change
+    tolerance : float
+        The largest relative range of the aggregates in the window
+    fill : bool
+        If True the stats of the remaining ticks are filled in
+    converged_at : int
+        The tick the run converged at, or None
+    """
+
+    def __init__(self, window:int, tolerance:float, fill:bool=False):
+        self.window = window
+        self.tolerance = tolerance
+        self.fill = fill
+
+        # The model changes at the end of the first day and when the treatment starts
+        self.earliest = STEPHOUR
+        if parameters.params.get(IS_TREATMENT_USED, False):
+            self.earliest = max(self.earliest, parameters.params.get(START_OF_TREATMENT_AT, 0))
+
+        self.degradation = 1.0 - parameters.params[VIRAL_DEGREDATION_RATE]
+
+        # The (susceptible, eclipsed, infected, viral load) of the last window + 1 ticks
+        self.history = deque(maxlen=window + 1)
+        self.converged_at = None
+
+    def update(self, model, tick, susceptible:int, eclipsed:int, infected:int, viral_load) -> bool:
+        """ Add the aggregates of the tick, and return True if the run has converged
+            and should stop.
+        """
+        if tick < self.earliest:
+            return False
+
+        self.history.append((susceptible, eclipsed, infected, viral_load))
+        if len(self.history) <= self.window:
+            return False
+
+        cells = susceptible + eclipsed + infected
+        *counts, viral_loads = zip(*self.history)
+
+        for values in counts:
+            if max(values) - min(values) > self.tolerance * cells:
+                return False
+
+        mean = sum(viral_loads) / len(viral_loads)
+        if max(viral_loads) - min(viral_loads) > self.tolerance * max(mean, 1.0):
+            return False
+
+        self.converged_at = int(tick)
+
+        if model.rank == 0:
+            printf(f'Converged at tick {self.converged_at}, {self.window} ticks within {self.tolerance}')
+
+            if self.fill:
+                self.fill_stats(model, tick)
+
+        return True
+
+    def get_state(self) -> dict:
+        """ The aggregates of the window so far, see checkpoint
+        """
+        history = list(self.history)
+        return {'counts': np.array([values[:3] for values in history], dtype=np.int64).reshape(-1, 3),
+                'viral_loads': np.array([values[3] for values in history], dtype=np.float64),
+                'converged_at': -1 if self.converged_at is None else self.converged_at}
+
+    def set_state(self, state:dict) -> None:
+        self.history = deque(((*counts, viral_load) for counts, viral_load in 
+                              zip(state['counts'].tolist(), state['viral_loads'].tolist())), maxlen=self.window + 1)
+        self.converged_at = None if state['converged_at'] < 0 else int(state['converged_at'])
+
+    def production(self) -> float:
+        """ The mean virus production per tick in the window, from the viral load changes
+        """
+        viral_loads = [values[3] for values in self.history]
+        produced = [after - math.floor(before * self.degradation)
+                    for before, after in zip(viral_loads[:-1], viral_loads[1:])]
+
+        return sum(produced) / len(produced)
+
+    def fill_stats(self, model, tick) -> None:
+        """ Record the stats rows of the ticks after the tick to the run time
+        """
+        susceptible, eclipsed, infected, viral_load = self.history[-1]
+        production = round(self.production())
+
+        stats = Statistics.getInstance()
+        tick_type = type(tick)
+
+        # The recorded viral load is at the start of the tick, see Model.step()
+        for t in range(int(tick) + 1, parameters.params[RUN_TIME] + 1):
+            viral_load = math.floor(viral_load * self.degradation) + production
+            stats.record_stats(tick_type(t), model.run_number, susceptible, eclipsed, infected, viral_load)
@@ -0,0 +1,54 @@
+# This file is part of the HepB Model
+#
+# Counter based random numbers keyed on the global cell identity
+#
+# Used by the rank invariant mode, where each random value is a pure function
+# of (random.seed, stream, tick, cell id), so that a run does not depend on how
+# the cells are partitioned across ranks or on the order they are visited.
+#
+
+import numpy as np
+
+# Independent streams of random values
+STREAM_INFECTION = 1   # number of susceptible cells hit by the infection
+STREAM_SELECTION = 2   # which susceptible cells are infected
+STREAM_ECLIPSE = 3     # eclipse phase duration of newly infected cells
+STREAM_TREATMENT = 4   # virions released under treatment
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+def _mix(x:np.ndarray) -> np.ndarray:
+    """ The splitmix64 finalizer, a bijective mixing of 64 bit integers
+    """
+    x = x + _GOLDEN
+    x = (x ^ (x >> np.uint64(30))) * _MIX_1
+    x = (x ^ (x >> np.uint64(27))) * _MIX_2
+    return x ^ (x >> np.uint64(31))
+
+def stream_key(seed:int, stream:int, tick:int) -> np.uint64:
+    """ The key of the random values of a stream at a tick
+    """
+    with np.errstate(over='ignore'):
+        key = _mix(np.array([seed], dtype=np.uint64))
+        key = _mix(key ^ np.uint64(stream))
+        key = _mix(key ^ np.uint64(tick))
+
+    return key[0]
+
+def cell_uniforms(seed:int, stream:int, tick:int, cells:np.ndarray) -> np.ndarray:
+    """ Uniform random values in [0, 1), one for each global cell id
+    """
+    key = stream_key(seed, stream, tick)
+
+    with np.errstate(over='ignore'):
+        x = _mix(_mix(np.asarray(cells, dtype=np.uint64) ^ key))
+
+    return (x >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+def tick_generator(seed:int, stream:int, tick:int) -> np.random.Generator:
+    """ A generator for the values of a stream at a tick that are shared by all
+        cells (and all ranks), eg the number of cells to infect.
+    """
+    return np.random.Generator(np.random.Philox(key=int(stream_key(seed, stream, tick))))
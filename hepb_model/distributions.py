@@ -1,8 +1,10 @@
 # This file is part of the HepB Model
 #
 # Random Distributions
-# 
-# 
+#
+#
+
+import numpy as np
 
 from repast4py import parameters, random
 
@@ -10,38 +12,112 @@ from .constants import *
 
 class Distributions:
     """Distributions class holds statistical distributions references.
-    
+
+    Random values can be drawn for a whole batch of cells at once, and scalar
+    eclipse times are served from a pre-filled buffer, so that the model does not
+    make one generator call from Python per cell.
+
+    All values are drawn from the generator in the order the model asks for them,
+    except scalar eclipse times, which are taken in order from a block of
+    distributions.buffer.size draws made whenever the previous block is used up.
+    A run is therefore reproducible for a given random.seed and buffer size.  A
+    buffer size of 0 draws each scalar eclipse time directly.
+
     Attributes
     ----------
     __instance : Distributions
         Distributions singleton
+    buffer_size : int
+        number of scalar eclipse times drawn per block
 
     """
-    
+
     __instance = None
-   
-    @staticmethod 
+
+    @staticmethod
     def getInstance():
         return Distributions.__instance
-   
-    def __init__(self):
+
+    def __init__(self, rng:np.random.Generator=None):
         """Constructor
-        
+
         Parameters
         ----------
-        
+        rng : np.random.Generator
+            the generator to draw from, by default the repast4py random.default_rng
         """
-        
+
         # NOTE repast4py random.init() will set the numpy generator seed using the random.seed parameter
+        self._rng = rng
+
+        self.eclipse_min = parameters.params[ECLIPSED_TO_INFECTED_PHASE_TRANSITION_MIN]
+        self.eclipse_max = parameters.params[ECLIPSED_TO_INFECTED_PHASE_TRANSITION_MAX]
+
+        self.buffer_size = parameters.params.get(DISTRIBUTIONS_BUFFER_SIZE, 1024)
+        self.reset()
 
         Distributions.__instance = self
 
+    @property
+    def rng(self) -> np.random.Generator:
+        if self._rng is not None:
+            return self._rng
+        return random.default_rng
+
+    def close(self):
+        Distributions.__instance = None
 
-    def get_random_eclipse_time(self) -> int:
-        
-        min = parameters.params[ECLIPSED_TO_INFECTED_PHASE_TRANSITION_MIN]
-        max = parameters.params[ECLIPSED_TO_INFECTED_PHASE_TRANSITION_MAX]
+    def reset(self) -> None:
+        """ Discard the buffered draws, eg after the generator is re-seeded
+        """
+        self.eclipse_buffer = np.zeros(0, dtype=np.int64)
+        self.eclipse_buffer_pos = 0
 
-        return random.default_rng.integers(min,max)
-        
+    def get_state(self) -> dict:
+        """ The buffered draws, see checkpoint.  The generator state is saved separately.
+        """
+        return {'eclipse_buffer': self.eclipse_buffer, 'eclipse_buffer_pos': self.eclipse_buffer_pos}
+
+    def set_state(self, state:dict) -> None:
+        self.eclipse_buffer = np.array(state['eclipse_buffer'], dtype=np.int64)
+        self.eclipse_buffer_pos = int(state['eclipse_buffer_pos'])
+
+    def get_random_eclipse_time(self, size=None):
+        """Draw the eclipse phase duration for one cell, or for `size` cells
+        as an array when size is given.
+        """
+        if size is not None:
+            return self.rng.integers(self.eclipse_min, self.eclipse_max, size=size)
+
+        if self.buffer_size <= 0:
+            return self.rng.integers(self.eclipse_min, self.eclipse_max)
+
+        if self.eclipse_buffer_pos >= len(self.eclipse_buffer):
+            self.eclipse_buffer = self.rng.integers(self.eclipse_min, self.eclipse_max, size=self.buffer_size)
+            self.eclipse_buffer_pos = 0
+
+        eclipse_time = self.eclipse_buffer[self.eclipse_buffer_pos]
+        self.eclipse_buffer_pos += 1
+
+        return int(eclipse_time)
+
+    def get_random_eclipse_time_counts(self, n:int) -> np.ndarray:
+        """Draw the eclipse phase durations of n cells as counts, where element i is
+        the number of cells with the duration eclipse_min + i.
+        """
+        durations = self.eclipse_max - self.eclipse_min
+        return self.rng.multinomial(n, np.full(durations, 1.0 / durations))
+
+    def get_random_selection(self, population:int, size:int) -> np.ndarray:
+        """Select `size` of the integers 0..population-1 uniformly without replacement
+        """
+        return self.rng.choice(population, size, replace=False)
+
+    def get_hypergeometric(self, ngood:int, nbad:int, nsample:int) -> int:
+        """Draw the number of good items in a sample of nsample, taken without
+        replacement from ngood good and nbad bad items.
+        """
+        return int(self.rng.hypergeometric(ngood, nbad, nsample))
 
+    def get_random_uniforms(self, size:int) -> np.ndarray:
+        return self.rng.random(size)
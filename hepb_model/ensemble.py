@@ -0,0 +1,303 @@
+# This file is part of the HepB Model
+#
+# Multi-replicate ensemble of the HepB Model in one process
+#
+#
+
+import json, os
+import numpy as np
+from mpi4py import MPI
+
+from repast4py import schedule, parameters
+
+from .constants import *
+from .hepb_enums import StatusCode
+from .hepb_utils import printf, IndexPool, sample_infections
+from .distributions import Distributions
+from .kinetics import ProductionKinetics
+from .model_statistics import Statistics
+from .treatment import Treatment
+
+# The parameters that can differ between the replicates of an ensemble.  The others
+#   set the shape of the cell arrays, the kinetics table or the engine, so runs that
+#   differ in those are separate ensembles.
+REPLICATE_PARAMS = ['random.seed', 'run.number', 'run', OUTPUT_DIRECTORY, INITIAL_VIRAL_LOAD,
+                    VIRAL_INFECTION_RATE, INFECTIOUS_VIRUS_FIRST_DAY, PROPORTION_INFECTIOUS_VIRUS,
+                    VIRAL_DEGREDATION_RATE]
+
+def replicate_params(replicates:list) -> list:
+    """ The parameter overrides of each replicate, from a list of seeds, JSON
+        parameter lines (eg a swift-t UPF file) or dicts.
+    """
+    params = []
+    for replicate in replicates:
+        if isinstance(replicate, dict):
+            params.append(dict(replicate))
+        elif isinstance(replicate, str):
+            params.append(json.loads(replicate))
+        else:
+            params.append({'random.seed': int(replicate)})
+
+    return params
+
+def replicate_run_dirs(replicates:list, output_dir:str) -> list:
+    """ The stats directory of each replicate: its own output.directory, or run_<i> in
+        the output directory as in the swift-t sweep.  Replicates that share an
+        output.directory, as the lines of a UPF often do, write to run_<i> in it, so
+        that no two replicates write the same stats file.
+    """
+    given = [replicate.get(OUTPUT_DIRECTORY) for replicate in replicates]
+
+    run_dirs = []
+    for i, run_dir in enumerate(given):
+        if run_dir is None:
+            run_dirs.append(os.path.join(output_dir, f'run_{i}'))
+        elif given.count(run_dir) > 1:
+            run_dirs.append(os.path.join(run_dir, f'run_{i}'))
+        else:
+            run_dirs.append(run_dir)
+
+    return run_dirs
+
+
+class EnsembleModel:
+    """EnsembleModel runs R replicates of the HepB Model together, with the state of
+       the cells in (R, cells) arrays, so that the per tick Python work is shared by
+       all the replicates.
+
+       The replicates follow the array engine with the hypergeometric sampler, and each
+       has its own generator, seeded from its random.seed and used in the same order as
+       a single run, so replicate r has the same output as a single array engine run
+       with its parameters.  Each replicate writes its stats to its own output.directory
+       if set, otherwise to the run_<i> subfolder of the output directory, as the 
+       swift-t sweep does, see replicate_run_dirs().  On more than one rank, the
+       replicates are split round robin across the ranks.
+
+    Attributes
+    ----------
+    replicates : list
+        The indices in the ensemble of the replicates on this rank
+    params : list
+        The parameters of each replicate on this rank
+    status : np.ndarray (int8)
+        StatusCode of each cell, shape (R, cells)
+    eclipsed_phase_period : np.ndarray (int64)
+        tick when an eclipsed cell becomes infected
+    first_infectious_status_time : np.ndarray (int64)
+        production cycle counter of an infected cell
+    next_production : np.ndarray (int64)
+        tick of the next virus production of an infected cell
+    total_viral_load : np.ndarray (float64)
+        The viral load of each replicate
+    """
+
+    def __init__(self, comm:MPI.Intracomm, replicates:list):
+        """Constructor
+
+        Parameters
+        ----------
+        comm : MPI.Intracomm
+            the communicator whose ranks share the replicates
+        replicates : list
+            the parameter overrides of each replicate, see replicate_params()
+        """
+        self.comm = comm
+        self.rank = comm.Get_rank()
+
+        self.check_params(replicates)
+
+        world_size = comm.Get_size()
+        self.replicates = list(range(self.rank, len(replicates), world_size))
+        self.params = [dict(parameters.params, **replicates[i]) for i in self.replicates]
+
+        num_replicates = len(self.replicates)
+
+        if self.rank == 0:
+            printf(f'HepB Model Ensemble Initialization... {len(replicates)} replicates on {world_size} ranks')
+
+        self.runner = schedule.init_schedule_runner(MPI.COMM_SELF)
+        self.runner.schedule_repeating_event(1, 1, self.step)
+        self.runner.schedule_stop(parameters.params[RUN_TIME])
+        self.runner.schedule_end_event(self.at_end)
+
+        output_dir = parameters.params[OUTPUT_DIRECTORY]
+
+        # With the stats in memory the replicates write no files, see at_end()
+        in_memory = parameters.params.get(STATS_IN_MEMORY, False)
+        self.result = None
+
+        # Imported here, as yaml is only needed for the output of the props
+        import yaml
+
+        run_dirs = replicate_run_dirs(replicates, output_dir)
+
+        self.distributions = []
+        self.stats = []
+        for i, params in zip(self.replicates, self.params):
+            # The generator is sampled as in the Model, so the draws match a single run
+            rng = np.random.default_rng(params['random.seed'])
+            rng.random(10000)
+            rng.random(1)
+            self.distributions.append(Distributions(rng))
+
+            run_dir = run_dirs[i]
+            params[OUTPUT_DIRECTORY] = run_dir
+
+            if not in_memory:
+                os.makedirs(run_dir, exist_ok=True)
+                with open(os.path.join(run_dir, 'model_props.yaml'), 'w') as f:
+                    yaml.dump(params, f, default_flow_style=False)
+
+            self.stats.append(Statistics(output_dir=run_dir))
+
+        self.kinetics = ProductionKinetics(parameters.params[RUN_TIME] + 1)
+
+        self.n = parameters.params[GRID_WIDTH] * parameters.params[GRID_HEIGHT]
+        shape = (num_replicates, self.n)
+
+        self.status = np.full(shape, StatusCode.SUSCEPTIBLE, dtype=np.int8)
+        self.eclipsed_phase_period = np.zeros(shape, dtype=np.int64)
+        self.first_infectious_status_time = np.zeros(shape, dtype=np.int64)
+        self.next_production = np.zeros(shape, dtype=np.int64)
+
+        self.susceptible_pools = [IndexPool(self.n) for _ in range(num_replicates)]
+
+        # Status counts of each replicate
+        self.susceptible = np.full(num_replicates, self.n, dtype=np.int64)
+        self.eclipsed = np.zeros(num_replicates, dtype=np.int64)
+        self.infected = np.zeros(num_replicates, dtype=np.int64)
+
+        self.run_number = np.array([params.get('run.number', 0) for params in self.params])
+        self.total_viral_load = np.array([params[INITIAL_VIRAL_LOAD] for params in self.params], dtype=np.float64)
+        self.viral_infection_rate = np.array([params[VIRAL_INFECTION_RATE] for params in self.params])
+        self.first_day_proportion = np.array([params[INFECTIOUS_VIRUS_FIRST_DAY] for params in self.params])
+        self.later_proportion = np.array([params[PROPORTION_INFECTIOUS_VIRUS] for params in self.params])
+        self.degradation = np.array([1.0 - params[VIRAL_DEGREDATION_RATE] for params in self.params])
+
+        self.proportion_infectious_virus = self.first_day_proportion.copy()
+
+        self.treatment = Treatment()
+        self.seeds = [params['random.seed'] for params in self.params]
+
+        # Virus produced by each replicate since the last viral load update
+        self.pending_viral_load = np.zeros(num_replicates, dtype=np.int64)
+
+    def check_params(self, replicates:list) -> None:
+        """ Check that the replicates only differ in the REPLICATE_PARAMS, and that the
+            model options are ones the ensemble follows.
+        """
+        names = set().union(*replicates) - set(REPLICATE_PARAMS)
+        varying = [name for name in names 
+                   if any(replicate.get(name, parameters.params.get(name)) != 
+                          replicates[0].get(name, parameters.params.get(name)) for replicate in replicates)]
+
+        if len(varying) > 0:
+            raise ValueError(f'Ensemble replicates can only differ in {REPLICATE_PARAMS}, not {sorted(varying)}')
+
+        # Parameters shared by all the replicates
+        for name, value in replicates[0].items():
+            if name not in REPLICATE_PARAMS:
+                parameters.params[name] = value
+
+        if (parameters.params.get(INFECT_NEIGHBORS, False) or parameters.params.get(RANK_INVARIANT, False) or
+                parameters.params.get(INFECTION_SAMPLER, SAMPLER_HYPERGEOMETRIC) != SAMPLER_HYPERGEOMETRIC):
+            raise ValueError(f'The ensemble does not support {INFECT_NEIGHBORS}, {RANK_INVARIANT} or '
+                             f'the {SAMPLER_SHUFFLE} {INFECTION_SAMPLER}')
+
+    def step(self):
+        """ Advance all the replicates by one tick, as Model.step()
+        """
+        # The stats record the tick as the schedule gives it, as in the Model
+        runner_tick = schedule.runner().tick()
+        tick = int(runner_tick)
+
+        susceptible = self.susceptible.copy()
+        eclipsed = self.eclipsed.copy()
+        infected = self.infected.copy()
+        viral_load = self.total_viral_load.copy()
+
+        self.infect(tick)
+
+        if tick < STEPHOUR:
+            self.proportion_infectious_virus = self.first_day_proportion
+        else:
+            self.proportion_infectious_virus = self.later_proportion
+
+        # The virus produced at the previous tick is added to the viral load
+        production = self.pending_viral_load
+        self.pending_viral_load = np.zeros_like(production)
+
+        if self.treatment.used and tick > 0:
+            production = np.array([self.treatment.release(tick, p, seed) 
+                                   for p, seed in zip(production.tolist(), self.seeds)], dtype=np.int64)
+
+        self.step_cells(tick)
+
+        self.total_viral_load = np.floor(self.total_viral_load * self.degradation) + production
+
+        for r, stats in enumerate(self.stats):
+            stats.record_stats(runner_tick, self.run_number[r].item(), susceptible[r].item(), eclipsed[r].item(),
+                               infected[r].item(), viral_load[r].item())
+
+    def infect(self, tick:int) -> None:
+        """ Eclipse the randomly selected susceptible cells of each replicate, as
+            HBVirus.infect() and HepatocyteArray.infect()
+        """
+        ratio_susceptible = self.susceptible / self.n
+        rate_of_infection = (self.proportion_infectious_virus * self.viral_infection_rate
+                             * self.total_viral_load * ratio_susceptible)
+
+        # rate is between 0 and 1, the AnyLogic model infects one cell
+        rate_of_infection[(rate_of_infection >= 0) & (rate_of_infection < 1)] = 1
+        num_to_infect = np.ceil(rate_of_infection).astype(np.int64)
+
+        for r, distributions in enumerate(self.distributions):
+            cells = sample_infections(self.susceptible_pools[r], self.n, num_to_infect[r].item(), distributions)
+            if len(cells) == 0:
+                continue
+
+            eclipse_time = distributions.get_random_eclipse_time(size=len(cells))
+
+            self.susceptible[r] -= len(cells)
+            self.eclipsed[r] += len(cells)
+
+            self.status[r, cells] = StatusCode.ECLIPSED
+            self.eclipsed_phase_period[r, cells] = tick + eclipse_time
+
+    def step_cells(self, tick:int) -> None:
+        """ HepatocyteArray.step() for the cells of all the replicates, see kernels.step_replicates()
+        """
+        # Imported at first use, see kernels
+        from .kernels import step_replicates
+
+        num_replicates = len(self.replicates)
+        became_infected = np.zeros(num_replicates, dtype=np.int64)
+        produced = np.zeros(num_replicates, dtype=np.int64)
+
+        step_replicates(self.status, self.eclipsed_phase_period, self.first_infectious_status_time,
+                        self.next_production, self.kinetics.virions, self.kinetics.interval, tick,
+                        StatusCode.ECLIPSED, StatusCode.INFECTED, became_infected, produced)
+
+        self.eclipsed -= became_infected
+        self.infected += became_infected
+
+        self.pending_viral_load += produced
+
+    def run(self):
+        self.runner.execute()
+
+    def at_end(self):
+        """ Write the buffered stats of the replicates.  With a stats.result, the result 
+            on rank 0 is the JSON list of the result of each replicate, see Statistics.result().
+        """
+        results = [(i, stats.result()) for i, stats in zip(self.replicates, self.stats)]
+
+        for stats in self.stats:
+            stats.close()
+
+        results = self.comm.gather(results, root=0)
+        if self.rank == 0 and parameters.params.get(STATS_RESULT, RESULT_DONE) != RESULT_DONE:
+            self.result = json.dumps([result for _, result in sorted(sum(results, []))])
+
+        if self.rank == 0:
+            printf("Ensemble Ended.")
@@ -0,0 +1,83 @@
+# This file is part of the HepB Model
+#
+# Tick indexed calendar of Hepatocyte transitions
+#
+#
+
+import numpy as np
+
+class EventCalendar:
+    """EventCalendar holds the local cells that are due to act at each future tick.
+
+       Susceptible cells never act, eclipsed cells only act at the tick they
+       become infected, and infected cells only act at their next production, so
+       the model step only needs to visit the cells in the bucket of the current
+       tick.  Cells are identified by their local index on this rank, ie the
+       Hepatocyte hepb_id or the index into the HepatocyteArray arrays.
+
+    Attributes
+    ----------
+    __instance : EventCalendar
+        EventCalendar singleton
+    buckets : dict
+        tick -> list of the local cell indices (int or np.ndarray) due at the tick
+    """
+
+    __instance = None
+
+    @staticmethod
+    def getInstance():
+        return EventCalendar.__instance
+
+    def __init__(self):
+        """Constructor
+
+        Parameters
+        ----------
+
+        """
+        self.buckets = {}
+
+        EventCalendar.__instance = self
+
+    def schedule(self, tick, cell) -> None:
+        """ Schedule a cell, or an array of cells, to act at the tick
+        """
+        self.buckets.setdefault(int(tick), []).append(cell)
+
+    def schedule_cells(self, ticks:np.ndarray, cells:np.ndarray) -> None:
+        """ Schedule each cell in the array to act at the corresponding tick
+        """
+        if len(cells) == 0:
+            return
+
+        order = np.argsort(ticks, kind='stable')
+        ticks = ticks[order]
+        cells = cells[order]
+
+        due_ticks, starts = np.unique(ticks, return_index=True)
+        for tick, due in zip(due_ticks, np.split(cells, starts[1:])):
+            self.buckets.setdefault(int(tick), []).append(due)
+
+    def pop(self, tick) -> list:
+        """ Remove and return the list of cells due at the tick
+        """
+        return self.buckets.pop(int(tick), [])
+
+    def pop_cells(self, tick) -> np.ndarray:
+        """ Remove and return the cells due at the tick as one index array
+        """
+        due = self.buckets.pop(int(tick), None)
+
+        if due is None:
+            return np.zeros(0, dtype=np.int64)
+
+        return np.concatenate([np.atleast_1d(cells) for cells in due])
+
+    def clear(self) -> None:
+        """ Remove all the scheduled cells
+        """
+        self.buckets = {}
+
+    def close(self):
+        EventCalendar.__instance = None
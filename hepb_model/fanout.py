@@ -0,0 +1,159 @@
+# This file is part of the HepB Model
+#
+# Fork based fan-out of an initialized model into replicates
+#
+# Usage, from the project root:
+#   python3 -m hepb_model fanout data/model_props.yaml '{"runTime":500}' --seeds 1 2 3 4 --workers 4
+#
+
+import argparse, json, os, selectors, sys, traceback
+from pathlib import Path
+from timeit import default_timer as timer
+
+from mpi4py import MPI
+
+from repast4py.parameters import init_params
+from repast4py import parameters
+
+from .constants import *
+from .hepb_utils import printf
+from .model_statistics import Statistics
+from . import hepb_model
+
+def run_child(model, index:int, seed:int, output_dir:str, write_fd:int) -> int:
+    """ Run one replicate in a forked child and send its result to the parent
+    """
+    start = timer()
+    error = None
+    try:
+        model.reseed(seed, output_dir)
+        model.run()
+    except Exception:
+        error = traceback.format_exc()
+
+    result = dict(index=index, seed=seed, output_directory=output_dir,
+                  run_time=timer() - start, error=error, result=model.result)
+
+    with os.fdopen(write_fd, 'w') as f:
+        json.dump(result, f)
+
+    return 0 if error is None else 1
+
+def fanout(model, seeds:list, output_dir:str, workers:int=None) -> list:
+    """ Run a replicate of the initialized (not yet run) model for each seed, each in a
+        forked child process that shares the parent's initialized cells copy-on-write,
+        with at most workers children at a time.
+
+        Parameters
+        ----------
+        model : Model
+            the initialized model, on a single rank
+        seeds : list
+            the random seed of each replicate
+        output_dir : str
+            replicate i writes its stats to output_dir/run_i
+        workers : int
+            the maximum number of children running at once, by default the number of cpus
+
+        Returns
+        -------
+        list
+            the result dict of each replicate, in the seeds order, with the run time, the
+            child exit status and the error traceback, if any
+    """
+    if model.comm.Get_size() > 1:
+        raise ValueError('The model can only be forked on a single rank')
+
+    if workers is None:
+        workers = os.cpu_count()
+
+    # The replicates write their own stats, so the parent's (empty) stats file, if any, is removed
+    Statistics.getInstance().discard()
+
+    sys.stdout.flush()
+
+    # The running children by pid, with the result chunks read so far
+    selector = selectors.DefaultSelector()
+    running = {}
+    results = {}
+    pending = list(enumerate(seeds))
+
+    while pending or running:
+        while pending and len(running) < workers:
+            index, seed = pending.pop(0)
+            read_fd, write_fd = os.pipe()
+
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                status = run_child(model, index, seed, os.path.join(output_dir, f'run_{index}'), write_fd)
+                sys.stdout.flush()
+
+                # Skip the parent's exit handlers, eg MPI finalization
+                os._exit(status)
+
+            os.close(write_fd)
+            running[pid] = (index, seed, [])
+            selector.register(read_fd, selectors.EVENT_READ, pid)
+
+        # A child's result is read to the end before the child is waited for, as a child 
+        #   whose result is larger than the pipe buffer blocks until it is read
+        for key, _ in selector.select():
+            pid = key.data
+            chunk = os.read(key.fd, 65536)
+            if chunk:
+                running[pid][2].append(chunk)
+                continue
+
+            selector.unregister(key.fd)
+            os.close(key.fd)
+
+            index, seed, chunks = running.pop(pid)
+            _, status = os.waitpid(pid, 0)
+
+            message = b''.join(chunks).decode()
+            result = json.loads(message) if message else dict(index=index, seed=seed, error='No result')
+            result['exit_status'] = os.waitstatus_to_exitcode(status)
+            results[index] = result
+
+            printf(f'Replicate {index} (seed {seed}) exited with {result["exit_status"]}')
+
+    selector.close()
+
+    return [results[i] for i in range(len(seeds))]
+
+def run(mpi4py_comm, config_file:str, additional_params:str, seeds:list, workers:int=None) -> list:
+    """ Initialize the model once with the parameters and run a forked replicate of it
+        for each seed.  See fanout().
+    """
+    init_params(config_file, additional_params)
+
+    parameters.params[DATA_DIR] = str(Path(config_file).parent)
+    output_dir = parameters.params[OUTPUT_DIRECTORY]
+
+    hepb_model.reset()
+    model = hepb_model.Model(mpi4py_comm)
+
+    start = timer()
+    results = fanout(model, seeds, output_dir, workers)
+
+    failed = sum(1 for result in results if result['exit_status'] != 0)
+    printf(f'Fan-out of {len(seeds)} replicates finished in {timer() - start:.1f}s, {failed} failed')
+
+    hepb_model.reset()
+
+    return results
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m hepb_model fanout',
+                                     description='Run forked replicates of one initialized HepB model')
+    parser.add_argument('parameters_file', help='the model props file')
+    parser.add_argument('parameters', nargs='?', default='{}', help='JSON model parameters')
+    parser.add_argument('--seeds', type=int, nargs='+', required=True, help='the seed of each replicate')
+    parser.add_argument('--workers', type=int, help='the maximum number of replicates running at once')
+    args = parser.parse_args(args)
+
+    results = run(MPI.COMM_WORLD, args.parameters_file, args.parameters, args.seeds, args.workers)
+
+    if any(result['exit_status'] != 0 for result in results):
+        raise SystemExit(1)
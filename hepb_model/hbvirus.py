@@ -2,13 +2,20 @@ import math, sys
 import numpy as np
 from mpi4py import MPI
 
-from repast4py import core, schedule, parameters, random, context
-from repast4py.space import DiscretePoint as dpt
+from repast4py import core, schedule, parameters, random
 
-from .hepb_enums import Status
 from .constants import *
-from .hepatocyte import Hepatocyte
-from .hepb_utils import printf, GridNghFinder
+from .hepb_utils import printf
+from .status_counts import StatusCounts
+from .treatment import Treatment
+from .counter_rng import cell_uniforms, tick_generator, STREAM_INFECTION, STREAM_SELECTION, STREAM_ECLIPSE
+
+# Indices of the per tick quantities that are summed across ranks in one collective
+GLOBAL_SUSCEPTIBLE = 0
+GLOBAL_ECLIPSED = 1
+GLOBAL_INFECTED = 2
+GLOBAL_PRODUCTION = 3
+GLOBAL_STATE_SIZE = 4
 
 class HBVirus():
     """HBVirus models the Hep B virus activitiy in the bloodstream.
@@ -19,7 +26,12 @@ class HBVirus():
     Attributes
     ----------
     total_viral_load : int        
-        The HBV viral load on this rank.
+        The HBV viral load on this rank, or the total across ranks in the rank
+        invariant mode.
+    rank_invariant : bool
+        If True the run does not depend on the number of ranks, see infect_rank_invariant()
+    treatment : Treatment
+        Reduces the virus released by the infected cells
 
     
     
@@ -29,32 +41,63 @@ class HBVirus():
 
 
 
-    def __init__(self, rank:int, comm: MPI.Intracomm, context:context.SharedContext) -> None:
+    def __init__(self, rank:int, comm: MPI.Intracomm, cells) -> None:
+        """Constructor
+
+        Parameters
+        ----------
+        rank : int
+            the rank of this HBVirus instance
+        comm : MPI.Intracomm
+            the MPI communicator of the model
+        cells : HepatocyteAgents or HepatocyteArray
+            the hepatocyte engine that holds the cells on this rank
+        """
         self.rank = rank
         self.comm = comm
-        self.context = context
+        self.cells = cells
 
         world_size = comm.Get_size()
 
+        # In the rank invariant mode each rank keeps the exact total viral load, and infects
+        #   its share of the cells that are selected from all cells, instead of splitting the
+        #   viral load between ranks that then infect their own cells independently.
+        self.rank_invariant = parameters.params.get(RANK_INVARIANT, False)
+        if self.rank_invariant:
+            world_size = 1
+            self.seed = parameters.params['random.seed']
+            self.total_cells = parameters.params[GRID_WIDTH] * parameters.params[GRID_HEIGHT]
+            self.total_susceptible = self.total_cells
+
+        # The viral load is shared equally across world_size ranks
+        self.viral_load_share = world_size
+
         # The total viral load in the blood, sum across all ranks
         self.total_viral_load = parameters.params[INITIAL_VIRAL_LOAD] / world_size
 
         self.proportion_infectious_virus = parameters.params[INFECTIOUS_VIRUS_FIRST_DAY]
         self.viral_infection_rate = parameters.params[VIRAL_INFECTION_RATE]
 
+        self.treatment = Treatment()
+
         # Viral load production on this rank
         self.local_viral_load_production = 0
 
+        # The per tick local state, and its sum across ranks, see update_viral_load()
+        self.local_state = np.zeros(GLOBAL_STATE_SIZE, dtype=np.int64)
+        self.global_state = np.zeros(GLOBAL_STATE_SIZE, dtype=np.int64)
+        self.reduce_request = None
+
+        # Snapshot of the local status counts at the start of the tick
         self.local_susceptible = 0
         self.local_eclipsed = 0
         self.local_infected = 0
 
-        self.grid = self.context.get_projection('grid')
+        # Check the maintained counters against a full recount of the cells every tick
+        self.check_counts = parameters.params.get(DEBUG_CHECK_COUNTS, False)
 
-        grid_height = parameters.params[GRID_HEIGHT]
-        grid_width = parameters.params[GRID_WIDTH]
-
-        self.ngh_finder = GridNghFinder(0, 0, grid_width, grid_height)
+        # The multipass pipeline recounts the cells instead of using the counters
+        self.multipass = parameters.params.get(TICK_PIPELINE, PIPELINE_FUSED) == PIPELINE_MULTIPASS
 
     
     # def step(self) -> None:
@@ -63,22 +106,53 @@ class HBVirus():
 
     #     self.update_viral_load();
 
+    @property
+    def counts(self) -> StatusCounts:
+        """ The live counters of the local cells in each status
+        """
+        return StatusCounts.getInstance()
+
+    @property
+    def susceptible(self) -> int:
+        return StatusCounts.getInstance().susceptible
+
+    @property
+    def eclipsed(self) -> int:
+        return StatusCounts.getInstance().eclipsed
+
+    @property
+    def infected(self) -> int:
+        return StatusCounts.getInstance().infected
+
     def log_cell_counts(self) -> None:
         """ Log the *local* counts of each Hepatocyte status type
 
         """
-        self.local_cells = self.context.size([Hepatocyte.ID])[Hepatocyte.ID]
+        self.local_cells = self.cells.size()
 
-        self.local_susceptible = 0
-        self.local_eclipsed = 0
-        self.local_infected = 0
-        for hepatocyte in self.context.agents(Hepatocyte.ID):
-            if hepatocyte.status == Status.SUSCEPTIBLE:
-                self.local_susceptible += 1
-            elif hepatocyte.status == Status.ECLIPSED:
-                self.local_eclipsed += 1
-            elif hepatocyte.status == Status.INFECTED:
-                self.local_infected += 1
+        if self.multipass:
+            self.local_susceptible, self.local_eclipsed, self.local_infected = self.cells.count_statuses()
+            return
+
+        self.local_susceptible, self.local_eclipsed, self.local_infected = self.counts.as_tuple()
+
+        if self.check_counts:
+            self.check_cell_counts()
+
+    def check_cell_counts(self) -> None:
+        """ Compare the maintained status counters with a full recount of the local cells
+        """
+        recount = self.cells.count_statuses()
+
+        if recount != self.counts.as_tuple():
+            raise RuntimeError(f'Status counters {self.counts.as_tuple()} do not match the recount '
+                               f'{recount} (susceptible, eclipsed, infected) on rank {self.rank}')
+
+    def global_viral_load(self):
+        """ The total viral load across all ranks
+        """
+        # NOTE just multiply one rank x world size since viral load is shared across ranks
+        return self.total_viral_load * self.viral_load_share
 
     def infect(self) -> None:
         """ infect susciptible hepatocytes - if there are any
@@ -86,50 +160,75 @@ class HBVirus():
    
         """
 
-        # NOTE the AnyLogic implementation does not infect nearest neighbors like the Mason version.
-        # TODO add to model properties
-        infect_neighbors = False
+        if self.rank_invariant:
+            self.infect_rank_invariant()
+            return
 
         # get heptocytes to infect- this method determine the number of hepatocyte to infect
         n = self.determine_number_to_infect()
         
-        # Get a shuffled list of random heptocytes to try and infect (eclipse)
-        random_hepatocytes = self.context.agents(Hepatocyte.ID, count = n, shuffle = True)
-
-        # For each randomly selected HC, if its susceptible, then infect it, otherwise if the HC
-        #   is already infected, select up to 2 random neighbors and infect them.
-        for hepatcyte in random_hepatocytes:
-            if hepatcyte.status == Status.SUSCEPTIBLE:
-                hepatcyte.eclipsed()
-            else:
-                if infect_neighbors:
-                    pt = self.grid.get_location(hepatcyte)
-                    nghs = self.ngh_finder.find(pt.x, pt.y)  # include_origin=True)
-                    # print(f'Search origin: {pt.x}, {pt.y}. Radius: {nghs}')
-
-                    at = dpt(0, 0)
-                    susceptible_neighs = []
-                    for ngh in nghs:
-                        at._reset_from_array(ngh)
-                        # NOTE We expect that all agents are Hepatocyte, so no need to check type
-                        for hc in self.grid.get_agents(at):
-                            if hc.status == Status.SUSCEPTIBLE:
-                                susceptible_neighs.append(hc)
-
-                    if len(susceptible_neighs) > 0:
-                        selected = random.default_rng.choice(susceptible_neighs, 2)
-                        for hc in selected:
-                            # print(f'Infected neighbor: {hc}')
-                            hc.eclipsed()
+        self.cells.infect(n)
+
+
+    def infect_rank_invariant(self) -> None:
+        """ Infect susceptible hepatocytes independently of the number of ranks.
+
+            The number of cells to infect is determined from the total viral load and the
+            susceptible ratio over all cells, and how many of the selected cells are susceptible
+            is drawn from a generator shared by all ranks.  Those cells are the susceptible 
+            cells with the smallest random keys, where each key depends only on the seed, the 
+            tick and the global cell id, and the eclipse times are drawn the same way.
+        """
+        tick = int(schedule.runner().tick())
+
+        n = min(self.determine_number_to_infect(), self.total_cells)
+        if n <= 0 or self.total_susceptible == 0:
+            return
+
+        rng = tick_generator(self.seed, STREAM_INFECTION, tick)
+        k = int(rng.hypergeometric(self.total_susceptible, self.total_cells - self.total_susceptible, n))
+        self.total_susceptible -= k
+        if k == 0:
+            return
+
+        pool = self.cells.susceptible_pool
+        keys = cell_uniforms(self.seed, STREAM_SELECTION, tick, self.cells.gids[pool.items[:pool.size]])
+
+        # Only the k smallest local keys can be among the k smallest of all keys
+        if k < len(keys):
+            candidates = np.argpartition(keys, k - 1)[:k]
+        else:
+            candidates = np.arange(len(keys))
+        candidate_keys = keys[candidates]
 
+        if self.comm.Get_size() > 1:
+            all_keys = np.concatenate(self.comm.allgather(candidate_keys))
+        else:
+            all_keys = candidate_keys
+
+        if k < len(all_keys):
+            threshold = np.partition(all_keys, k - 1)[k - 1]
+            candidates = candidates[candidate_keys <= threshold]
+
+        cells = pool.remove_at(candidates)
+
+        eclipse_min = parameters.params[ECLIPSED_TO_INFECTED_PHASE_TRANSITION_MIN]
+        eclipse_max = parameters.params[ECLIPSED_TO_INFECTED_PHASE_TRANSITION_MAX]
+        u = cell_uniforms(self.seed, STREAM_ECLIPSE, tick, self.cells.gids[cells])
+        eclipse_times = eclipse_min + np.floor(u * (eclipse_max - eclipse_min)).astype(np.int64)
+
+        self.cells.eclipse_cells(cells, eclipse_times)
 
     def determine_number_to_infect(self) -> int:
-        total_cells = self.context.size([Hepatocyte.ID])[Hepatocyte.ID]
+        total_cells = self.cells.size()
         
-        total_susceptible = 0
-        for hepatocyte in self.context.agents(Hepatocyte.ID):
-            if hepatocyte.status == Status.SUSCEPTIBLE:
-                total_susceptible += 1
+        if self.rank_invariant:
+            total_cells = self.total_cells
+            total_susceptible = self.total_susceptible
+        elif self.multipass:
+            total_susceptible, _, _ = self.cells.count_statuses()
+        else:
+            total_susceptible = self.susceptible
 
         ratio_susceptible =  total_susceptible / total_cells
 
@@ -166,73 +265,95 @@ class HBVirus():
 
         
     def update_viral_load(self) -> None:
+        """ Harvest the local viral load production and start the reduction of the
+            per tick global state across ranks.  The local status counts and production
+            are packed into one int64 buffer and summed with a single non-blocking
+            Allreduce, which completes in complete_viral_load_update() so that the
+            communication overlaps with the local hepatocyte update.
+        """
         tick = schedule.runner().tick()
 
         if tick > 0:
             self.new_viral_load_production()
-            
-            # TODO check if schedule priority is better than using MPI barrier
-            self.comm.Barrier()
+        else:
+            self.local_viral_load_production = 0
 
-            # Sum the local viral load production across all ranks, storing the result in rank 0
-            sum_loads = np.zeros(1, dtype='i') # The sum across ranks
-            self.comm.Reduce(np.array([self.local_viral_load_production], dtype='i'), sum_loads, op=MPI.SUM, root=0)
+        self.local_state[GLOBAL_SUSCEPTIBLE] = self.local_susceptible
+        self.local_state[GLOBAL_ECLIPSED] = self.local_eclipsed
+        self.local_state[GLOBAL_INFECTED] = self.local_infected
+        self.local_state[GLOBAL_PRODUCTION] = self.local_viral_load_production
 
-            # TODO check if this can be used instead of Bcast
-            # self.comm.Allreduce()
+        if self.comm.Get_size() == 1:
+            self.global_state[:] = self.local_state
+        else:
+            self.reduce_request = self.comm.Iallreduce(self.local_state, self.global_state, op=MPI.SUM)
 
-            sum_local_viral_load_production = sum_loads[0]
-            
-            # Update the total (blood) viral load including temporal degredation just on one rank,
-            #    then broadcast it to all other ranks.
-            if self.rank == 0:
-                # printf(f'rank {self.rank}, sum local viral load: {sum_local_viral_load_production}')
-                deg_infe = math.floor(self.total_viral_load * self.degrade_viral_load_rate() )
-                self.total_viral_load = deg_infe + sum_local_viral_load_production
-                
-                world_size = self.comm.Get_size()
-                self.total_viral_load = self.total_viral_load / world_size
-
-                data = np.array([self.total_viral_load], dtype='i')
-            else:
-                data = np.zeros(1, dtype='i')
-
-            # Broadcast the total viral load calculated on rank 0 to all other ranks
-            self.comm.Bcast(data, root=0)
+    def wait_for_reduction(self) -> None:
+        """ Wait for the reduction started in update_viral_load(), if not done yet
+        """
+        if self.reduce_request is not None:
+            self.reduce_request.Wait()
+            self.reduce_request = None
+
+    def complete_viral_load_update(self) -> None:
+        """ Wait for the reduction started in update_viral_load() and update the total 
+            (blood) viral load including temporal degredation.  Every rank computes the 
+            same value from the reduced production, so no broadcast is needed.
+        """
+        self.wait_for_reduction()
+
+        tick = schedule.runner().tick()
+
+        if tick > 0:
+            sum_local_viral_load_production = int(self.global_state[GLOBAL_PRODUCTION])
+
+            # The virus released under treatment, the same on every rank
+            sum_local_viral_load_production = self.treatment.release(tick, sum_local_viral_load_production, 
+                                                                     parameters.params['random.seed'])
+
+            # printf(f'rank {self.rank}, sum local viral load: {sum_local_viral_load_production}')
+            deg_infe = math.floor(self.total_viral_load * self.degrade_viral_load_rate() )
+            total_viral_load = deg_infe + sum_local_viral_load_production
             
-            self.total_viral_load = data[0]
+            # The viral load is shared equally across ranks
+            self.total_viral_load = total_viral_load // self.viral_load_share
         
             # if (self.rank == 0):
             # printf(f'Total viral load: {self.total_viral_load}, rank: {self.rank}')
 
- 
-    def new_viral_load_production(self) -> None:
-        """ Calculate the local viral load production on each rank
-            Then sum accross ranks
+    def get_state(self) -> dict:
+        """ The viral load state carried from one tick to the next, see checkpoint
         """
-        viral_load = 0
-        
-        for hepatocyte in self.context.agents(Hepatocyte.ID):
-            viral_load += hepatocyte.viral_load_produced
+        state = {'total_viral_load': self.total_viral_load,
+                 'proportion_infectious_virus': self.proportion_infectious_virus}
+        if self.rank_invariant:
+            state['total_susceptible'] = self.total_susceptible
 
-            # to avoid double counting, once the newly produced virus is counted, 
-            # set the value to zero. the idea is once the viirus is relased froom 
-            # the cell, it is no more in the cell but in the blook stream.
-            hepatocyte.viral_load_produced = 0
-
-        # TODO check for sync issues if all ranks will use the current local_viral_load_value
-        self.local_viral_load_production = int(viral_load)
-
-        # printf(f'rank {self.rank}, local viral load: {self.local_viral_load_production}')
+        return state
 
-        # load = np.zeros(1, dtype='float64')
+    def set_state(self, state:dict) -> None:
+        self.total_viral_load = state['total_viral_load']
+        self.proportion_infectious_virus = state['proportion_infectious_virus']
+        if self.rank_invariant:
+            self.total_susceptible = state['total_susceptible']
 
-        # self.comm.Reduce(np.array([self.local_viral_load], dtype='float64'), load, op=MPI.SUM, root=0)
+    @property
+    def global_susceptible(self) -> int:
+        return int(self.global_state[GLOBAL_SUSCEPTIBLE])
 
-        # printf(f'rank {self.rank} , local viral load: {self.local_viral_load}, total viral load {self.total_viral_load}')
+    @property
+    def global_eclipsed(self) -> int:
+        return int(self.global_state[GLOBAL_ECLIPSED])
 
-        # return int(viral_load)
+    @property
+    def global_infected(self) -> int:
+        return int(self.global_state[GLOBAL_INFECTED])
 
-        
+    def new_viral_load_production(self) -> None:
+        """ Calculate the local viral load production on each rank
+            Then sum accross ranks
+        """
+        # TODO check for sync issues if all ranks will use the current local_viral_load_value
+        self.local_viral_load_production = self.cells.harvest_viral_load()
 
-        
\ No newline at end of file
+        # printf(f'rank {self.rank}, local viral load: {self.local_viral_load_production}')
@@ -5,15 +5,21 @@
 # 
 
 import math
+import numpy as np
 
 from repast4py import core, schedule, parameters, random
 from repast4py.network import DirectedSharedNetwork
 from repast4py.schedule import PriorityType
+from repast4py.space import DiscretePoint as dpt
 
 #from .model_statistics import Statistics, LogType
 from .constants import *
-from .hepb_enums import Status
+from .hepb_enums import Status, StatusCode
 from .distributions import Distributions
+from .event_calendar import EventCalendar
+from .status_counts import StatusCounts
+from .kinetics import ProductionKinetics
+from .hepb_utils import IndexPool, sample_infections, prefixed, unprefixed
 
 class Hepatocyte(core.Agent):
 
@@ -83,14 +89,33 @@ class Hepatocyte(core.Agent):
         if self.status == Status.INFECTED:
             self.produce_virus()
 
-    def eclipsed(self) -> None:
-        """ Set the cell status to Eclipsed phase
+    def schedule_at(self, tick) -> None:
+        """ Add this cell to the event calendar (if used) to step at the tick
         """
+        calendar = EventCalendar.getInstance()
+        if calendar is not None:
+            calendar.schedule(tick, self.hepb_id)
+
+    def eclipsed(self, eclipse_time:int=None) -> None:
+        """ Set the cell status to Eclipsed phase, for the eclipse time if given, 
+            otherwise for a random eclipse time.
+        """
+        counts = StatusCounts.getInstance()
+        if self.status == Status.SUSCEPTIBLE:
+            counts.susceptible -= 1
+            counts.eclipsed += 1
+        elif self.status == Status.INFECTED:
+            counts.infected -= 1
+            counts.eclipsed += 1
+
         self.status = Status.ECLIPSED
-        eclipse_time = Distributions().getInstance().get_random_eclipse_time()
+        if eclipse_time is None:
+            eclipse_time = Distributions.getInstance().get_random_eclipse_time()
         self.eclipsed_phase_period = schedule.runner().tick() + eclipse_time
         self.viral_load_produced = 0
 
+        self.schedule_at(self.eclipsed_phase_period)
+
     def eclipsed_to_infected_phase_transition(self) -> None:
         # If the cell status is Eclipsed and the transition to infected time is now,
         #  then transition to infected phase.
@@ -101,39 +126,15 @@ class Hepatocyte(core.Agent):
             if tick == self.eclipsed_phase_period:
                 self.infected()
                 self.next_production = int(tick + 1)
+                self.schedule_at(self.next_production)
         
         pass
 
     def viral_production_rate(self) -> float:
-        """ Calculate the amount of virus infected cell can produce 
+        """ The amount of virus infected cell can produce in its current production cycle,
+            see kinetics.viral_production_rate()
         """
-        tau = self.first_infectious_status_time
-
-        steepness = parameters.params[VIRAL_PRODUCTION_STEEPNESS_GROWTH_CURVE]
-        alpha = parameters.params[VIRAL_PRODUCTION_CYCLE_MIDPOINT]
-
-        expF = 1 + math.exp(-1 * steepness * (tau - alpha))
-
-        viral_production = parameters.params[VIRAL_PRODUCTION_STEADY_STATE] / expF
-
-        if viral_production < 0:
-            viral_production = 0
-
-        if viral_production > parameters.params[VIRAL_PRODUCTION_STEADY_STATE]:
-            viral_production = parameters.params[VIRAL_PRODUCTION_STEADY_STATE]
-
-        return viral_production
-
-    def production_cycle_power_law(self, cycle:int) -> int:
-        """ Calculate the production cycle
-        """
-
-        power_law_const = parameters.params[VIRAL_PROD_CYCLE_POWER_LAW_CONSTANT]
-        power_law_exp = parameters.params[VIRAL_PROD_CYCLE_POWER_LAW_EXPONENT]
-
-        x = power_law_const * math.exp(-1.0 * cycle * power_law_exp)
-
-        return math.ceil(x)
+        return ProductionKinetics.getInstance().rate_at(self.first_infectious_status_time)
 
     def produce_virus(self) -> None:
         # if (self.uid_rank == 1):
@@ -142,25 +143,264 @@ class Hepatocyte(core.Agent):
         tick = schedule.runner().tick()
 
         if tick == self.next_production:
-            # this is the amount of virus the hepatcyte can produce right now
-            viral_C = self.viral_production_rate()
+            kinetics = ProductionKinetics.getInstance()
+            cycle = self.first_infectious_status_time
+
+            # the virus the hepatcyte can produce right now, and the time to the next production
+            viral_load = kinetics.virions_at(cycle)
+            next_period = kinetics.interval_at(cycle)
 
-            next_period = self.production_cycle_power_law(self.first_infectious_status_time - 1)
             self.first_infectious_status_time += 1  # add one everytime it produce virus
             
-            if next_period <= 1 : # means production is every next step
-                next_period = 1
-            
             self.next_production = int(tick + next_period)
+            self.schedule_at(self.next_production)
 
-            # if it is less than 1, it means, the production is 1, when it reach to  production time, else, it can be the maximum
-            if viral_C < 1 :
-                self.viral_load_produced = 1
-            else:
-                self.viral_load_produced = int(viral_C)   # Discrete integer virus produced
+            self.viral_load_produced = viral_load   # Discrete integer virus produced
     
 
     def infected(self) -> None:
+        counts = StatusCounts.getInstance()
+        counts.eclipsed -= 1
+        counts.infected += 1
+
         self.first_infectious_status_time = 1
         self.status = Status.INFECTED
         self.eclipsed_phase_period = 0  # Reset to zero
+
+
+class HepatocyteAgents:
+    """The object hepatocyte engine, holding one Hepatocyte agent per local cell.
+
+       The HBVirus instance on each rank uses the engine to count, infect and 
+       harvest the viral production of the local cells, and the model step 
+       advances the cells through the engine.  See HepatocyteArray for the 
+       vectorized alternative with the same interface.
+
+    Attributes
+    ----------
+    context : SharedContext
+        The repast4py context that holds the Hepatocyte agents on this rank, or None
+        when the agents are not added to a context (the index space partition).
+    grid : SharedGrid
+        The grid projection, used by the neighbor infection process, or None with
+        the index space partition.
+    agents : list
+        The local Hepatocyte agents, indexed by hepb_id.
+    fused : bool
+        If True the virus produced by the cells is harvested as they are stepped,
+        instead of in a separate pass over all cells.
+    pending_viral_load : int
+        Virus harvested by the fused step since the last harvest_viral_load().
+    susceptible_pool : IndexPool
+        The hepb_ids of the susceptible cells, used by the hypergeometric sampler.
+    gids : np.ndarray
+        The global cell id (x * gridHeight + y) of each local cell, indexed by hepb_id.
+    """
+
+    def __init__(self, context, grid, agents:list, fused:bool=True, gids:np.ndarray=None):
+        self.context = context
+        self.grid = grid
+        self.agents = agents
+        self.gids = gids
+        self.fused = fused
+        self.pending_viral_load = 0
+
+        self.sampler = parameters.params.get(INFECTION_SAMPLER, SAMPLER_HYPERGEOMETRIC)
+        self.susceptible_pool = IndexPool(len(agents))
+
+        self.infect_neighbors = parameters.params.get(INFECT_NEIGHBORS, False)
+
+        # The GridNghFinder imports numba, so it is only created when the neighbor
+        #   infection first needs it.
+        self._ngh_finder = None
+
+    @property
+    def ngh_finder(self):
+        if self._ngh_finder is None:
+            from .kernels import GridNghFinder
+
+            grid_height = parameters.params[GRID_HEIGHT]
+            grid_width = parameters.params[GRID_WIDTH]
+
+            self._ngh_finder = GridNghFinder(0, 0, grid_width, grid_height)
+
+        return self._ngh_finder
+
+    def size(self) -> int:
+        """ The number of local cells
+        """
+        return len(self.agents)
+
+    def count_statuses(self):
+        """ Count the local cells by status
+
+            Returns
+            -------
+            tuple
+                the number of (susceptible, eclipsed, infected) cells.
+        """
+        susceptible = 0
+        eclipsed = 0
+        infected = 0
+        for hepatocyte in self.agents:
+            if hepatocyte.status == Status.SUSCEPTIBLE:
+                susceptible += 1
+            elif hepatocyte.status == Status.ECLIPSED:
+                eclipsed += 1
+            elif hepatocyte.status == Status.INFECTED:
+                infected += 1
+
+        return susceptible, eclipsed, infected
+
+    def infect(self, n:int) -> None:
+        """ Try to infect n randomly selected local cells.
+        """
+
+        # NOTE the AnyLogic implementation does not infect nearest neighbors like the Mason version.
+        infect_neighbors = self.infect_neighbors
+
+        # Without neighbor infection only the selected susceptible cells matter, so sample 
+        #   those directly instead of shuffling all the cells.
+        if not infect_neighbors and self.sampler == SAMPLER_HYPERGEOMETRIC:
+            distributions = Distributions.getInstance()
+            cells = sample_infections(self.susceptible_pool, len(self.agents), n, distributions)
+            self.eclipse_cells(cells, distributions.get_random_eclipse_time(size=len(cells)))
+            return
+
+        # Get a shuffled list of random heptocytes to try and infect (eclipse)
+        if self.context is not None:
+            random_hepatocytes = self.context.agents(Hepatocyte.ID, count = n, shuffle = True)
+        else:
+            selected = Distributions.getInstance().get_random_selection(len(self.agents), min(n, len(self.agents)))
+            random_hepatocytes = [self.agents[cell] for cell in selected]
+
+        # For each randomly selected HC, if its susceptible, then infect it, otherwise if the HC
+        #   is already infected, select up to 2 random neighbors and infect them.
+        for hepatcyte in random_hepatocytes:
+            if hepatcyte.status == Status.SUSCEPTIBLE:
+                self.eclipse(hepatcyte)
+            else:
+                if infect_neighbors:
+                    pt = self.grid.get_location(hepatcyte)
+                    nghs = self.ngh_finder.find(pt.x, pt.y)  # include_origin=True)
+                    # print(f'Search origin: {pt.x}, {pt.y}. Radius: {nghs}')
+
+                    at = dpt(0, 0)
+                    susceptible_neighs = []
+                    for ngh in nghs:
+                        at._reset_from_array(ngh)
+                        # NOTE We expect that all agents are Hepatocyte, so no need to check type
+                        for hc in self.grid.get_agents(at):
+                            if hc.status == Status.SUSCEPTIBLE:
+                                susceptible_neighs.append(hc)
+
+                    if len(susceptible_neighs) > 0:
+                        selected = random.default_rng.choice(susceptible_neighs, 2)
+                        for hc in selected:
+                            # print(f'Infected neighbor: {hc}')
+                            self.eclipse(hc)
+
+    def eclipse_cells(self, cells:np.ndarray, eclipse_times:np.ndarray) -> None:
+        """ Eclipse the susceptible cells at the indices, that have already been removed 
+            from the susceptible pool, for the eclipse times.
+        """
+        for cell, eclipse_time in zip(cells, eclipse_times):
+            self.agents[cell].eclipsed(int(eclipse_time))
+
+    def eclipse(self, hepatocyte:Hepatocyte) -> None:
+        """ Eclipse the cell and keep the susceptible pool up to date
+        """
+        if hepatocyte.status == Status.SUSCEPTIBLE:
+            self.susceptible_pool.remove(hepatocyte.hepb_id)
+
+        hepatocyte.eclipsed()
+
+    def harvest_viral_load(self) -> int:
+        """ Sum the virus released by the local cells since the last harvest.
+        """
+        if self.fused:
+            viral_load = self.pending_viral_load
+            self.pending_viral_load = 0
+            return viral_load
+
+        viral_load = 0
+        
+        for hepatocyte in self.agents:
+            viral_load += hepatocyte.viral_load_produced
+
+            # to avoid double counting, once the newly produced virus is counted, 
+            # set the value to zero. the idea is once the viirus is relased froom 
+            # the cell, it is no more in the cell but in the blook stream.
+            hepatocyte.viral_load_produced = 0
+
+        return int(viral_load)
+
+    def step(self) -> None:
+        """ Update the Hepatocytes on this rank.  With the event calendar only the 
+            cells that are due at this tick are stepped, otherwise all of them.
+        """
+        calendar = EventCalendar.getInstance()
+
+        if calendar is None:
+            hepatocytes = self.agents
+        else:
+            tick = schedule.runner().tick()
+            hepatocytes = [self.agents[cell] for cell in calendar.pop(tick)]
+
+        if not self.fused:
+            for hepatocyte in hepatocytes:
+                hepatocyte.step()
+            return
+
+        # The fused step also harvests the virus released in the same pass.  Virus produced
+        #   at this tick is only added to the blood viral load at the next tick, so taking
+        #   it now is the same as collecting it in a separate pass at the next tick.
+        viral_load = 0
+        for hepatocyte in hepatocytes:
+            hepatocyte.step()
+            if hepatocyte.viral_load_produced > 0:
+                viral_load += hepatocyte.viral_load_produced
+                hepatocyte.viral_load_produced = 0
+
+        self.pending_viral_load += viral_load
+
+    def get_state(self) -> dict:
+        """ The state of the cells as arrays indexed by hepb_id, see checkpoint
+        """
+        codes = {Status.SUSCEPTIBLE: StatusCode.SUSCEPTIBLE, Status.ECLIPSED: StatusCode.ECLIPSED,
+                 Status.INFECTED: StatusCode.INFECTED}
+
+        state = {'status': np.array([codes[hc.status] for hc in self.agents], dtype=np.int8),
+                 'eclipsed_phase_period': np.array([hc.eclipsed_phase_period for hc in self.agents], dtype=np.float64),
+                 'first_infectious_status_time': np.array([hc.first_infectious_status_time for hc in self.agents], dtype=np.int64),
+                 'next_production': np.array([hc.next_production for hc in self.agents], dtype=np.int64),
+                 'viral_load_produced': np.array([hc.viral_load_produced for hc in self.agents], dtype=np.int64),
+                 'pending_viral_load': self.pending_viral_load}
+        state.update(prefixed('pool.', self.susceptible_pool.get_state()))
+
+        return state
+
+    def set_state(self, state:dict, tick:int) -> None:
+        """ Restore the state of the cells at the end of the tick, and schedule the cells
+            that act at later ticks.
+        """
+        statuses = {StatusCode.SUSCEPTIBLE: Status.SUSCEPTIBLE, StatusCode.ECLIPSED: Status.ECLIPSED,
+                    StatusCode.INFECTED: Status.INFECTED}
+
+        for hc, status, period, cycle, next_production, produced in zip(self.agents, 
+                state['status'].tolist(), state['eclipsed_phase_period'].tolist(), 
+                state['first_infectious_status_time'].tolist(), state['next_production'].tolist(),
+                state['viral_load_produced'].tolist()):
+            hc.status = statuses[status]
+            hc.eclipsed_phase_period = period
+            hc.first_infectious_status_time = cycle
+            hc.next_production = next_production
+            hc.viral_load_produced = produced
+
+            if hc.status == Status.ECLIPSED and period > tick:
+                hc.schedule_at(period)
+            elif hc.status == Status.INFECTED:
+                hc.schedule_at(next_production)
+
+        self.pending_viral_load = int(state['pending_viral_load'])
+        self.susceptible_pool.set_state(unprefixed('pool.', state))
@@ -0,0 +1,354 @@
+# This file is part of the HepB Model
+#
+# Structure-of-arrays Hepatocyte engine
+#
+#
+
+import numpy as np
+from mpi4py import MPI
+
+from repast4py import schedule, parameters, random
+
+from .constants import *
+from .hepb_enums import StatusCode
+from .distributions import Distributions
+from .event_calendar import EventCalendar
+from .status_counts import StatusCounts
+from .hepb_utils import IndexPool, sample_infections, prefixed, unprefixed
+from .kinetics import ProductionKinetics
+
+class HepatocyteArray:
+    """HepatocyteArray holds the state of all local Hepatocytes as NumPy arrays.
+
+       This is the vectorized alternative to the object engine (one Hepatocyte
+       agent per cell) and is selected with hepatocyte.engine = array.  The cell
+       behaviors are the same as in Hepatocyte, but run as array operations over
+       all the cells on this rank.  Cell i on this rank is stored at index i of
+       each array.
+
+    Attributes
+    ----------
+    status : np.ndarray (int8)
+        StatusCode of each cell
+    eclipsed_phase_period : np.ndarray (int64)
+        tick when an eclipsed cell becomes infected
+    first_infectious_status_time : np.ndarray (int64)
+        production cycle counter of an infected cell
+    next_production : np.ndarray (int64)
+        tick of the next virus production of an infected cell
+    viral_load_produced : np.ndarray (int64)
+        virus produced by each cell since the last harvest
+    fused : bool
+        If True the produced virus is summed as it is produced, instead of 
+        stored per cell and summed in a separate pass.
+    pending_viral_load : int
+        Virus summed by the fused step since the last harvest_viral_load().
+    susceptible_pool : IndexPool
+        The indices of the susceptible cells, used by the hypergeometric sampler.
+    gids : np.ndarray
+        The global cell id (x * gridHeight + y) of each local cell.
+    infect_neighbors : bool
+        If True selected cells that are not susceptible infect their neighbors.
+    raster : np.ndarray (int8)
+        With neighbor infection, the status of the local grid columns plus a ghost 
+        column on each side with the status of the neighboring ranks' edge columns.
+        status is a view of the local columns.
+    """
+
+    def __init__(self, n:int, rank:int, fused:bool=True, gids:np.ndarray=None, comm=None):
+        """Constructor
+
+        Parameters
+        ----------
+        n : int
+            number of cells on this rank
+        rank : int
+            rank on which the cells are created
+        fused : bool
+            harvest the produced virus during the step
+        gids : np.ndarray
+            the global cell id of each cell
+        comm : mpi4py.MPI.Intracomm
+            the communicator for the neighbor infection ghost columns
+        """
+        self.rank = rank
+        self.n = n
+        self.gids = gids
+        self.fused = fused
+        self.pending_viral_load = 0
+
+        self.sampler = parameters.params.get(INFECTION_SAMPLER, SAMPLER_HYPERGEOMETRIC)
+        self.susceptible_pool = IndexPool(n)
+
+        self.comm = comm
+        self.infect_neighbors = parameters.params.get(INFECT_NEIGHBORS, False)
+
+        if self.infect_neighbors:
+            # The kernels import numba, so only when the neighbor infection is used
+            from .kernels import NO_CELL
+
+            # The neighbor infection kernel needs the local cells to be whole grid columns
+            self.height = parameters.params[GRID_HEIGHT]
+            if n % self.height != 0 or gids[0] % self.height != 0:
+                raise ValueError(f'{INFECT_NEIGHBORS} with the array engine needs space.partition: {PARTITION_INDEX}')
+
+            self.xmin = int(gids[0]) // self.height
+            self.columns = n // self.height
+
+            self.raster = np.full((self.columns + 2, self.height), NO_CELL, dtype=np.int8)
+            self.raster[1:-1] = StatusCode.SUSCEPTIBLE
+            self.status = self.raster[1:-1].reshape(-1)
+        else:
+            self.status = np.full(n, StatusCode.SUSCEPTIBLE, dtype=np.int8)
+        self.eclipsed_phase_period = np.zeros(n, dtype=np.int64)
+        self.first_infectious_status_time = np.zeros(n, dtype=np.int64)
+        self.next_production = np.zeros(n, dtype=np.int64)
+        self.viral_load_produced = np.zeros(n, dtype=np.int64)
+
+    def size(self) -> int:
+        """ The number of local cells
+        """
+        return self.n
+
+    def count_statuses(self):
+        """ Count the local cells by status
+
+            Returns
+            -------
+            tuple
+                the number of (susceptible, eclipsed, infected) cells.
+        """
+        counts = np.bincount(self.status, minlength=len(StatusCode))
+
+        return (int(counts[StatusCode.SUSCEPTIBLE]), int(counts[StatusCode.ECLIPSED]),
+                int(counts[StatusCode.INFECTED]))
+
+    def infect(self, n:int) -> None:
+        """ Try to infect n randomly selected local cells.  As in the object engine,
+            only the selected cells that are susceptible are eclipsed.
+        """
+        if self.infect_neighbors:
+            self.infect_with_neighbors(n)
+            return
+
+        if self.sampler == SAMPLER_HYPERGEOMETRIC:
+            self.eclipsed(sample_infections(self.susceptible_pool, self.n, n, Distributions.getInstance()))
+            return
+
+        n = min(n, self.n)
+
+        selected = Distributions.getInstance().get_random_selection(self.n, n)
+        selected = selected[self.status[selected] == StatusCode.SUSCEPTIBLE]
+
+        for cell in selected:
+            self.susceptible_pool.remove(cell)
+
+        self.eclipsed(selected)
+
+    def infect_with_neighbors(self, n:int) -> None:
+        """ Try to infect n randomly selected local cells, and for each selected cell that
+            is not susceptible, two of its susceptible neighbors, which can be on a 
+            neighboring rank.  See kernels.infect_with_neighbors().
+        """
+        from .kernels import infect_with_neighbors
+
+        distributions = Distributions.getInstance()
+
+        n = min(n, self.n)
+
+        self.exchange_ghost_columns()
+
+        selected = distributions.get_random_selection(self.n, n)
+        uniforms = distributions.get_random_uniforms((n, 2))
+
+        cells, ghosts = infect_with_neighbors(self.raster, selected, uniforms, 
+                                              StatusCode.SUSCEPTIBLE, StatusCode.ECLIPSED)
+        
+        remote = self.exchange_neighbor_infections(ghosts)
+        if len(remote) > 0:
+            remote = np.unique(remote[self.status[remote] == StatusCode.SUSCEPTIBLE])
+            cells = np.concatenate((cells, remote))
+
+        for cell in cells:
+            self.susceptible_pool.remove(cell)
+
+        self.eclipsed(cells)
+
+    def neighbor_ranks(self):
+        """ The ranks with the grid columns left and right of the local columns
+        """
+        left = self.rank - 1 if self.xmin > 0 else MPI.PROC_NULL
+        right = self.rank + 1 if self.xmin + self.columns < parameters.params[GRID_WIDTH] else MPI.PROC_NULL
+
+        return left, right
+
+    def exchange_ghost_columns(self) -> None:
+        """ Copy the edge columns of the neighboring ranks into the raster ghost columns
+        """
+        if self.comm is None or self.comm.Get_size() == 1:
+            return
+
+        left, right = self.neighbor_ranks()
+
+        self.comm.Sendrecv(self.raster[1], dest=left, recvbuf=self.raster[-1], source=right)
+        self.comm.Sendrecv(self.raster[-2], dest=right, recvbuf=self.raster[0], source=left)
+
+    def exchange_neighbor_infections(self, ghosts:np.ndarray) -> np.ndarray:
+        """ Send the ghost cells infected by the local cells to the ranks that own them,
+            and return the local cells infected by the neighboring ranks.
+        """
+        if self.comm is None or self.comm.Get_size() == 1:
+            return np.zeros(0, dtype=np.int64)
+
+        left, right = self.neighbor_ranks()
+
+        # As global cell ids, column 0 of the raster is grid column xmin - 1
+        column = ghosts // self.height
+        gids = (self.xmin - 1 + column) * self.height + ghosts % self.height
+        to_left = gids[column == 0]
+        to_right = gids[column != 0]
+
+        from_right = self.comm.sendrecv(to_left, dest=left, source=right)
+        from_left = self.comm.sendrecv(to_right, dest=right, source=left)
+
+        received = [r for r in (from_left, from_right) if r is not None]
+        if len(received) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        return np.concatenate(received) - self.xmin * self.height
+
+    def eclipse_cells(self, cells:np.ndarray, eclipse_times:np.ndarray) -> None:
+        """ Eclipse the susceptible cells at the indices, that have already been removed 
+            from the susceptible pool, for the eclipse times.
+        """
+        self.eclipsed(cells, eclipse_times)
+
+    def eclipsed(self, cells:np.ndarray, eclipse_time:np.ndarray=None) -> None:
+        """ Set the status of the susceptible cells at the indices to Eclipsed phase, for
+            the eclipse times if given, otherwise for random eclipse times.
+        """
+        if len(cells) == 0:
+            return
+
+        counts = StatusCounts.getInstance()
+        counts.susceptible -= len(cells)
+        counts.eclipsed += len(cells)
+
+        tick = int(schedule.runner().tick())
+        if eclipse_time is None:
+            eclipse_time = Distributions.getInstance().get_random_eclipse_time(size=len(cells))
+
+        self.status[cells] = StatusCode.ECLIPSED
+        self.eclipsed_phase_period[cells] = tick + eclipse_time
+        self.viral_load_produced[cells] = 0
+
+        calendar = EventCalendar.getInstance()
+        if calendar is not None:
+            calendar.schedule_cells(self.eclipsed_phase_period[cells], cells)
+
+    def step(self) -> None:
+        """ Vectorized Hepatocyte.step() for the cells on this rank.  With the event 
+            calendar only the cells that are due at this tick are checked, otherwise all of them.
+        """
+        tick = int(schedule.runner().tick())
+
+        calendar = EventCalendar.getInstance()
+
+        if calendar is None:
+            cells = np.arange(self.n)
+        else:
+            cells = calendar.pop_cells(tick)
+
+        # Eclipsed cells whose transition time is now become infected
+        due = cells[(self.status[cells] == StatusCode.ECLIPSED) & (self.eclipsed_phase_period[cells] == tick)]
+        self.infected(due)
+        self.next_production[due] = tick + 1
+
+        producing = cells[(self.status[cells] == StatusCode.INFECTED) & (self.next_production[cells] == tick)]
+        self.produce_virus(producing, tick)
+
+        if calendar is not None:
+            if len(due) > 0:
+                calendar.schedule(tick + 1, due)
+            calendar.schedule_cells(self.next_production[producing], producing)
+
+    def infected(self, cells:np.ndarray) -> None:
+        counts = StatusCounts.getInstance()
+        counts.eclipsed -= len(cells)
+        counts.infected += len(cells)
+
+        self.first_infectious_status_time[cells] = 1
+        self.status[cells] = StatusCode.INFECTED
+        self.eclipsed_phase_period[cells] = 0  # Reset to zero
+
+    def produce_virus(self, cells:np.ndarray, tick:int) -> None:
+        """ Produce virus from the infected cells at the indices, whose next
+            production is at this tick.
+        """
+        if len(cells) == 0:
+            return
+
+        kinetics = ProductionKinetics.getInstance()
+        cycle = np.minimum(self.first_infectious_status_time[cells], kinetics.last_cycle)
+
+        self.first_infectious_status_time[cells] += 1  # add one everytime it produce virus
+        self.next_production[cells] = tick + kinetics.interval[cycle]
+
+        produced = kinetics.virions[cycle]   # Discrete integer virus produced
+
+        if self.fused:
+            self.pending_viral_load += int(produced.sum())
+        else:
+            self.viral_load_produced[cells] = produced
+
+    def harvest_viral_load(self) -> int:
+        """ Sum the virus released by the local cells since the last harvest.
+        """
+        if self.fused:
+            viral_load = self.pending_viral_load
+            self.pending_viral_load = 0
+            return viral_load
+
+        viral_load = int(self.viral_load_produced.sum())
+
+        # to avoid double counting, once the newly produced virus is counted, set it to zero
+        self.viral_load_produced[:] = 0
+
+        return viral_load
+
+    def get_state(self) -> dict:
+        """ The state of the cells, see checkpoint
+        """
+        state = {'status': self.raster if self.infect_neighbors else self.status,
+                 'eclipsed_phase_period': self.eclipsed_phase_period,
+                 'first_infectious_status_time': self.first_infectious_status_time,
+                 'next_production': self.next_production,
+                 'viral_load_produced': self.viral_load_produced,
+                 'pending_viral_load': self.pending_viral_load}
+        state.update(prefixed('pool.', self.susceptible_pool.get_state()))
+
+        return state
+
+    def set_state(self, state:dict, tick:int) -> None:
+        """ Restore the state of the cells at the end of the tick, and schedule the cells
+            that act at later ticks.
+        """
+        if self.infect_neighbors:
+            self.raster[:] = state['status']
+        else:
+            self.status[:] = state['status']
+
+        self.eclipsed_phase_period[:] = state['eclipsed_phase_period']
+        self.first_infectious_status_time[:] = state['first_infectious_status_time']
+        self.next_production[:] = state['next_production']
+        self.viral_load_produced[:] = state['viral_load_produced']
+        self.pending_viral_load = int(state['pending_viral_load'])
+        self.susceptible_pool.set_state(unprefixed('pool.', state))
+
+        calendar = EventCalendar.getInstance()
+        if calendar is not None:
+            eclipsed = np.nonzero((self.status == StatusCode.ECLIPSED) & (self.eclipsed_phase_period > tick))[0]
+            calendar.schedule_cells(self.eclipsed_phase_period[eclipsed], eclipsed)
+
+            infected = np.nonzero(self.status == StatusCode.INFECTED)[0]
+            calendar.schedule_cells(self.next_production[infected], infected)
@@ -0,0 +1,182 @@
+# This file is part of the HepB Model
+#
+# Aggregate (cohort) Hepatocyte engine
+#
+#
+
+import numpy as np
+
+from repast4py import schedule
+
+from .constants import *
+from .distributions import Distributions
+from .status_counts import StatusCounts
+from .kinetics import ProductionKinetics
+
+class HepatocyteCohorts:
+    """HepatocyteCohorts holds the local Hepatocytes as counts of cells that share 
+       the same future, instead of as individual cells.
+
+       Without neighbor infection the location of a cell does not matter, and the
+       future of a cell is set by its status, the tick of its next transition and its
+       production cycle.  The engine keeps the number of susceptible cells, the number 
+       of eclipsed cells by the tick they become infected, and the number of infected 
+       cells by the tick of their next production and their production cycle, so a 
+       tick costs O(cohorts) rather than O(cells).
+
+       The infections are drawn as in the hypergeometric sampler: the number of 
+       susceptible cells among the n selected cells is hypergeometric and their eclipse 
+       times are multinomial, so the engine has the same distribution of outcomes as
+       the object and array engines, but not the same random draws.  It is selected 
+       with hepatocyte.engine = cohort.
+
+    Attributes
+    ----------
+    n : int
+        number of cells on this rank
+    susceptible : int
+        number of susceptible cells
+    eclipsed : dict
+        number of eclipsed cells by the tick they become infected
+    infected : dict
+        for each tick, the number of infected cells that produce virus at the tick 
+        by production cycle
+    fused : bool
+        Unused, the produced virus is always summed as it is produced.
+    pending_viral_load : int
+        Virus produced since the last harvest_viral_load().
+    susceptible_pool : None
+        The engine has no individual cells to sample.
+    gids : None
+        The engine has no individual cells.
+    """
+
+    def __init__(self, n:int, rank:int, fused:bool=True):
+        """Constructor
+
+        Parameters
+        ----------
+        n : int
+            number of cells on this rank
+        rank : int
+            rank on which the cells are created
+        fused : bool
+            unused, see fused
+        """
+        self.rank = rank
+        self.n = n
+        self.fused = fused
+        self.pending_viral_load = 0
+
+        self.susceptible_pool = None
+        self.gids = None
+
+        self.susceptible = n
+        self.eclipsed = {}
+        self.infected = {}
+
+    def size(self) -> int:
+        """ The number of local cells
+        """
+        return self.n
+
+    def count_statuses(self):
+        """ Count the local cells by status
+
+            Returns
+            -------
+            tuple
+                the number of (susceptible, eclipsed, infected) cells.
+        """
+        num_eclipsed = sum(self.eclipsed.values())
+        num_infected = sum(sum(cohorts.values()) for cohorts in self.infected.values())
+
+        return self.susceptible, num_eclipsed, num_infected
+
+    def infect(self, n:int) -> None:
+        """ Try to infect n randomly selected local cells, ie eclipse the selected cells
+            that are susceptible.
+        """
+        distributions = Distributions.getInstance()
+
+        n = min(n, self.n)
+        if n <= 0 or self.susceptible == 0:
+            return
+
+        k = distributions.get_hypergeometric(self.susceptible, self.n - self.susceptible, n)
+        if k == 0:
+            return
+
+        tick = int(schedule.runner().tick())
+        counts = distributions.get_random_eclipse_time_counts(k)
+
+        for offset in counts.nonzero()[0]:
+            due = tick + distributions.eclipse_min + int(offset)
+            self.eclipsed[due] = self.eclipsed.get(due, 0) + int(counts[offset])
+
+        self.susceptible -= k
+
+        status_counts = StatusCounts.getInstance()
+        status_counts.susceptible -= k
+        status_counts.eclipsed += k
+
+    def step(self) -> None:
+        """ Infect the eclipsed cells that are due at this tick, and produce virus
+            from the infected cells that are due to produce.
+        """
+        tick = int(schedule.runner().tick())
+
+        # Eclipsed cells whose transition time is now become infected, and produce next tick
+        due = self.eclipsed.pop(tick, 0)
+        if due > 0:
+            status_counts = StatusCounts.getInstance()
+            status_counts.eclipsed -= due
+            status_counts.infected += due
+
+            self.add_producers(tick + 1, 1, due)
+
+        producing = self.infected.pop(tick, None)
+        if producing is None:
+            return
+
+        kinetics = ProductionKinetics.getInstance()
+        for cycle, count in producing.items():
+            self.pending_viral_load += kinetics.virions_at(cycle) * count
+
+            # Cycles past the table behave the same, so they share the last cohort
+            self.add_producers(tick + kinetics.interval_at(cycle), 
+                               min(cycle + 1, kinetics.last_cycle), count)
+
+    def add_producers(self, tick:int, cycle:int, count:int) -> None:
+        cohorts = self.infected.setdefault(tick, {})
+        cohorts[cycle] = cohorts.get(cycle, 0) + count
+
+    def harvest_viral_load(self) -> int:
+        """ Sum the virus released by the local cells since the last harvest.
+        """
+        viral_load = self.pending_viral_load
+        self.pending_viral_load = 0
+        return viral_load
+
+    def get_state(self) -> dict:
+        """ The cohort counts, see checkpoint
+        """
+        infected = [(tick, cycle, count) for tick, cohorts in self.infected.items() 
+                    for cycle, count in cohorts.items()]
+
+        return {'susceptible': self.susceptible,
+                'pending_viral_load': self.pending_viral_load,
+                'eclipsed': np.array(list(self.eclipsed.items()), dtype=np.int64).reshape(-1, 2),
+                'infected': np.array(infected, dtype=np.int64).reshape(-1, 3)}
+
+    def set_state(self, state:dict, tick:int) -> None:
+        """ Restore the cohort counts at the end of the tick
+        """
+        self.susceptible = int(state['susceptible'])
+        self.pending_viral_load = int(state['pending_viral_load'])
+
+        self.eclipsed = {int(due): int(count) for due, count in state['eclipsed']}
+
+        self.infected = {}
+        for due, cycle, count in state['infected'].tolist():
+            self.add_producers(due, cycle, count)
@@ -6,13 +6,19 @@
 #  tuples for each, to support compact logging.
 #
 
-from enum import Enum
+from enum import Enum, IntEnum
 
 class Status(Enum):
     SUSCEPTIBLE = "SUSCEPTIBLE"
     ECLIPSED = "ECLIPSED"
     INFECTED = "INFECTED"
 
+class StatusCode(IntEnum):
+    """Integer codes for Status, used by the array based hepatocyte engines."""
+    SUSCEPTIBLE = 0
+    ECLIPSED = 1
+    INFECTED = 2
+
 class LogType(Enum):
 
     ACTIVATED = "ACTIVATED"
@@ -8,14 +8,12 @@ from mpi4py import MPI
 import sys, os
 
 import numpy as np
-import networkx as nx
 from pathlib import Path
 from datetime import datetime
-# import json
+import json
 import functools
 from timeit import default_timer as timer
 # import pandas as pd 
-import yaml
 
 from repast4py.parameters import init_params
 from repast4py import core, schedule, context, parameters, random, space
@@ -23,14 +21,24 @@ from repast4py.space import BorderType, OccupancyType, GridStickyBorders, GridPe
 from repast4py.space import DiscretePoint as DPt
 
 from .constants import *
-from .hepatocyte import Hepatocyte
+from .hepatocyte import Hepatocyte, HepatocyteAgents
+from .hepatocyte_array import HepatocyteArray
+from .hepatocyte_cohort import HepatocyteCohorts
 from .hbvirus import *
 from .hepb_enums import *
-from .hepb_utils import printf, GridNghFinder
+from .hepb_utils import printf, peak_rss_mb, index_partition_bounds, prefixed, unprefixed
 from .model_statistics import Statistics
 from .distributions import Distributions
+from .event_calendar import EventCalendar
+from .status_counts import StatusCounts
+from .kinetics import ProductionKinetics
+from .ensemble import EnsembleModel, replicate_params
+from .convergence import ConvergenceMonitor
+from .timers import PhaseTimers
+from .checkpoint import write_checkpoint, read_checkpoint, latest_checkpoint_tick
 
 model = None
+result = None
 
 def write_props(dir):
     """Save the model props to a file in the output folder
@@ -41,6 +49,9 @@ def write_props(dir):
             the model output directory
     """
 
+    # Imported here, as yaml is only needed for the output of the props
+    import yaml
+
     fname = os.path.join(dir,'model_props.yaml')
 
     with open(fname, 'w') as f:
@@ -75,16 +86,19 @@ class Model:
         if self.rank == 0:
             printf(f'HepB Model Initialization... Run # {self.run_number}.  Random seed: {parameters.params["random.seed"]}, rand = {d}')
             printf(f'Ranks: {world_size}')
+            printf(f'Hepatocyte engine: {parameters.params.get(HEPATOCYTE_ENGINE, ENGINE_OBJECT)}')
         
-        # Schedule the model step interval and end time
+        # The model step is scheduled once the start tick is known
         self.runner = schedule.init_schedule_runner(comm)
-        self.runner.schedule_repeating_event(1, 1, self.step)
-        self.runner.schedule_stop(parameters.params[RUN_TIME])
         
 
         output_dir = parameters.params[OUTPUT_DIRECTORY]
+
+        # With the stats in memory the run writes no files, see get()
+        self.in_memory = parameters.params.get(STATS_IN_MEMORY, False)
+        self.result = None
         
-        if self.rank == 0:
+        if self.rank == 0 and not self.in_memory:
             if not os.path.exists(output_dir):
                 os.makedirs(output_dir)
 
@@ -93,51 +107,265 @@ class Model:
         tick = schedule.runner().tick()
 
         Distributions() # Initialize Distributions
-        Statistics()    # Initialize Statistics
+
+        # The stats are only recorded on rank 0, the other ranks write no stats file
+        Statistics(in_memory=self.in_memory or self.rank != 0)
+
+        # A cell produces at most once per tick, so no cell gets past cycle runTime
+        ProductionKinetics(parameters.params[RUN_TIME] + 1)
+
+        # The event calendar lets the model step only the cells that are due at each tick,
+        #   the sweep scheduling steps every cell on every tick.
+        scheduling = parameters.params.get(HEPATOCYTE_SCHEDULING, SCHEDULING_CALENDAR)
+        if scheduling == SCHEDULING_CALENDAR:
+            EventCalendar()
+        elif scheduling == SCHEDULING_SWEEP:
+            if EventCalendar.getInstance() is not None:
+                EventCalendar.getInstance().close()
+        else:
+            raise ValueError(f'Unknown {HEPATOCYTE_SCHEDULING}: {scheduling}')
     
         grid_height = parameters.params[GRID_HEIGHT]
         grid_width = parameters.params[GRID_WIDTH]
 
-        box = space.BoundingBox(0, grid_width, 0, grid_height, 0, 0)
+        partition = parameters.params.get(SPACE_PARTITION, PARTITION_GRID)
 
-        self.grid = space.SharedGrid('grid', bounds=box, borders=BorderType.Sticky, 
-                                     occupancy=OccupancyType.Single,
-                                     buffer_size=2, comm=comm)
-        
-        self.context.add_projection(self.grid)
-        
-        local_bounds = self.grid.get_local_bounds()
+        if partition == PARTITION_GRID:
+            box = space.BoundingBox(0, grid_width, 0, grid_height, 0, 0)
+
+            self.grid = space.SharedGrid('grid', bounds=box, borders=BorderType.Sticky, 
+                                         occupancy=OccupancyType.Single,
+                                         buffer_size=2, comm=comm)
+            
+            self.context.add_projection(self.grid)
+            
+            local_bounds = self.grid.get_local_bounds()
+
+        elif partition == PARTITION_INDEX:
+            # Without neighbor infection the cell locations are never queried, so the
+            #   cells are split by column across ranks without a grid or its halo buffers.
+            self.grid = None
+            local_bounds = index_partition_bounds(grid_width, grid_height, self.rank, world_size)
+
+        else:
+            raise ValueError(f'Unknown {SPACE_PARTITION}: {partition}')
 
         # printf(f'rank: {self.rank}, x: {local_bounds.xmin},  {local_bounds.xmin+local_bounds.xextent}')
         # printf(f'rank: {self.rank}, y: {local_bounds.ymin},  {local_bounds.ymin+local_bounds.yextent}')
 
-        # Create the individual Hepatocyte agents and add them to the grid
-        id = 0
-        for i in range(local_bounds.xmin, local_bounds.xmin+local_bounds.xextent):
-            for j in range (local_bounds.ymin, local_bounds.ymin+local_bounds.yextent):
-                hc = Hepatocyte(id, self.rank)
-                self.context.add(hc)
-                self.grid.move(hc, DPt(i,j))
-                id += 1
+        engine = parameters.params.get(HEPATOCYTE_ENGINE, ENGINE_OBJECT)
+
+        pipeline = parameters.params.get(TICK_PIPELINE, PIPELINE_FUSED)
+        if pipeline not in (PIPELINE_FUSED, PIPELINE_MULTIPASS):
+            raise ValueError(f'Unknown {TICK_PIPELINE}: {pipeline}')
+        fused = pipeline == PIPELINE_FUSED
+
+        if parameters.params.get(INFECT_NEIGHBORS, False):
+            if engine == ENGINE_COHORT or parameters.params.get(RANK_INVARIANT, False):
+                raise ValueError(f'{INFECT_NEIGHBORS} needs the cell locations, so it does not support '
+                                 f'the cohort {HEPATOCYTE_ENGINE} or {RANK_INVARIANT}')
+            if engine == ENGINE_OBJECT and self.grid is None:
+                raise ValueError(f'{INFECT_NEIGHBORS} with the object engine needs {SPACE_PARTITION}: {PARTITION_GRID}')
+
+        n = local_bounds.xextent * local_bounds.yextent
+
+        if engine in (ENGINE_ARRAY, ENGINE_OBJECT):
+            # Local cell i is at grid location (xmin + i // yextent, ymin + i % yextent)
+            cells = np.arange(n)
+            xs = local_bounds.xmin + cells // local_bounds.yextent
+            ys = local_bounds.ymin + cells % local_bounds.yextent
+            gids = xs * grid_height + ys
+
+        if engine == ENGINE_ARRAY:
+            self.cells = HepatocyteArray(n, self.rank, fused, gids, comm)
+
+        elif engine == ENGINE_OBJECT:
+            # Create the individual Hepatocyte agents in one batch, and only add them to the
+            #   context and grid when there is a grid for the neighbor infection to query.
+            agents = [Hepatocyte(id, self.rank) for id in range(n)]
+
+            if self.grid is not None:
+                for hc, i, j in zip(agents, xs.tolist(), ys.tolist()):
+                    self.context.add(hc)
+                    self.grid.move(hc, DPt(i,j))
+                agent_context = self.context
+            else:
+                agent_context = None
+
+            self.cells = HepatocyteAgents(agent_context, self.grid, agents, fused, gids)
+
+        elif engine == ENGINE_COHORT:
+            # The local cells are only counted, see HepatocyteCohorts
+            if parameters.params.get(RANK_INVARIANT, False):
+                raise ValueError(f'{RANK_INVARIANT} needs the object or array {HEPATOCYTE_ENGINE}')
+
+            self.cells = HepatocyteCohorts(n, self.rank, fused)
+
+        else:
+            raise ValueError(f'Unknown {HEPATOCYTE_ENGINE}: {engine}')
 
+        # All cells start susceptible
+        StatusCounts(self.cells.size())
 
         # Create the HB Virus agent
 
-        self.hb_virus = HBVirus(self.rank, comm, self.context)
+        self.hb_virus = HBVirus(self.rank, comm, self.cells)
 
         # self.ngh_finder = GridNghFinder(0, 0, box.xextent, box.yextent)
 
         # agent = grid.get_agent(space.DiscretePoint(0, 0))
 
 
-        if self.rank == 0:        
+        if self.rank == 0 and not self.in_memory:
             write_props(output_dir)
+            ProductionKinetics.getInstance().write(output_dir)
 
-        self.runner.schedule_end_event(self.at_end)
+        self.checkpoint_interval = parameters.params.get(CHECKPOINT_INTERVAL, 0)
+        self.checkpoint_dir = parameters.params.get(CHECKPOINT_DIRECTORY)
+        if self.checkpoint_dir is None:
+            self.checkpoint_dir = os.path.join(output_dir, 'checkpoints')
+
+        self.init_observers()
+
+        self.timers = PhaseTimers()
+
+        start_tick = 1
+        if parameters.params.get(CHECKPOINT_RESUME, False):
+            start_tick = self.restore_checkpoint() + 1
+
+        self.schedule_run(start_tick, parameters.params[RUN_TIME])
 
         if self.rank == 0:
             stop = timer()
             printf("Model init time: " + str(stop - start) + "s.")
+            printf(f'Model init memory: {peak_rss_mb():.1f} MB.')
+
+    def reseed(self, seed:int, output_dir:str) -> None:
+        """Start a new replicate of the initialized model, with the random seed and the
+           stats written to the output directory, eg in a forked copy of the model 
+           (see fanout).  The model must not have been run yet.
+        """
+        parameters.params['random.seed'] = seed
+        parameters.params[OUTPUT_DIRECTORY] = output_dir
+
+        random.init(seed)
+
+        # Sample the random instance as in the constructor, so the replicate is the
+        #   same as a model initialized with the seed.
+        random.default_rng.random(10000)
+        random.default_rng.random(1)
+
+        Distributions.getInstance().reset()
+
+        if self.hb_virus.rank_invariant:
+            self.hb_virus.seed = seed
+
+        if self.rank == 0 and not self.in_memory:
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+
+            write_props(output_dir)
+            ProductionKinetics.getInstance().write(output_dir)
+
+        Statistics(output_dir=output_dir, in_memory=self.in_memory or self.rank != 0)
+
+        # Each replicate checkpoints to its own folder, in its output directory or in a 
+        #   subfolder of the checkpoint.directory, and resumes from its own checkpoints
+        checkpoint_dir = parameters.params.get(CHECKPOINT_DIRECTORY)
+        if checkpoint_dir is None:
+            self.checkpoint_dir = os.path.join(output_dir, 'checkpoints')
+        else:
+            self.checkpoint_dir = os.path.join(checkpoint_dir, os.path.basename(os.path.normpath(output_dir)))
+
+        if parameters.params.get(CHECKPOINT_RESUME, False):
+            self.schedule_run(self.restore_checkpoint() + 1, parameters.params[RUN_TIME])
+
+    def schedule_run(self, start_tick:int, stop_tick:int, end:bool=True) -> None:
+        """Schedule the model steps from the start tick to the stop tick on a new schedule 
+           runner, with the at_end() clean up if end, eg to run the model in parts.
+        """
+        self.runner = schedule.init_schedule_runner(self.comm)
+        self.runner.schedule_repeating_event(start_tick, 1, self.step)
+        self.runner.schedule_stop(stop_tick)
+        if end:
+            self.runner.schedule_end_event(self.at_end)
+
+    def get_state(self) -> dict:
+        """The state of the model on this rank, except the stats, by component.  The 
+           arrays are the live model arrays.
+        """
+        # The observers with a state, eg the convergence window, by their index
+        observers = {}
+        for i, observer in enumerate(self.observers):
+            if hasattr(observer, 'get_state'):
+                observers.update(prefixed(f'{i}.', observer.get_state()))
+
+        return {'model': {'world_size': self.comm.Get_size()},
+                'rng': {'state': random.default_rng.bit_generator.state},
+                'distributions': Distributions.getInstance().get_state(),
+                'virus': self.hb_virus.get_state(),
+                'cells': self.cells.get_state(),
+                'observers': observers}
+
+    def set_state(self, states:dict, tick:int) -> None:
+        """Restore the state from get_state() at the end of the tick, with the cells 
+           that act at later ticks rescheduled and the status counts recounted.
+        """
+        if states['model']['world_size'] != self.comm.Get_size():
+            raise ValueError(f'The state at tick {tick} is of {states["model"]["world_size"]} '
+                             f'ranks, it can only be restored on the same number of ranks')
+
+        calendar = EventCalendar.getInstance()
+        if calendar is not None:
+            calendar.clear()
+
+        random.default_rng.bit_generator.state = states['rng']['state']
+        Distributions.getInstance().set_state(states['distributions'])
+        self.hb_virus.set_state(states['virus'])
+        self.cells.set_state(states['cells'], tick)
+
+        # The observers without a state (or a saved state) start anew
+        for i, observer in enumerate(self.observers):
+            state = unprefixed(f'{i}.', states.get('observers', {}))
+            if hasattr(observer, 'set_state') and len(state) > 0:
+                observer.set_state(state)
+
+        counts = StatusCounts.getInstance()
+        counts.susceptible, counts.eclipsed, counts.infected = self.cells.count_statuses()
+
+    def save_checkpoint(self, tick:int) -> None:
+        """Write the state of the model on this rank at the end of the tick, see checkpoint
+        """
+        states = self.get_state()
+
+        if self.rank == 0:
+            states['stats'] = Statistics.getInstance().get_state()
+
+        write_checkpoint(self.checkpoint_dir, self.rank, tick, states)
+
+    def restore_checkpoint(self) -> int:
+        """Restore the state of the model from the latest checkpoint that all ranks have
+           written, and continue its stats file.
+
+           Returns
+           -------
+           int
+               the tick of the checkpoint, or 0 if there is none and the run starts anew
+        """
+        tick = latest_checkpoint_tick(self.checkpoint_dir, self.comm)
+        if tick < 0:
+            if self.rank == 0:
+                printf(f'No checkpoint in {self.checkpoint_dir}, starting at tick 1')
+            return 0
+
+        states = read_checkpoint(self.checkpoint_dir, self.rank, tick)
+        self.set_state(states, tick)
+
+        if self.rank == 0:
+            Statistics.getInstance().set_state(states['stats'])
+            printf(f'Resumed from the checkpoint at tick {tick} in {self.checkpoint_dir}')
+
+        return tick
 
     def step(self):
         """Main model step behavior.  This method controls the sequence of model
@@ -149,37 +377,102 @@ class Model:
         if self.rank == 0 and tick % 25 == 0:
             printf(f'Tick: {tick}')
 
+        # Each phase is timed from the end of the previous one, see PhaseTimers
+        timers = self.timers
+        t = timers.now()
+
         # Update the HBVirus instance on all ranks
         self.hb_virus.log_cell_counts()
+        t = timers.lap('log_cell_counts', t)
 
-        self.log_stats(tick)  # Aggregate stats across ranks and save data
+        # The stats for this tick are recorded once the status counts are summed across
+        #   ranks, together with the viral load at the start of the tick.
+        viral_load = self.hb_virus.global_viral_load()
 
         self.hb_virus.infect()
+        t = timers.lap('infect', t)
         self.hb_virus.step_function_viral_proportion()
+        t = timers.lap('step_function_viral_proportion', t)
         self.hb_virus.update_viral_load()
+        t = timers.lap('update_viral_load', t)
+
+        # Update the Hepatocytes on all ranks, while the global state is reduced
+        self.cells.step()
+        t = timers.lap('hepatocyte_step', t)
+
+        self.hb_virus.wait_for_reduction()
+        t = timers.lap('reduce_wait', t)
+        self.hb_virus.complete_viral_load_update()
+        t = timers.lap('complete_viral_load_update', t)
+
+        self.log_stats(tick, viral_load)  # Save the stats aggregated across ranks
+        t = timers.lap('log_stats', t)
+
+        stop = self.notify_observers(tick, viral_load)
+        t = timers.lap('observers', t)
+
+        # The checkpoint has the observers' state after the tick.  A run that the observers
+        #   end is complete, so it has no checkpoint of its last tick.
+        if self.checkpoint_interval > 0 and tick % self.checkpoint_interval == 0 and not stop:
+            self.save_checkpoint(int(tick))
+            timers.lap('checkpoint', t)
+
+    def init_observers(self) -> None:
+        """Set the observers of the parameters, ie the convergence monitor if any
+        """
+        self.observers = []
+
+        window = parameters.params.get(CONVERGENCE_WINDOW, 0)
+        if window > 0:
+            self.add_observer(ConvergenceMonitor(window, parameters.params.get(CONVERGENCE_TOLERANCE, 0.001),
+                                                 parameters.params.get(CONVERGENCE_FILL, False)))
+
+    def add_observer(self, observer) -> None:
+        """Add an observer of the stats aggregates, with an update(model, tick, susceptible,
+           eclipsed, infected, viral_load) method that is called at the end of each tick 
+           and returns True to end the run, see ConvergenceMonitor.  The aggregates are
+           the same on every rank, so an observer that decides from them ends the run on
+           all the ranks at the same tick.
+        """
+        self.observers.append(observer)
 
-        # Update the Hepatocytes on all ranks
-        for hepatocyte in self.context.agents(Hepatocyte.ID):
-            hepatocyte.step()
+    def notify_observers(self, tick, viral_load) -> bool:
+        """Pass the stats aggregates of the tick to the observers, and stop the run at the
+           end of the tick if any of them asks to.
+
+           Returns
+           -------
+           bool
+               True if the run stops
+        """
+        stop = False
+        for observer in self.observers:
+            if observer.update(self, tick, self.hb_virus.global_susceptible, self.hb_virus.global_eclipsed,
+                               self.hb_virus.global_infected, viral_load):
+                stop = True
+
+        if stop:
+            self.runner.stop()
+
+        return stop
         
-    def log_stats(self, tick):
-        sum_susceptible = np.zeros(1, dtype='i') 
-        sum_eclipsed = np.zeros(1, dtype='i') 
-        sum_infected = np.zeros(1, dtype='i') 
-        self.comm.Reduce(np.array([self.hb_virus.local_susceptible], dtype='i'), sum_susceptible, op=MPI.SUM, root=0)
-        self.comm.Reduce(np.array([self.hb_virus.local_eclipsed], dtype='i'), sum_eclipsed, op=MPI.SUM, root=0)
-        self.comm.Reduce(np.array([self.hb_virus.local_infected], dtype='i'), sum_infected, op=MPI.SUM, root=0)
+    def log_stats(self, tick, viral_load):
+        """Record the status counts summed across ranks and the total viral load.
 
+        Parameters
+        ----------
+        tick : float
+            the model tick
+        viral_load : int
+            the total viral load at the start of the tick
+        """
         if self.rank == 0:
-            # Sum of viral load across all ranks
-            # NOTE just multiply one rank x world size since viral load is shared across ranks
-            total_viral_load = self.hb_virus.total_viral_load * self.comm.Get_size()
             Statistics.getInstance().record_stats(tick, 
                                                   self.run_number, 
-                                                  sum_susceptible[0], 
-                                                  sum_eclipsed[0], 
-                                                  sum_infected[0],
-                                                  total_viral_load)
+                                                  self.hb_virus.global_susceptible, 
+                                                  self.hb_virus.global_eclipsed, 
+                                                  self.hb_virus.global_infected,
+                                                  viral_load)
 
     
 
@@ -194,7 +487,20 @@ class Model:
 #        events_filename = Statistics.getInstance().event_file.name
 #        stats_filename = Statistics.getInstance().stats_file.name
 
-#        Statistics.getInstance().close()
+        # The timings are written next to the stats file
+        if parameters.params.get(PHASE_TIMERS, False):
+            stats_fname = Statistics.getInstance().stats_fname
+            stats_file = parameters.params[STATS_OUTPUT_FILE]
+            self.timers.write(self.comm, stats_fname[:len(stats_fname) - len(stats_file)] + 'timings.csv')
+
+        # Write the buffered stats, the stats are only recorded on rank 0
+        if self.rank == 0:
+            self.result = Statistics.getInstance().result()
+        Statistics.getInstance().close()
+
+        peak_memory = self.comm.gather(round(peak_rss_mb(), 1), root=0)
+        if self.rank == 0:
+            printf(f'Peak memory per rank (MB): {peak_memory}')
 
 #        print_run_summary(stats_filename, self.burnin_period_days)
 
@@ -216,7 +522,7 @@ class Model:
         #os.remove(events_filename)  # delete the csv file
 
 
-def run(mpi4py_comm, config_file, additional_params):
+def run(mpi4py_comm, config_file, additional_params, observers=None):
     """Run the model with provided parameters. Note that swift-t scripts call
        this run method and provide it's own MPI Comm object, so don't hardcode
        the MPI Comm instance here.
@@ -231,9 +537,26 @@ def run(mpi4py_comm, config_file, additional_params):
         additional_params str
             String of aditional params in JSON string format, e.g.
             '{"Name":"Joe", "Age":34}'
+            
+            Or, to run an ensemble of replicates together (see EnsembleModel), 
+            a list of seeds or of JSON parameter lines, or the list as a JSON
+            string, e.g. '[1, 2, 3]'.
+        observers : list
+            Observers of the stats aggregates of each tick, which can end the run
+            early, see Model.add_observer().  Not for ensembles.
 
     """
 
+    # Nothing is carried over from an earlier run in the same process
+    reset()
+
+    replicates = None
+    if isinstance(additional_params, str) and additional_params.lstrip().startswith('['):
+        additional_params = json.loads(additional_params)
+    if isinstance(additional_params, (list, tuple)):
+        replicates = replicate_params(additional_params)
+        additional_params = ''
+
     init_params(config_file, additional_params)
     
     # NOTE repast4py random.init() will set the numpy generator seed using the random.seed parameter
@@ -246,7 +569,14 @@ def run(mpi4py_comm, config_file, additional_params):
     parameters.params[DATA_DIR] = data_dir
 
     global model
-    model = Model(mpi4py_comm)
+    if replicates is not None:
+        if observers:
+            raise ValueError('Ensembles do not support observers')
+        model = EnsembleModel(mpi4py_comm, replicates)
+    else:
+        model = Model(mpi4py_comm)
+        for observer in observers or []:
+            model.add_observer(observer)
 
     if model.rank == 0:
         start = timer()
@@ -259,7 +589,33 @@ def run(mpi4py_comm, config_file, additional_params):
 
     global result
     result = "Done."  # NOTE returned to swift-t to indicate run finished.
+    if model.result is not None:
+        # The stats, see stats.result
+        result = model.result
+
+    close_singletons()
+
+def close_singletons():
+    """Release the singletons of a run, so that they are not used by the next run in the 
+       same process, eg a sweep worker.
+    """
+    for singleton in (Statistics, Distributions, EventCalendar, StatusCounts, ProductionKinetics, PhaseTimers):
+        if singleton.getInstance() is not None:
+            singleton.getInstance().close()
+
+def reset():
+    """Clear the state of an earlier run in this process, ie the model and result 
+       globals and the singletons.
+    """
+    global model, result
+    model = None
+    result = None
+
+    close_singletons()
   
 def get():
+    """The result of the last run: "Done.", or on rank 0 the stats as set by stats.result,
+       see Statistics.result() and model_statistics.decode_stats().
+    """
     global result
     return result
\ No newline at end of file
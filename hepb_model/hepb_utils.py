@@ -3,18 +3,38 @@
 # Misc utility functions.
 # 
 # 
-import sys
-import pandas as pd
+import sys, resource
 import numpy as np
 
-import numba
-from numba import int32, int64
-from numba.experimental import jitclass
+from repast4py import space
 
 def printf(msg):
     print(msg)
     sys.stdout.flush()
 
+def peak_rss_mb() -> float:
+    """ The peak resident memory of this process in MB
+    """
+    # NOTE ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def index_partition_bounds(grid_width:int, grid_height:int, rank:int, world_size:int):
+    """ The local bounds of the cells on a rank when the grid columns are split 
+        into world_size contiguous blocks, the first blocks having one more column
+        when the width does not divide evenly.
+
+        Returns
+        -------
+        space.BoundingBox
+            the whole column block of the rank
+    """
+    columns, extra = divmod(grid_width, world_size)
+
+    xmin = rank * columns + min(rank, extra)
+    xextent = columns + (1 if rank < extra else 0)
+
+    return space.BoundingBox(xmin, xextent, 0, grid_height, 0, 0)
+
 
 def print_run_summary(model_output_stats_file, burn_in_days):
     """Print basic run stats from the model output stats file.
@@ -27,6 +47,9 @@ def print_run_summary(model_output_stats_file, burn_in_days):
             days for burn in period to remove from stats
     """
     
+    # Imported here, pandas is only needed for the analysis of the output
+    import pandas as pd
+
     # Read the stats.csv into a pandas data frame to print basic run stats
     stats_df = pd.read_csv(model_output_stats_file)
 
@@ -44,41 +67,111 @@ def print_run_summary(model_output_stats_file, burn_in_days):
     )
 
 
-spec = [
-    ('mo', int32[:]),
-    ('no', int32[:]),
-    ('xmin', int32),
-    ('ymin', int32),
-    ('ymax', int32),
-    ('xmax', int32)
-]
-
-@jitclass(spec)
-class GridNghFinder:
-
-    def __init__(self, xmin, ymin, xmax, ymax, include_center=False):
-        if include_center:
-            self.mo = np.array([-1, 0, 1, -1, 0, 1, -1, 0, 1], dtype=np.int32)
-            self.no = np.array([1, 1, 1, 0, 0, 0, -1, -1, -1], dtype=np.int32)
-        else:
-            self.mo = np.array([-1, 0, 1, -1, 1, -1, 0, 1], dtype=np.int32)
-            self.no = np.array([1, 1, 1, 0, 0, -1, -1, -1], dtype=np.int32)
-        
-        self.xmin = xmin
-        self.ymin = ymin
-        self.xmax = xmax
-        self.ymax = ymax
-
-    def find(self, x, y):
-        xs = self.mo + x
-        ys = self.no + y
-
-        xd = (xs >= self.xmin) & (xs <= self.xmax)
-        xs = xs[xd]
-        ys = ys[xd]
-
-        yd = (ys >= self.ymin) & (ys <= self.ymax)
-        xs = xs[yd]
-        ys = ys[yd]
-
-        return np.stack((xs, ys, np.zeros(len(ys), dtype=np.int32)), axis=-1)
\ No newline at end of file
+class IndexPool:
+    """A set of the local cell indices 0..n-1, eg the susceptible cells on a rank, 
+    with O(1) removal and sampling without replacement that costs O(k) for k items.
+
+    Attributes
+    ----------
+    items : np.ndarray
+        the indices in the pool are items[0:size], in no particular order
+    positions : np.ndarray
+        position of each index in items, -1 if the index is not in the pool
+    size : int
+        the number of indices in the pool
+    """
+
+    def __init__(self, n:int):
+        self.items = np.arange(n, dtype=np.int64)
+        self.positions = np.arange(n, dtype=np.int64)
+        self.size = n
+
+    def __len__(self):
+        return self.size
+
+    def get_state(self) -> dict:
+        return {'items': self.items, 'positions': self.positions, 'size': self.size}
+
+    def set_state(self, state:dict) -> None:
+        self.items = np.array(state['items'], dtype=np.int64)
+        self.positions = np.array(state['positions'], dtype=np.int64)
+        self.size = int(state['size'])
+
+    def __contains__(self, item):
+        return self.positions[item] >= 0
+
+    def remove(self, item:int) -> None:
+        """ Remove an index from the pool by swapping it with the last one
+        """
+        pos = self.positions[item]
+        last = self.items[self.size - 1]
+
+        self.items[pos] = last
+        self.positions[last] = pos
+        self.positions[item] = -1
+        self.size -= 1
+
+    def remove_at(self, chosen:np.ndarray) -> np.ndarray:
+        """ Remove the indices at the (distinct) positions in the pool, eg positions
+            selected uniformly at random without replacement, and return them in the
+            order of the positions.
+        """
+        k = len(chosen)
+        if k == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        selected = self.items[chosen]
+
+        # Fill the holes left below the new size with the unselected tail items
+        new_size = self.size - k
+        holes = chosen[chosen < new_size]
+        in_tail = np.ones(k, dtype=bool)
+        in_tail[chosen[chosen >= new_size] - new_size] = False
+        movers = self.items[new_size:self.size][in_tail]
+
+        self.items[holes] = movers
+        self.positions[movers] = holes
+        self.positions[selected] = -1
+        self.size = new_size
+
+        return selected
+
+
+def prefixed(prefix:str, state:dict) -> dict:
+    """ The state entries with the names prefixed, eg to store several states in one file
+    """
+    return {prefix + name: value for name, value in state.items()}
+
+def unprefixed(prefix:str, state) -> dict:
+    """ The state entries with the prefix, without the prefix
+    """
+    return {name[len(prefix):]: state[name] for name in state if name.startswith(prefix)}
+
+def sample_infections(pool:IndexPool, total_cells:int, n:int, distributions) -> np.ndarray:
+    """Select n of the total cells uniformly at random without replacement and return
+    the selected cells that are in the susceptible pool, removing them from the pool.
+
+    Rather than selecting all n cells, this draws how many of the n selected cells are
+    susceptible from the hypergeometric distribution, and then selects that many cells 
+    from the pool, which has the same distribution at a cost that scales with n.
+
+        Parameters
+        ----------
+        pool : IndexPool
+            the susceptible cells
+        total_cells : int
+            the number of cells, susceptible or not
+        n : int
+            the number of cells to select
+        distributions : Distributions
+            the random distributions
+    """
+    n = min(n, total_cells)
+    susceptible = len(pool)
+
+    if n <= 0 or susceptible == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    k = distributions.get_hypergeometric(susceptible, total_cells - susceptible, n)
+
+    return pool.remove_at(distributions.get_random_selection(susceptible, k))
@@ -0,0 +1,213 @@
+# This file is part of the HepB Model
+#
+# Compiled kernels for the vectorized Hepatocyte engine, and the neighbor search of
+# the object engine
+#
+# The kernels are cached on disk (cache=True), so only the first process compiles them,
+# see compile_kernels().  This module is only imported when a kernel is first needed,
+# as importing numba is a large part of the model startup.
+#
+
+import numpy as np
+from numba import njit
+
+# The raster value of the ghost cells outside the grid
+NO_CELL = -1
+
+# Offsets of the 8 (Moore) neighbors, as in GridNghFinder
+NGH_DX = np.array([-1, 0, 1, -1, 1, -1, 0, 1], dtype=np.int64)
+NGH_DY = np.array([1, 1, 1, 0, 0, -1, -1, -1], dtype=np.int64)
+
+@njit(cache=True)
+def infect_with_neighbors(raster, selected, uniforms, susceptible, eclipsed):
+    """ Try to infect the selected cells in order, as the object engine neighbor infection.
+
+        A selected susceptible cell is eclipsed.  Otherwise, if the selected cell has
+        susceptible neighbors, two of them are picked at random with replacement and
+        eclipsed (a cell picked twice is eclipsed once).  Each cell that is eclipsed is
+        marked in the raster, so the later selections see it.
+
+        Parameters
+        ----------
+        raster : np.ndarray (int8)
+            the local cell statuses, shape (local columns + 2, grid height), where the
+            first and last columns are the ghost columns of the neighboring ranks, or
+            NO_CELL outside the grid.  Local cell i is at (1 + i // height, i % height).
+        selected : np.ndarray (int64)
+            the local indices of the selected cells, in the order they are tried
+        uniforms : np.ndarray (float64)
+            two uniform [0, 1) values per selected cell, shape (len(selected), 2)
+        susceptible, eclipsed : int
+            the status codes
+
+        Returns
+        -------
+        local : np.ndarray (int64)
+            the local indices of the eclipsed cells
+        ghosts : np.ndarray (int64)
+            the eclipsed ghost cells, as raster column * height + row
+    """
+    columns, height = raster.shape
+
+    local = np.empty(3 * len(selected), dtype=np.int64)
+    ghosts = np.empty(2 * len(selected), dtype=np.int64)
+    num_local = 0
+    num_ghosts = 0
+
+    candidates = np.empty(8, dtype=np.int64)
+
+    for k in range(len(selected)):
+        cell = selected[k]
+        x = 1 + cell // height
+        y = cell % height
+
+        if raster[x, y] == susceptible:
+            raster[x, y] = eclipsed
+            local[num_local] = cell
+            num_local += 1
+            continue
+
+        count = 0
+        for d in range(8):
+            ny = y + NGH_DY[d]
+            if ny >= 0 and ny < height and raster[x + NGH_DX[d], ny] == susceptible:
+                candidates[count] = d
+                count += 1
+
+        if count == 0:
+            continue
+
+        for j in range(2):
+            d = candidates[int(uniforms[k, j] * count)]
+            nx = x + NGH_DX[d]
+            ny = y + NGH_DY[d]
+
+            if raster[nx, ny] != susceptible:
+                continue
+            raster[nx, ny] = eclipsed
+
+            if nx == 0 or nx == columns - 1:
+                ghosts[num_ghosts] = nx * height + ny
+                num_ghosts += 1
+            else:
+                local[num_local] = (nx - 1) * height + ny
+                num_local += 1
+
+    return local[:num_local], ghosts[:num_ghosts]
+
+@njit(cache=True)
+def step_replicates(status, eclipsed_phase_period, first_infectious_status_time, next_production,
+                    virions, interval, tick, eclipsed, infected, became_infected, produced):
+    """ HepatocyteArray.step() for the cells of each replicate of an ensemble, in one
+        pass over the (replicates, cells) arrays.
+
+        Eclipsed cells whose transition time is the tick become infected and produce at 
+        the next tick.  Infected cells whose next production is the tick produce virions
+        for their production cycle (the last row of the kinetics table for later cycles).
+
+        Parameters
+        ----------
+        virions, interval : np.ndarray (int64)
+            the ProductionKinetics table
+        eclipsed, infected : int
+            the status codes
+        became_infected, produced : np.ndarray (int64)
+            set to the number of cells that became infected, and the virions 
+            produced, in each replicate
+    """
+    replicates, cells = status.shape
+    last_cycle = len(virions) - 1
+
+    for r in range(replicates):
+        num_infected = 0
+        num_produced = 0
+
+        for i in range(cells):
+            cell_status = status[r, i]
+
+            if cell_status == eclipsed:
+                if eclipsed_phase_period[r, i] == tick:
+                    status[r, i] = infected
+                    eclipsed_phase_period[r, i] = 0
+                    first_infectious_status_time[r, i] = 1
+                    next_production[r, i] = tick + 1
+                    num_infected += 1
+
+            elif cell_status == infected and next_production[r, i] == tick:
+                cycle = min(first_infectious_status_time[r, i], last_cycle)
+                first_infectious_status_time[r, i] += 1
+                next_production[r, i] = tick + interval[cycle]
+                num_produced += virions[cycle]
+
+        became_infected[r] = num_infected
+        produced[r] = num_produced
+
+@njit(cache=True)
+def grid_neighbors(x, y, mo, no, xmin, ymin, xmax, ymax):
+    """ The points at the offsets (mo, no) from (x, y) that are in the bounds, see GridNghFinder
+
+        Returns
+        -------
+        np.ndarray (int32)
+            the (x, y, 0) of each point, shape (points, 3)
+    """
+    nghs = np.zeros((len(mo), 3), dtype=np.int32)
+    count = 0
+
+    for d in range(len(mo)):
+        nx = mo[d] + x
+        ny = no[d] + y
+
+        if nx >= xmin and nx <= xmax and ny >= ymin and ny <= ymax:
+            nghs[count, 0] = nx
+            nghs[count, 1] = ny
+            count += 1
+
+    return nghs[:count]
+
+class GridNghFinder:
+    """GridNghFinder finds the neighbors of a grid point, within the inclusive bounds
+    (xmin, ymin) to (xmax, ymax).
+
+    The search is the cached grid_neighbors() kernel, rather than a numba jitclass, 
+    which cannot be cached and so was compiled again by every process.
+    """
+
+    def __init__(self, xmin, ymin, xmax, ymax, include_center=False):
+        if include_center:
+            self.mo = np.array([-1, 0, 1, -1, 0, 1, -1, 0, 1], dtype=np.int32)
+            self.no = np.array([1, 1, 1, 0, 0, 0, -1, -1, -1], dtype=np.int32)
+        else:
+            self.mo = np.array([-1, 0, 1, -1, 1, -1, 0, 1], dtype=np.int32)
+            self.no = np.array([1, 1, 1, 0, 0, -1, -1, -1], dtype=np.int32)
+
+        self.xmin = xmin
+        self.ymin = ymin
+        self.xmax = xmax
+        self.ymax = ymax
+
+    def find(self, x, y):
+        return grid_neighbors(x, y, self.mo, self.no, self.xmin, self.ymin, self.xmax, self.ymax)
+
+def compile_kernels() -> None:
+    """ Compile the kernels for the argument types the model calls them with, so they
+        are in the on-disk cache before the runs of a sweep start, rather than compiled
+        by each worker.  The kernels are only compiled if they are not already cached.
+    """
+    # Imported here, the kernels themselves do not depend on the model
+    from .hepb_enums import StatusCode
+
+    susceptible, eclipsed, infected = StatusCode.SUSCEPTIBLE, StatusCode.ECLIPSED, StatusCode.INFECTED
+
+    raster = np.full((3, 2), NO_CELL, dtype=np.int8)
+    raster[1] = susceptible
+    infect_with_neighbors(raster, np.zeros(1, dtype=np.int64), np.zeros((1, 2), dtype=np.float64),
+                          susceptible, eclipsed)
+
+    status = np.full((1, 1), susceptible, dtype=np.int8)
+    cells = np.zeros((1, 1), dtype=np.int64)
+    counts = np.zeros(1, dtype=np.int64)
+    step_replicates(status, cells, cells.copy(), cells.copy(), counts.copy(), counts.copy(), 1,
+                    eclipsed, infected, counts.copy(), counts.copy())
+
+    GridNghFinder(0, 0, 1, 1).find(0, 0)
@@ -0,0 +1,140 @@
+# This file is part of the HepB Model
+#
+# Virion production kinetics of infected Hepatocytes
+#
+#
+
+import csv, math, os
+import numpy as np
+
+from repast4py import parameters
+
+from .constants import *
+
+def viral_production_rate(tau:int) -> float:
+    """ Calculate the amount of virus an infected cell can produce in production cycle tau
+    """
+    steepness = parameters.params[VIRAL_PRODUCTION_STEEPNESS_GROWTH_CURVE]
+    alpha = parameters.params[VIRAL_PRODUCTION_CYCLE_MIDPOINT]
+
+    expF = 1 + math.exp(-1 * steepness * (tau - alpha))
+
+    viral_production = parameters.params[VIRAL_PRODUCTION_STEADY_STATE] / expF
+
+    if viral_production < 0:
+        viral_production = 0
+
+    if viral_production > parameters.params[VIRAL_PRODUCTION_STEADY_STATE]:
+        viral_production = parameters.params[VIRAL_PRODUCTION_STEADY_STATE]
+
+    return viral_production
+
+def production_cycle_power_law(cycle:int) -> int:
+    """ Calculate the production cycle
+    """
+    power_law_const = parameters.params[VIRAL_PROD_CYCLE_POWER_LAW_CONSTANT]
+    power_law_exp = parameters.params[VIRAL_PROD_CYCLE_POWER_LAW_EXPONENT]
+
+    x = power_law_const * math.exp(-1.0 * cycle * power_law_exp)
+
+    return math.ceil(x)
+
+
+class ProductionKinetics:
+    """ProductionKinetics is a table of the virus production of an infected cell
+    by production cycle, built once from the model parameters.
+
+    In production cycle c (the Hepatocyte first_infectious_status_time, which
+    starts at 1) an infected cell releases virions[c] virions and produces again
+    interval[c] ticks later.  The table ends at the cycle where both have reached
+    their steady state (or where no cell can get to in the run time), and later
+    cycles read the last entry.
+
+    Attributes
+    ----------
+    __instance : ProductionKinetics
+        ProductionKinetics singleton
+    rate : np.ndarray (float64)
+        the continuous production rate P(tau) of each cycle
+    virions : np.ndarray (int64)
+        the discrete number of virions released in each cycle
+    interval : np.ndarray (int64)
+        ticks from each production to the next
+    last_cycle : int
+        index of the last (steady state) entry
+    """
+
+    __instance = None
+
+    @staticmethod
+    def getInstance():
+        return ProductionKinetics.__instance
+
+    def __init__(self, max_cycle:int):
+        """Constructor
+
+        Parameters
+        ----------
+        max_cycle : int
+            the largest cycle that needs an exact entry, ie a cell cannot produce
+            more than once per tick, so the run time is enough.
+        """
+        steady_state = parameters.params[VIRAL_PRODUCTION_STEADY_STATE]
+
+        # The rate and interval converge monotonically only when both exponents are positive
+        converges = (parameters.params[VIRAL_PRODUCTION_STEEPNESS_GROWTH_CURVE] > 0 and
+                     parameters.params[VIRAL_PROD_CYCLE_POWER_LAW_EXPONENT] > 0)
+
+        rates = []
+        intervals = []
+        for cycle in range(max_cycle + 1):
+            rate = viral_production_rate(cycle)
+
+            next_period = production_cycle_power_law(cycle - 1)
+            if next_period <= 1:   # means production is every next step
+                next_period = 1
+
+            rates.append(rate)
+            intervals.append(next_period)
+
+            if converges and cycle > 0 and rate == steady_state and next_period == 1:
+                break
+
+        self.rate = np.array(rates, dtype=np.float64)
+
+        # if it is less than 1, the production is 1, else the discrete integer virus produced
+        self.virions = np.where(self.rate < 1, 1, self.rate.astype(np.int64))
+        self.interval = np.array(intervals, dtype=np.int64)
+        self.last_cycle = len(rates) - 1
+
+        ProductionKinetics.__instance = self
+
+    def virions_at(self, cycle:int) -> int:
+        return int(self.virions[min(cycle, self.last_cycle)])
+
+    def interval_at(self, cycle:int) -> int:
+        return int(self.interval[min(cycle, self.last_cycle)])
+
+    def rate_at(self, cycle:int) -> float:
+        return float(self.rate[min(cycle, self.last_cycle)])
+
+    def write(self, output_dir:str) -> str:
+        """Write the table to a CSV file in the output directory.  The hours column
+        is the time of each production since the cell became infected, so the
+        production stages can be checked without running the model.
+        """
+        fname = os.path.join(output_dir, KINETICS_OUTPUT_FILE)
+
+        hours = 1 + np.concatenate(([0], np.cumsum(self.interval[1:-1])))
+
+        with open(fname, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["cycle", "hours since infected", "production rate", "virions", "interval"])
+            for cycle in range(1, self.last_cycle + 1):
+                writer.writerow([cycle, int(hours[cycle - 1]), float(self.rate[cycle]),
+                                 int(self.virions[cycle]), int(self.interval[cycle])])
+
+        return fname
+
+    def close(self):
+        ProductionKinetics.__instance = None
@@ -4,27 +4,58 @@
 # 
 # 
 
-import csv, os, math
+import base64, csv, io, json, os, math
+import numpy as np
 from datetime import datetime
 
 from repast4py import parameters
 
 from .hepb_enums import *
 from .constants import *
+from .hepb_utils import prefixed, unprefixed
+
+
+STATS_HEADER = ["run","tick","susceptible","eclipsed","infected","viral load (log)"]
+
+# Column name and type of each stats field, in the header order
+STATS_COLUMNS = [("run", np.int64), ("tick", np.float64), ("susceptible", np.int64), 
+                 ("eclipsed", np.int64), ("infected", np.int64), ("viral_load_log", np.float64)]
+
+# stats.output.file extensions that are written with pyarrow
+PARQUET_EXTENSIONS = ('.parquet',)
+ARROW_EXTENSIONS = ('.arrow', '.feather')
 
 
 class Statistics:
     """Statistics class records changes in all agent attributes and compiles
     additional summary aggregate statistics.
+
+    The stats rows are stored in preallocated typed column arrays and written every
+    stats.flush.interval rows and when the Statistics is closed, instead of being 
+    written and flushed on every tick.  The file format follows the extension of 
+    stats.output.file: CSV (the default), or Parquet (.parquet) or Arrow IPC 
+    (.arrow, .feather), which need pyarrow.
+
+    A CSV file is appended at each flush, so a crashed run loses at most one 
+    interval of rows.  Parquet and Arrow files are only readable once complete, so
+    they are written on close, and each flush instead saves all the rows so far to
+    a <stats file>.partial.npz checkpoint, which is removed when the file is written.
+
+    With stats.in.memory no file is written, and the rows are only kept in memory for
+    the run result, see result().
     
     Attributes
     ----------
     __instance : Statistics
         Statistics singleton
-    events_writer : csv.writer
-        CSV writer for events log data
-    stats_writer : csv.writer
-        CSV writer for stats log data
+    stats_fname : str
+        The stats output file
+    flush_interval : int
+        The number of rows buffered before they are written, 0 writes only on close
+    columns : dict
+        The buffered stats column arrays by name
+    size : int
+        The number of rows in the column arrays
     
     """
     
@@ -34,29 +65,89 @@ class Statistics:
     def getInstance():
         return Statistics.__instance
    
-    def __init__(self):
+    def __init__(self, output_dir:str=None, flush_interval:int=None, in_memory:bool=None):
         """Constructor
         
         Parameters
         ----------
-        
+        output_dir : str
+            The directory of the stats file, by default the output.directory parameter
+        flush_interval : int
+            The number of rows to buffer, by default the stats.flush.interval parameter
+        in_memory : bool
+            Keep the rows in memory without a stats file, by default the stats.in.memory
+            parameter
         """
         
         Statistics.__instance = self
         
-        output_dir = parameters.params[OUTPUT_DIRECTORY]
+        if output_dir is None:
+            output_dir = parameters.params[OUTPUT_DIRECTORY]
         # output_dir = os.path.join(output_dir, datetime.now().strftime('%Y-%m-%d_%H-%M-%S'))
-        stats_fname = os.path.join(output_dir, 'run_' + datetime.now().strftime('%Y-%m-%d_%H-%M-%S') + '_' + parameters.params[STATS_OUTPUT_FILE])
-        
-        self.stats_file = open(stats_fname,'w', newline='')
-        self.stats_writer = csv.writer(self.stats_file)
+        self.stats_fname = os.path.join(output_dir, 'run_' + datetime.now().strftime('%Y-%m-%d_%H-%M-%S') + '_' + parameters.params[STATS_OUTPUT_FILE])
+
+        if flush_interval is None:
+            flush_interval = parameters.params.get(STATS_FLUSH_INTERVAL, 100)
+        self.flush_interval = flush_interval
+
+        self.result_type = parameters.params.get(STATS_RESULT, RESULT_DONE)
+        if self.result_type not in (RESULT_DONE, RESULT_PAYLOAD, RESULT_SUMMARY):
+            raise ValueError(f'Unknown {STATS_RESULT}: {self.result_type}')
+
+        if in_memory is None:
+            in_memory = parameters.params.get(STATS_IN_MEMORY, False)
+
+        extension = os.path.splitext(self.stats_fname)[1].lower()
+        if in_memory:
+            self.format = 'memory'
+            flush_interval = 0
+        elif extension in PARQUET_EXTENSIONS:
+            self.format = 'parquet'
+        elif extension in ARROW_EXTENSIONS:
+            self.format = 'arrow'
+        else:
+            self.format = 'csv'
+
+        # The columnar formats keep every row until the file is written on close
+        self.columnar = self.format != 'csv'
+        if self.columnar:
+            if self.format != 'memory':
+                _import_pyarrow()
+            self.checkpoint_fname = self.stats_fname + '.partial.npz'
+
+        # The rows written to a CSV file are dropped, unless they are the run result
+        self.keep_rows = self.columnar or self.result_type != RESULT_DONE
+
+        capacity = flush_interval if flush_interval > 0 else 1024
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in STATS_COLUMNS}
+        self.size = 0
+
+        # The rows in the columns that have been written (csv) or checkpointed
+        self.flushed = 0
+
+        # The tick is written as the value the schedule gives (eg 1.0), see _format_rows()
+        self.tick_type = float
+
+        self.stats_file = None
+        self.stats_writer = None
 
-        # Write headers
-        self.stats_writer.writerow(["run","tick","susceptible","eclipsed","infected","viral load (log)"])
+        if self.format == 'csv':
+            # A resumed run that starts in the same second as the run it resumes has the
+            #   same stats file name, which is continued rather than truncated, see set_state()
+            if parameters.params.get(CHECKPOINT_RESUME, False) and os.path.exists(self.stats_fname):
+                self.stats_file = open(self.stats_fname, 'r+', newline='')
+                self.stats_file.seek(0, os.SEEK_END)
+                self.stats_writer = csv.writer(self.stats_file)
+            else:
+                self.stats_file = open(self.stats_fname,'w', newline='')
+                self.stats_writer = csv.writer(self.stats_file)
+
+                # Write headers
+                self.stats_writer.writerow(STATS_HEADER)
+                self.stats_file.flush()
 
-    # TODO Performance Profiling ~25% CPU here.
     def record_stats(self, tick, run, num_susciptible, num_eclipsed, num_infected, total_viral_load):
-        """Writes any cached stats to file for each of the event loggers.
+        """Buffer the stats of a tick, and write the buffer when it is full.
         
         Parameters
         ----------
@@ -68,22 +159,230 @@ class Statistics:
         if total_viral_load > 0:
             viral_load_log = math.log10(total_viral_load)
         else:
-            viral_load_log = 0
-        
-        
-        # Write the summary stats and aggregate stats for this tick
-        self.stats_writer.writerow([str(run), str(tick), str(num_susciptible), str(num_eclipsed), str(num_infected), str(viral_load_log) ])
-                        
-        # Flushing files ensures incremental save
-        self.stats_file.flush()
+            viral_load_log = -0.0   # marks the integer 0, see _format_rows()
+
+        if self.size == len(self.columns["run"]):
+            self._grow()
+
+        i = self.size
+        self.tick_type = type(tick)
+        self.columns["run"][i] = run
+        self.columns["tick"][i] = tick
+        self.columns["susceptible"][i] = num_susciptible
+        self.columns["eclipsed"][i] = num_eclipsed
+        self.columns["infected"][i] = num_infected
+        self.columns["viral_load_log"][i] = viral_load_log
+        self.size += 1
+
+        if self.flush_interval > 0 and self.size - self.flushed >= self.flush_interval:
+            self.flush()
+
+    def _grow(self):
+        """ Make room for more rows, by dropping the rows already written to a CSV 
+            file, or by doubling the columns.
+        """
+        if not self.keep_rows and self.flushed == self.size:
+            self.size = 0
+            self.flushed = 0
+            return
+
+        for name in self.columns:
+            column = self.columns[name]
+            self.columns[name] = np.concatenate((column, np.zeros_like(column)))
+
+    def _format_rows(self, start:int, stop:int):
+        """ The rows as lists of strings, as the original per tick str() of each value
+        """
+        run = self.columns["run"][start:stop].tolist()
+        tick = [self.tick_type(t) for t in self.columns["tick"][start:stop].tolist()]
+        susceptible = self.columns["susceptible"][start:stop].tolist()
+        eclipsed = self.columns["eclipsed"][start:stop].tolist()
+        infected = self.columns["infected"][start:stop].tolist()
+        viral_load_log = self.columns["viral_load_log"][start:stop].tolist()
+
+        # A zero viral load is logged as the integer 0, but a viral load of 1 as 0.0
+        viral_load_log = [0 if v == 0 and math.copysign(1, v) < 0 else v for v in viral_load_log]
+
+        return [[str(v) for v in row] for row in zip(run, tick, susceptible, eclipsed, infected, viral_load_log)]
+
+    def flush(self):
+        """Write the buffered rows to the CSV file, or checkpoint them for the columnar formats
+        """
+        if self.size == self.flushed or self.format == 'memory':
+            return
+
+        if self.columnar:
+            tmp_fname = self.checkpoint_fname + '.tmp.npz'
+            np.savez(tmp_fname, tick_type=self.tick_type.__name__, 
+                     **{name: column[:self.size] for name, column in self.columns.items()})
+            os.replace(tmp_fname, self.checkpoint_fname)
+        else:
+            self.stats_writer.writerows(self._format_rows(self.flushed, self.size))
+            self.stats_file.flush()
+
+        self.flushed = self.size
+
+    def get_state(self) -> dict:
+        """ The rows recorded so far, see checkpoint.  The buffered rows are written first, 
+            and a CSV file is then recorded by its name and length, and the rows kept in 
+            memory by their columns.
+        """
+        self.flush()
+
+        state = {'stats_fname': self.stats_fname, 'tick_type': self.tick_type.__name__}
+        if self.keep_rows:
+            state.update(prefixed('column.', {name: column[:self.size] for name, column in self.columns.items()}))
+        if not self.columnar:
+            state['stats_file_size'] = self.stats_file.tell()
+
+        return state
+
+    def set_state(self, state:dict) -> None:
+        """ Continue the stats file of the checkpoint, without the rows written after it.
+            The new (empty) stats file is removed.
+        """
+        if state['stats_fname'] != self.stats_fname:
+            if self.stats_file is not None:
+                self.stats_file.close()
+                os.remove(self.stats_fname)
+            self.stats_fname = state['stats_fname']
+            if self.columnar:
+                self.checkpoint_fname = self.stats_fname + '.partial.npz'
+
+        self.tick_type = {'float': float, 'int': int}[state['tick_type']]
+
+        if self.keep_rows:
+            columns = unprefixed('column.', state)
+            self.size = len(columns['run'])
+            for name, dtype in STATS_COLUMNS:
+                self.columns[name] = np.zeros(max(2 * self.size, 1024), dtype=dtype)
+                self.columns[name][:self.size] = columns[name]
+        else:
+            self.size = 0
+        self.flushed = self.size
+
+        if not self.columnar:
+            if self.stats_file is not None:
+                self.stats_file.close()
+            self.stats_file = open(self.stats_fname, 'r+', newline='')
+            self.stats_file.truncate(state['stats_file_size'])
+            self.stats_file.seek(state['stats_file_size'])
+            self.stats_writer = csv.writer(self.stats_file)
+
+    def rows(self) -> dict:
+        """ A copy of the recorded stats columns, see record_rows()
+        """
+        return {name: column[:self.size].copy() for name, column in self.columns.items()}
+
+    def record_rows(self, columns:dict, tick_type=float) -> None:
+        """ Record the rows of stats columns from rows(), eg the rows of the ticks shared by 
+            several runs.
+        """
+        for i in range(len(columns['run'])):
+            if self.size == len(self.columns['run']):
+                self._grow()
+
+            for name in self.columns:
+                self.columns[name][self.size] = columns[name][i]
+            self.size += 1
+            self.tick_type = tick_type
+
+            if self.flush_interval > 0 and self.size - self.flushed >= self.flush_interval:
+                self.flush()
+
+    def discard(self):
+        """ Close without writing the stats, and remove the (empty) stats file
+        """
+        if self.stats_file is not None:
+            self.stats_file.close()
+            os.remove(self.stats_fname)
+
+        Statistics.__instance = None
+
+    def as_table(self):
+        """ The recorded rows as a pyarrow Table, for the columnar formats
+        """
+        pa = _import_pyarrow()
+
+        arrays = [self.columns[name][:self.size] for name, _ in STATS_COLUMNS]
+        arrays[-1] = arrays[-1] + 0.0   # -0.0 to 0.0
+        return pa.table(arrays, names=STATS_HEADER)
+
+    def result(self) -> str:
+        """ The run result of the stats, as set by stats.result: "Done.", the encoded rows 
+            (see encode_stats()), or the rows at stats.result.ticks (see summarize_stats())
+        """
+        if self.result_type == RESULT_PAYLOAD:
+            return encode_stats(self.rows())
+        elif self.result_type == RESULT_SUMMARY:
+            return summarize_stats(self.rows(), parameters.params.get(STATS_RESULT_TICKS))
+
+        return "Done."
 
-            
     def close(self):
         """Flush and close the log files
         """
+        if self.format == 'memory':
+            pass    # the rows stay in the columns, for result()
+        elif self.columnar:
+            table = self.as_table()
+            if self.format == 'parquet':
+                import pyarrow.parquet as pq
+                pq.write_table(table, self.stats_fname)
+            else:
+                import pyarrow.feather as feather
+                feather.write_feather(table, self.stats_fname, compression='uncompressed')
 
-        self.stats_file.flush()
-        self.stats_file.close()
+            if os.path.exists(self.checkpoint_fname):
+                os.remove(self.checkpoint_fname)
+        else:
+            self.flush()
+            self.stats_file.close()
 
         Statistics.__instance = None
-        
\ No newline at end of file
+
+
+def encode_stats(columns:dict) -> str:
+    """ The stats columns, eg from Statistics.rows(), as a compressed npz archive in 
+        base64, a compact string result for swift-t, see decode_stats()
+    """
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **columns)
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+def decode_stats(payload:str) -> dict:
+    """ The stats columns of an encode_stats() payload
+
+        Returns
+        -------
+        dict
+            the column arrays by name, see STATS_COLUMNS.  A viral_load_log of -0.0 is a
+            viral load of 0, see Statistics.record_stats().
+    """
+    with np.load(io.BytesIO(base64.b64decode(payload))) as data:
+        return {name: data[name] for name, _ in STATS_COLUMNS}
+
+def summarize_stats(columns:dict, ticks:list=None) -> str:
+    """ The stats rows of the ticks as JSON, with the values of each column by name, 
+        eg {"run": [8], "tick": [300.0], "susceptible": [...], ...}.  By default the 
+        last row.
+    """
+    if ticks is None:
+        selected = slice(len(columns['run']) - 1, None)
+    else:
+        selected = np.isin(columns['tick'], ticks)
+
+    summary = {name: columns[name][selected].tolist() for name, _ in STATS_COLUMNS}
+    summary['viral_load_log'] = [v + 0.0 for v in summary['viral_load_log']]   # -0.0 to 0.0
+
+    return json.dumps(summary)
+
+def _import_pyarrow():
+    """ pyarrow is only needed for the Parquet and Arrow stats files
+    """
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError(f'pyarrow is required for the {parameters.params[STATS_OUTPUT_FILE]} stats file, '
+                          'use a .csv stats.output.file or install pyarrow') from e
+    return pyarrow
@@ -0,0 +1,172 @@
+# This file is part of the HepB Model
+#
+# Treatment sweeps that simulate the untreated ticks once per seed
+#
+# Usage, from the project root:
+#   python3 -m hepb_model tree data/model_props.yaml '{"runTime":1500}' variants.txt --seeds 1 2
+#
+# where each line of variants.txt is a JSON treatment variant, eg
+#   {"isTreatmentUsed": true, "reduceProductionRate": 0.8}
+#
+
+import argparse, copy, json, os
+from pathlib import Path
+from timeit import default_timer as timer
+
+from mpi4py import MPI
+
+from repast4py.parameters import init_params
+from repast4py import parameters, random
+
+from .constants import *
+from .hepb_utils import printf
+from .model_statistics import Statistics
+from .treatment import Treatment
+from .sweep import read_upf
+from . import hepb_model
+
+# The parameters that can differ between the variants, the others are shared by the
+#   whole run and so by the untreated prefix.
+TREATMENT_PARAMS = [IS_TREATMENT_USED, START_OF_TREATMENT_AT, REDUCE_PRODUCTION_RATE,
+                    REDUCE_PRODUCTION_RATE_CONTROLLER, OUTPUT_DIRECTORY]
+
+def branch_tick(variants:list) -> int:
+    """ The last tick that is the same in all the variants, ie before the earliest
+        treatment start, and at most the run time.
+    """
+    run_time = parameters.params[RUN_TIME]
+    starts = [int(variant.get(START_OF_TREATMENT_AT, parameters.params.get(START_OF_TREATMENT_AT, run_time + 1)))
+              for variant in variants
+              if variant.get(IS_TREATMENT_USED, parameters.params.get(IS_TREATMENT_USED, False))]
+
+    return min([run_time] + [start - 1 for start in starts])
+
+class BranchStop:
+    """ Model observer that ends the untreated prefix at the end of the branch tick.
+
+        The prefix runs on a schedule to the run time, as a full run, since a stop event
+        at the branch tick would be shuffled with the step of that tick, a draw of the 
+        random generator that a full run does not make.
+    """
+
+    def __init__(self, tick:int):
+        self.tick = tick
+
+    def update(self, model, tick, susceptible, eclipsed, infected, viral_load) -> bool:
+        return tick >= self.tick
+
+def run_seed(comm:MPI.Intracomm, seed:int, variants:list, output_dir:str) -> int:
+    """ Run the treatment variants of one seed.  The model is run to the branch tick
+        once, and each variant continues from a copy of that state with its treatment.
+        Variant i writes its stats to output_dir/seed_<seed>/variant_<i>, unless it sets
+        its own output.directory, and has the same stats as a full run with its
+        parameters and the seed.
+
+        Returns
+        -------
+        int
+            the branch tick
+    """
+    base_params = dict(parameters.params, **{'random.seed': seed,
+                                             OUTPUT_DIRECTORY: os.path.join(output_dir, f'seed_{seed}')})
+    parameters.params.update(base_params)
+
+    hepb_model.reset()
+    random.init(seed)
+    model = hepb_model.Model(comm)
+
+    # The prefix stats are kept in memory and copied to each variant
+    Statistics.getInstance().discard()
+    Statistics(flush_interval=0, in_memory=True)
+
+    # The prefix runs to the branch tick, the other observers could end it early
+    branch = branch_tick(variants)
+    model.observers = [BranchStop(branch)]
+
+    model.schedule_run(1, parameters.params[RUN_TIME], end=False)
+    model.run()
+
+    prefix_stats = Statistics.getInstance()
+    rows = prefix_stats.rows()
+    tick_type = prefix_stats.tick_type
+    prefix_stats.discard()
+
+    state = copy.deepcopy(model.get_state())
+
+    for i, variant in enumerate(variants):
+        variant_dir = variant.get(OUTPUT_DIRECTORY, os.path.join(base_params[OUTPUT_DIRECTORY], f'variant_{i}'))
+
+        parameters.params.clear()
+        parameters.params.update(base_params, **variant)
+        parameters.params[OUTPUT_DIRECTORY] = variant_dir
+
+        model.set_state(copy.deepcopy(state), branch)
+        model.hb_virus.treatment = Treatment()
+        model.init_observers()
+
+        if model.rank == 0:
+            os.makedirs(variant_dir, exist_ok=True)
+            hepb_model.write_props(variant_dir)
+
+        Statistics(output_dir=variant_dir, in_memory=model.in_memory or model.rank != 0).record_rows(rows, tick_type)
+
+        model.schedule_run(branch + 1, parameters.params[RUN_TIME])
+        model.run()
+
+    parameters.params.clear()
+    parameters.params.update(base_params)
+
+    return branch
+
+def run(mpi4py_comm, config_file:str, additional_params:str, variants:list, seeds:list) -> None:
+    """ Run the treatment variants for each seed, see run_seed()
+
+        Parameters
+        ----------
+        variants : list
+            the parameter overrides of each variant as dicts, which can only be
+            TREATMENT_PARAMS
+        seeds : list
+            the random seeds, by default the random.seed parameter
+    """
+    init_params(config_file, additional_params)
+    parameters.params[DATA_DIR] = str(Path(config_file).parent)
+
+    for variant in variants:
+        others = set(variant) - set(TREATMENT_PARAMS)
+        if len(others) > 0:
+            raise ValueError(f'Treatment variants can only differ in {TREATMENT_PARAMS}, not {sorted(others)}')
+
+    if seeds is None:
+        seeds = [parameters.params['random.seed']]
+
+    output_dir = parameters.params[OUTPUT_DIRECTORY]
+    run_time = parameters.params[RUN_TIME]
+
+    start = timer()
+    for seed in seeds:
+        branch = run_seed(mpi4py_comm, seed, variants, output_dir)
+
+        if mpi4py_comm.Get_rank() == 0:
+            # The ticks run, against the ticks of a separate run of each variant
+            ticks = branch + len(variants) * (run_time - branch)
+            printf(f'Seed {seed}: {len(variants)} variants branched at tick {branch}, '
+                   f'{ticks} ticks run instead of {len(variants) * run_time}')
+
+    if mpi4py_comm.Get_rank() == 0:
+        printf(f'Scenario tree of {len(seeds)} seeds x {len(variants)} variants finished in {timer() - start:.1f}s')
+
+    hepb_model.reset()
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m hepb_model tree',
+                                     description='Run HepB model treatment variants from a shared untreated prefix')
+    parser.add_argument('parameters_file', help='the model props file')
+    parser.add_argument('parameters', help='JSON model parameters shared by the variants')
+    parser.add_argument('variants_file', help='the file of JSON treatment variants, one per line')
+    parser.add_argument('--seeds', type=int, nargs='+', help='the random seeds, by default random.seed')
+    args = parser.parse_args(args)
+
+    variants = [json.loads(line) for line in read_upf(args.variants_file)]
+
+    run(MPI.COMM_WORLD, args.parameters_file, args.parameters, variants, args.seeds)
@@ -0,0 +1,47 @@
+# This file is part of the HepB Model
+#
+# Per rank Hepatocyte status counters
+#
+#
+
+class StatusCounts:
+    """StatusCounts keeps the number of local cells in each status up to date
+    as the cells change state, so they do not need to be recounted each tick.
+
+    Attributes
+    ----------
+    __instance : StatusCounts
+        StatusCounts singleton
+    susceptible : int
+        number of susceptible cells on this rank
+    eclipsed : int
+        number of eclipsed cells on this rank
+    infected : int
+        number of infected cells on this rank
+    """
+
+    __instance = None
+
+    @staticmethod
+    def getInstance():
+        return StatusCounts.__instance
+
+    def __init__(self, susceptible:int):
+        """Constructor
+
+        Parameters
+        ----------
+        susceptible : int
+            the initial number of (all susceptible) cells on this rank
+        """
+        self.susceptible = susceptible
+        self.eclipsed = 0
+        self.infected = 0
+
+        StatusCounts.__instance = self
+
+    def as_tuple(self):
+        return self.susceptible, self.eclipsed, self.infected
+
+    def close(self):
+        StatusCounts.__instance = None
@@ -0,0 +1,139 @@
+# This file is part of the HepB Model
+#
+# Local process pool runner for parameter sweeps, an alternative to the swift-t
+# workflow in swift_proj for machines without swift-t.
+#
+# Usage, from the project root:
+#   python3 -m hepb_model sweep data/model_props.yaml swift_proj/data/upf_test.txt --workers 4
+#
+
+import argparse, contextlib, json, multiprocessing, os, traceback
+from datetime import datetime
+from timeit import default_timer as timer
+
+import yaml
+
+from .constants import *
+
+def read_upf(upf_file:str) -> list:
+    """ Read the JSON parameter lines of a UPF file, skipping blank lines
+    """
+    with open(upf_file) as f:
+        return [line.strip() for line in f if line.strip() != '']
+
+def run_params(json_params:str, instance:str) -> str:
+    """ Add the run output directory to the JSON parameters, as run_sweep.swift does,
+        where a directory in the parameter line takes precedence.
+    """
+    params = json.loads(json_params)
+    return json.dumps(dict({OUTPUT_DIRECTORY: instance}, **params))
+
+def run_one(task):
+    """ Run one model in a pool worker, with its output to a log file in the run output
+        directory.  The model is imported once per worker.
+
+        Returns
+        -------
+        tuple
+            the run index, the model result (or None), the run time and the error if any
+    """
+    index, config_file, model_params, instance = task
+
+    from mpi4py import MPI
+    from . import hepb_model
+
+    os.makedirs(instance, exist_ok=True)
+
+    start = timer()
+    error = None
+    with open(os.path.join(instance, 'run.log'), 'w') as log, contextlib.redirect_stdout(log):
+        try:
+            hepb_model.run(MPI.COMM_SELF, config_file, model_params)
+        except Exception:
+            error = traceback.format_exc()
+            log.write(error)
+
+    result = hepb_model.get()
+
+    # Release the run, so nothing is kept until the worker's next run
+    hepb_model.reset()
+
+    return index, result, timer() - start, error
+
+def sweep(config_file:str, upf_file:str, output_dir:str, workers:int) -> list:
+    """ Run each line of the UPF file in a pool of worker processes
+
+        Parameters
+        ----------
+        config_file : str
+            the model props file
+        upf_file : str
+            the file of JSON parameter lines, one run per line
+        output_dir : str
+            the sweep output directory, run i writes to output_dir/run_i
+        workers : int
+            number of worker processes
+
+        Returns
+        -------
+        list
+            the (index, result, run time, error) of each run, in the UPF order
+    """
+    lines = read_upf(upf_file)
+
+    tasks = []
+    for i, json_params in enumerate(lines):
+        instance = os.path.join(output_dir, f'run_{i}')
+        tasks.append((i, config_file, run_params(json_params, instance), instance))
+
+    print(f'Sweep of {len(tasks)} runs from {upf_file} with {workers} workers, output to {output_dir}')
+
+    # The workers load the compiled kernels from the cache, rather than each compiling them
+    from .kernels import compile_kernels
+    compile_kernels()
+
+    start = timer()
+    results = []
+
+    # Spawned workers start clean, rather than with a copy of this process
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers) as pool:
+        for index, result, run_time, error in pool.imap_unordered(run_one, tasks):
+            results.append((index, result, run_time, error))
+
+            elapsed = timer() - start
+            status = 'failed' if error is not None else result
+            if status is not None and len(status) > 20:
+                # The stats of the run, see stats.result
+                status = f'done ({len(status)} character result)'
+            print(f'Run {index} {status} in {run_time:.1f}s ({len(results)}/{len(tasks)}, '
+                  f'{3600 * len(results) / elapsed:.1f} runs/hour)', flush=True)
+
+    elapsed = timer() - start
+    failed = sum(1 for r in results if r[3] is not None)
+    print(f'Sweep finished {len(results) - failed} runs ({failed} failed) in {elapsed:.1f}s, '
+          f'{3600 * len(results) / elapsed:.1f} runs/hour')
+
+    return sorted(results)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m hepb_model sweep',
+                                     description='Run the HepB model for each line of a UPF file')
+    parser.add_argument('config_file', help='the model props file')
+    parser.add_argument('upf_file', help='the file of JSON parameter lines, one run per line')
+    parser.add_argument('--output', help='the sweep output directory, by default a timestamped '
+                                         'folder in the props output.directory')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    args = parser.parse_args(args)
+
+    output_dir = args.output
+    if output_dir is None:
+        with open(args.config_file) as f:
+            props = yaml.safe_load(f)
+        output_dir = os.path.join(props.get(OUTPUT_DIRECTORY, 'output'),
+                                  'sweep_' + datetime.now().strftime('%Y-%m-%d_%H-%M-%S'))
+
+    results = sweep(args.config_file, args.upf_file, output_dir, args.workers)
+
+    if any(error is not None for _, _, _, error in results):
+        raise SystemExit(1)
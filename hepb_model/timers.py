@@ -0,0 +1,116 @@
+# This file is part of the HepB Model
+#
+# Per phase timers of the model step, aggregated across ranks
+#
+#
+
+import csv, os
+from time import perf_counter
+
+import numpy as np
+from mpi4py import MPI
+
+from .hepb_utils import printf
+
+# The phases of Model.step(), in order
+STEP_PHASES = ['log_cell_counts', 'infect', 'step_function_viral_proportion', 'update_viral_load',
+               'hepatocyte_step', 'reduce_wait', 'complete_viral_load_update', 'log_stats',
+               'observers', 'checkpoint']
+
+TIMINGS_HEADER = ['phase', 'calls', 'min', 'mean', 'max', 'imbalance', 'max_rank']
+
+class PhaseTimers:
+    """PhaseTimers accumulates the wall clock time of each phase of the model step
+    on this rank.  A phase is timed as a lap from the end of the previous phase, so
+    the timers cost one perf_counter() call per phase.
+
+    The time a rank spends blocked waiting for the other ranks is in the reduce_wait
+    phase, the wait for the reduction of the status counts and virus production, so
+    the imbalance of the compute phases shows up as reduce_wait time on the faster
+    ranks.
+
+    Attributes
+    ----------
+    __instance : PhaseTimers
+        PhaseTimers singleton
+    totals : dict
+        The seconds spent in each phase, by name
+    calls : dict
+        The number of times each phase was timed, by name
+    """
+
+    __instance = None
+
+    @staticmethod
+    def getInstance():
+        return PhaseTimers.__instance
+
+    def __init__(self, phases:list=STEP_PHASES):
+        self.phases = list(phases)
+        self.totals = dict.fromkeys(self.phases, 0.0)
+        self.calls = dict.fromkeys(self.phases, 0)
+
+        PhaseTimers.__instance = self
+
+    @staticmethod
+    def now() -> float:
+        return perf_counter()
+
+    def lap(self, phase:str, start:float) -> float:
+        """ Add the time from start to now to the phase, and return now as the start of
+            the next phase.
+        """
+        now = perf_counter()
+        self.totals[phase] += now - start
+        self.calls[phase] += 1
+        return now
+
+    def summary(self, comm:MPI.Intracomm):
+        """ The min, mean and max across ranks of the time in each phase, on rank 0
+
+            Returns
+            -------
+            list
+                the TIMINGS_HEADER row of each phase on rank 0, None on the other ranks
+        """
+        totals = np.array([self.totals[phase] for phase in self.phases], dtype=np.float64)
+        world_size = comm.Get_size()
+
+        all_totals = np.zeros((world_size, len(self.phases)), dtype=np.float64) if comm.Get_rank() == 0 else None
+        comm.Gather(totals, all_totals, root=0)
+
+        if comm.Get_rank() != 0:
+            return None
+
+        rows = []
+        for i, phase in enumerate(self.phases):
+            times = all_totals[:, i]
+            mean = times.mean()
+            imbalance = times.max() / mean if mean > 0 else 1.0
+            rows.append([phase, self.calls[phase], times.min(), mean, times.max(), imbalance, int(times.argmax())])
+
+        return rows
+
+    def write(self, comm:MPI.Intracomm, fname:str) -> None:
+        """ Write the summary() of the phases to the CSV file on rank 0, and print the
+            phases that take the most time
+        """
+        rows = self.summary(comm)
+        if rows is None:
+            return
+
+        # The output directory is not created for a run with the stats in memory
+        os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok=True)
+
+        with open(fname, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(TIMINGS_HEADER)
+            writer.writerows(rows)
+
+        step_time = sum(row[3] for row in rows)
+        printf(f'Step phase timings ({comm.Get_size()} ranks, mean of {step_time:.2f}s) written to {fname}')
+        for phase, _, _, mean, maximum, imbalance, _ in sorted(rows, key=lambda row: -row[3])[:5]:
+            printf(f'  {phase}: mean {mean:.3f}s, max {maximum:.3f}s, imbalance {imbalance:.2f}')
+
+    def close(self):
+        PhaseTimers.__instance = None
@@ -0,0 +1,64 @@
+# This file is part of the HepB Model
+#
+# Antiviral treatment that reduces the virus production of infected Hepatocytes
+#
+#
+
+import math
+
+from repast4py import parameters
+
+from .constants import *
+from .counter_rng import tick_generator, STREAM_TREATMENT
+
+class Treatment:
+    """Treatment reduces the virus that the infected Hepatocytes release into the
+       blood, from the startOfTreatmentAt tick when isTreatmentUsed.
+
+       The reduction ramps up to reduceProductionRate, closing the fraction
+       reduceProductionRateController of the remaining gap each day, so on day d of
+       the treatment (d = 0, 1, ...) a virion is blocked with probability
+
+           reduceProductionRate * (1 - (1 - reduceProductionRateController) ** (d + 1))
+
+       The virions released at a tick are thinned with one binomial draw, which is
+       the same in distribution as thinning the production of each cell.  The draw
+       is keyed on the seed and the tick (see counter_rng), so every rank computes
+       the same value from the production summed across ranks, and the draws of the
+       other model random values are the same with and without treatment.
+
+    Attributes
+    ----------
+    used : bool
+        If False the production is not changed
+    start : int
+        The first tick of the treatment
+    """
+
+    def __init__(self):
+        self.used = parameters.params.get(IS_TREATMENT_USED, False)
+        self.start = parameters.params.get(START_OF_TREATMENT_AT, 0)
+        self.reduce_production_rate = parameters.params.get(REDUCE_PRODUCTION_RATE, 0.0)
+        self.controller = parameters.params.get(REDUCE_PRODUCTION_RATE_CONTROLLER, 1.0)
+
+        if not 0 <= self.reduce_production_rate <= 1 or not 0 <= self.controller <= 1:
+            raise ValueError(f'{REDUCE_PRODUCTION_RATE} and {REDUCE_PRODUCTION_RATE_CONTROLLER} must be in [0, 1]')
+
+    def reduction(self, tick) -> float:
+        """ The probability that a virion released at the tick is blocked
+        """
+        if not self.used or tick < self.start:
+            return 0.0
+
+        day = math.floor((tick - self.start) / STEPHOUR)
+        return self.reduce_production_rate * (1.0 - (1.0 - self.controller) ** (day + 1))
+
+    def release(self, tick, produced:int, seed:int) -> int:
+        """ The number of the produced virions that are released at the tick under treatment
+        """
+        reduction = self.reduction(tick)
+        if reduction == 0 or produced == 0:
+            return produced
+
+        rng = tick_generator(seed, STREAM_TREATMENT, int(tick))
+        return int(rng.binomial(produced, 1.0 - reduction))
@@ -0,0 +1,19 @@
+# This file is part of the HepB Model
+#
+# Shared helpers of the model tests.  The test modules import them with
+# "from conftest import ...", which works under unittest discover (the tests
+# folder is the top level folder) and pytest (which loads this file first).
+#
+
+import importlib.util
+import unittest
+
+def has_dependencies() -> bool:
+    """ Whether mpi4py and repast4py, which the model imports, are installed
+    """
+    return all(importlib.util.find_spec(name) is not None for name in ['mpi4py', 'repast4py'])
+
+# Skip a test or test class without the model dependencies, or without pyarrow for the
+#   Parquet and Arrow stats files
+requires_model = unittest.skipUnless(has_dependencies(), 'mpi4py and repast4py are needed for the model')
+requires_pyarrow = unittest.skipUnless(importlib.util.find_spec('pyarrow') is not None, 'pyarrow is needed')
@@ -0,0 +1,122 @@
+# This file is part of the HepB Model
+#
+# The early rejection distance and the ABC-SMC generations
+#
+
+import contextlib
+import io
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from conftest import requires_model
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROPS = os.path.join(ROOT_DIR, 'data', 'model_props.yaml')
+
+PARAMS = {'gridWidth': 10, 'gridHeight': 100, 'runTime': 120, 'hepatocyte.engine': 'array'}
+
+@requires_model
+class TestEarlyRejection(unittest.TestCase):
+
+    TICKS = np.array([10, 20, 30])
+    VALUES = np.array([1.0, 2.0, 3.0])
+
+    def score(self, rejection, viral_loads:dict) -> list:
+        return [rejection.update(None, float(tick), 0, 0, 0, viral_load) for tick, viral_load in viral_loads.items()]
+
+    def test_distance(self):
+        from hepb_model.calibration import EarlyRejection
+
+        rejection = EarlyRejection(self.TICKS, self.VALUES)
+        stops = self.score(rejection, {5: 10, 10: 10, 20: 1000, 30: 0})
+
+        # Stopped at the last target tick, 0 for no virus
+        self.assertEqual(stops, [False, False, False, True])
+        self.assertAlmostEqual(rejection.distance(), math.sqrt((0 + 1 + 9) / 3))
+        self.assertFalse(rejection.rejected)
+
+    def test_rejected_over_threshold(self):
+        from hepb_model.calibration import EarlyRejection
+
+        rejection = EarlyRejection(self.TICKS, self.VALUES, threshold=1.0)
+        stops = self.score(rejection, {10: 10, 20: 10 ** 4})
+
+        self.assertEqual(stops, [False, True])
+        self.assertTrue(rejection.rejected)
+        self.assertEqual(rejection.distance(), math.inf)
+
+    def test_ended_before_the_last_target(self):
+        from hepb_model.calibration import EarlyRejection
+
+        rejection = EarlyRejection(self.TICKS, self.VALUES)
+        self.score(rejection, {10: 10, 20: 100})
+
+        self.assertFalse(rejection.rejected)
+        self.assertEqual(rejection.distance(), math.inf)
+
+@requires_model
+class TestABCSMC(unittest.TestCase):
+
+    def setUp(self):
+        from repast4py import parameters
+
+        self.output_dir = tempfile.mkdtemp(prefix='hepb_test_calibration_')
+        self.saved_params = dict(parameters.params)
+
+    def tearDown(self):
+        from repast4py import parameters
+
+        parameters.params.clear()
+        parameters.params.update(self.saved_params)
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def write_target(self, ticks, values) -> str:
+        fname = os.path.join(self.output_dir, 'target.csv')
+        with open(fname, 'w') as f:
+            f.write('tick,viral load (log)\n')
+            for tick, value in zip(ticks, values):
+                f.write(f'{tick},{value}\n')
+        return fname
+
+    def calibration(self, target_file:str, **kwargs):
+        from hepb_model.calibration import ABCSMC
+
+        priors = {'viralInfectionRate': (0.005, 0.05)}
+        return ABCSMC(PROPS, PARAMS, target_file, priors, os.path.join(self.output_dir, 'abc'), **kwargs)
+
+    def test_generations(self):
+        # A target log10 viral load that rises from 1 to 3.5
+        ticks = np.arange(20, 121, 20)
+        target_file = self.write_target(ticks, 0.5 + ticks / 40)
+
+        abc = self.calibration(target_file, num_particles=6, seed=3)
+        with contextlib.redirect_stdout(io.StringIO()):
+            abc.run(3)
+
+        self.assertEqual(abc.generation, 3)
+        self.assertEqual(len(abc.particles), 6)
+        self.assertAlmostEqual(abc.weights.sum(), 1.0)
+        self.assertTrue(np.all(np.isfinite(abc.distances)))
+        self.assertTrue(math.isfinite(abc.threshold))
+        self.assertTrue(np.all((abc.particles >= 0.005) & (abc.particles <= 0.05)))
+        for g in range(3):
+            self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'abc', f'generation_{g}.csv')))
+
+    def test_runs_ending_early_are_not_accepted(self):
+        # The last target tick is after the runTime, so no run reaches it
+        target_file = self.write_target([50, PARAMS['runTime'] + 10], [2.0, 3.0])
+
+        abc = self.calibration(target_file, num_particles=2, max_runs=4)
+        with contextlib.redirect_stdout(io.StringIO()), self.assertRaises(RuntimeError):
+            abc.run(1)
+
+        self.assertIsNone(abc.particles)
+        self.assertEqual(abc.threshold, math.inf)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# This file is part of the HepB Model
+#
+# A run resumed from a checkpoint has the stats of an uninterrupted run
+#
+
+import contextlib
+import glob
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from conftest import requires_model, requires_pyarrow
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROPS = os.path.join(ROOT_DIR, 'data', 'model_props.yaml')
+
+# Checkpoints at ticks 100 and 200, the run resumes from 100 once 200 is removed
+PARAMS = {'gridWidth': 30, 'gridHeight': 100, 'runTime': 250, 'random.seed': 18, 'checkpoint.interval': 100}
+
+@requires_model
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(prefix='hepb_test_checkpoint_')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def stats_files(self) -> list:
+        return glob.glob(os.path.join(self.output_dir, 'run_*_stats.*'))
+
+    def read_stats(self) -> bytes:
+        fnames = self.stats_files()
+        self.assertEqual(len(fnames), 1)
+        with open(fnames[0], 'rb') as f:
+            return f.read()
+
+    def assert_resume_matches_full_run(self, **params):
+        from mpi4py import MPI
+        from hepb_model import hepb_model
+
+        params = dict(PARAMS, **params, **{'output.directory': self.output_dir})
+
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            hepb_model.run(MPI.COMM_WORLD, PROPS, json.dumps(params))
+            full = self.read_stats()
+
+            for fname in glob.glob(os.path.join(self.output_dir, 'checkpoints', '*_tick200.npz')):
+                os.remove(fname)
+
+            hepb_model.run(MPI.COMM_WORLD, PROPS, json.dumps(dict(params, **{'checkpoint.resume': True})))
+
+        self.assertIn('Resumed from the checkpoint at tick 100', out.getvalue())
+        self.assertEqual(self.read_stats(), full)
+
+    def test_object(self):
+        self.assert_resume_matches_full_run(**{'hepatocyte.engine': 'object'})
+
+    def test_array(self):
+        self.assert_resume_matches_full_run(**{'hepatocyte.engine': 'array'})
+
+    def test_cohort(self):
+        self.assert_resume_matches_full_run(**{'hepatocyte.engine': 'cohort'})
+
+    def test_rank_invariant(self):
+        self.assert_resume_matches_full_run(**{'hepatocyte.engine': 'array', 'rank.invariant': True})
+
+    def test_treatment(self):
+        self.assert_resume_matches_full_run(**{'hepatocyte.engine': 'array', 'isTreatmentUsed': True,
+                                               'startOfTreatmentAt': 150})
+
+    def test_convergence(self):
+        # With any change within the tolerance the run converges at tick 24 + 120, after the
+        #   checkpoint, from a window that starts before it
+        self.assert_resume_matches_full_run(**{'hepatocyte.engine': 'array', 'convergence.window': 120,
+                                               'convergence.tolerance': 1000.0, 'convergence.fill': True})
+
+    @requires_pyarrow
+    def test_parquet(self):
+        self.assert_resume_matches_full_run(**{'hepatocyte.engine': 'object', 'stats.output.file': 'stats.parquet'})
+
+if __name__ == '__main__':
+    unittest.main()
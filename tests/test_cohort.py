@@ -0,0 +1,77 @@
+# This file is part of the HepB Model
+#
+# The cohort engine has the distribution of outcomes of the object engine
+#
+
+import contextlib
+import io
+import json
+import os
+import unittest
+
+import numpy as np
+
+from conftest import requires_model
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROPS = os.path.join(ROOT_DIR, 'data', 'model_props.yaml')
+
+CELLS = 30 * 100
+TICKS = [100, 200, 300]
+PARAMS = {'gridWidth': 30, 'gridHeight': 100, 'runTime': 300, 'stats.in.memory': True,
+          'stats.result': 'summary', 'stats.result.ticks': TICKS}
+SEEDS = range(1, 31)
+
+@requires_model
+class TestCohort(unittest.TestCase):
+
+    def setUp(self):
+        from repast4py import parameters
+
+        self.saved_params = dict(parameters.params)
+
+    def tearDown(self):
+        from repast4py import parameters
+
+        parameters.params.clear()
+        parameters.params.update(self.saved_params)
+
+    def summaries(self, engine:str) -> dict:
+        """ The stats columns at the TICKS of a run of each seed, shape (seeds, ticks)
+        """
+        from mpi4py import MPI
+        from hepb_model import hepb_model
+
+        columns = {}
+        for seed in SEEDS:
+            params = dict(PARAMS, **{'hepatocyte.engine': engine, 'random.seed': seed})
+            with contextlib.redirect_stdout(io.StringIO()):
+                hepb_model.run(MPI.COMM_WORLD, PROPS, json.dumps(params))
+
+            for name, values in json.loads(hepb_model.get()).items():
+                columns.setdefault(name, []).append(values)
+
+        return {name: np.array(values) for name, values in columns.items()}
+
+    def test_same_distribution_as_object_engine(self):
+        cohort = self.summaries('cohort')
+        reference = self.summaries('object')
+
+        # Every cell is in one status
+        np.testing.assert_array_equal(cohort['susceptible'] + cohort['eclipsed'] + cohort['infected'], CELLS)
+
+        for name in ['susceptible', 'eclipsed', 'infected', 'viral_load_log']:
+            a = cohort[name]
+            b = reference[name]
+
+            # The means at each tick within 4 standard errors of their difference, and
+            #   the standard deviations within a factor of 2
+            se = np.sqrt(a.var(axis=0, ddof=1) / len(a) + b.var(axis=0, ddof=1) / len(b))
+            with self.subTest(column=name):
+                self.assertTrue(np.all(np.abs(a.mean(axis=0) - b.mean(axis=0)) <= 4 * se + 1e-9),
+                                f'{a.mean(axis=0)} against {b.mean(axis=0)}, se {se}')
+                ratio = a.std(axis=0) / np.maximum(b.std(axis=0), 1e-9)
+                self.assertTrue(np.all((ratio > 0.5) & (ratio < 2.0)), f'standard deviation ratios {ratio}')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+# This file is part of the HepB Model
+#
+# A run ends at the tick it converges at, and only once the window is steady
+#
+
+import contextlib
+import glob
+import io
+import json
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+from conftest import requires_model
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROPS = os.path.join(ROOT_DIR, 'data', 'model_props.yaml')
+
+WINDOW = 50
+PARAMS = {'gridWidth': 30, 'gridHeight': 100, 'runTime': 250, 'hepatocyte.engine': 'array',
+          'convergence.window': WINDOW}
+
+def read_stats(output_dir:str) -> list:
+    fnames = glob.glob(os.path.join(output_dir, 'run_*_stats.csv'))
+    assert len(fnames) == 1, fnames
+    with open(fnames[0]) as f:
+        return [line.split(',') for line in f.read().splitlines()[1:]]
+
+@requires_model
+class TestConvergenceMonitor(unittest.TestCase):
+
+    def setUp(self):
+        from repast4py import parameters
+
+        self.saved_params = dict(parameters.params)
+        parameters.params.update({'viralDegradationRate': 0.1, 'isTreatmentUsed': False})
+
+        # Not rank 0, so nothing is printed or filled in
+        self.model = types.SimpleNamespace(rank=1)
+
+    def tearDown(self):
+        from repast4py import parameters
+
+        parameters.params.clear()
+        parameters.params.update(self.saved_params)
+
+    def test_stops_after_a_steady_window(self):
+        from hepb_model.constants import STEPHOUR
+        from hepb_model.convergence import ConvergenceMonitor
+
+        monitor = ConvergenceMonitor(10, 0.01)
+
+        # The ticks of the first day are not considered, however steady
+        stops = [monitor.update(self.model, tick, 100, 0, 0, 1000) for tick in range(1, STEPHOUR + 10)]
+        self.assertFalse(any(stops))
+
+        self.assertTrue(monitor.update(self.model, STEPHOUR + 10, 100, 0, 0, 1000))
+        self.assertEqual(monitor.converged_at, STEPHOUR + 10)
+
+    def test_a_change_restarts_the_window(self):
+        from hepb_model.constants import STEPHOUR
+        from hepb_model.convergence import ConvergenceMonitor
+
+        monitor = ConvergenceMonitor(10, 0.01)
+
+        # A viral load change over 1% of its mean at STEPHOUR + 5 is in the window, of the
+        #   last 10 changes, until STEPHOUR + 15
+        viral_loads = {STEPHOUR + 5: 1100}
+        for tick in range(STEPHOUR, STEPHOUR + 20):
+            if monitor.update(self.model, tick, 100, 0, 0, viral_loads.get(tick, 1000)):
+                break
+
+        self.assertEqual(monitor.converged_at, STEPHOUR + 16)
+
+@requires_model
+class TestConvergenceRun(unittest.TestCase):
+
+    def setUp(self):
+        from repast4py import parameters
+
+        self.output_dir = tempfile.mkdtemp(prefix='hepb_test_convergence_')
+        self.saved_params = dict(parameters.params)
+
+    def tearDown(self):
+        from repast4py import parameters
+
+        parameters.params.clear()
+        parameters.params.update(self.saved_params)
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def run_model(self, **params) -> list:
+        from mpi4py import MPI
+        from hepb_model import hepb_model
+
+        params = dict(PARAMS, **params, **{'output.directory': self.output_dir})
+        with contextlib.redirect_stdout(io.StringIO()):
+            hepb_model.run(MPI.COMM_WORLD, PROPS, json.dumps(params))
+
+        return read_stats(self.output_dir)
+
+    def test_stop_tick(self):
+        from hepb_model.constants import STEPHOUR
+
+        # A tolerance that is always met stops the run a window after the first day
+        rows = self.run_model(**{'convergence.tolerance': 1000.0})
+
+        self.assertEqual(len(rows), STEPHOUR + WINDOW)
+        self.assertEqual(int(rows[-1][1]), STEPHOUR + WINDOW)
+
+    def test_stop_tick_after_the_treatment_start(self):
+        rows = self.run_model(**{'convergence.tolerance': 1000.0, 'isTreatmentUsed': True, 'startOfTreatmentAt': 100})
+
+        self.assertEqual(int(rows[-1][1]), 100 + WINDOW)
+
+    def test_fill(self):
+        from hepb_model.constants import STEPHOUR
+
+        rows = self.run_model(**{'convergence.tolerance': 1000.0, 'convergence.fill': True})
+
+        # The rows to the run time, with the status counts of the stop tick
+        self.assertEqual([int(row[1]) for row in rows], list(range(1, PARAMS['runTime'] + 1)))
+        for row in rows[STEPHOUR + WINDOW:]:
+            self.assertEqual(row[2:5], rows[STEPHOUR + WINDOW - 1][2:5])
+
+    def test_no_stop_while_changing(self):
+        # The infection is still spreading at the run time
+        rows = self.run_model(**{'convergence.tolerance': 0.0})
+
+        self.assertEqual(len(rows), PARAMS['runTime'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# This file is part of the HepB Model
+#
+# The replicates of an ensemble have the stats of single array engine runs
+#
+
+import contextlib
+import glob
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from conftest import requires_model
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROPS = os.path.join(ROOT_DIR, 'data', 'model_props.yaml')
+
+PARAMS = {'gridWidth': 30, 'gridHeight': 100, 'runTime': 250, 'hepatocyte.engine': 'array'}
+
+def read_stats(output_dir:str) -> str:
+    fnames = glob.glob(os.path.join(output_dir, 'run_*_stats.csv'))
+    assert len(fnames) == 1, fnames
+    with open(fnames[0]) as f:
+        return f.read()
+
+@requires_model
+class TestEnsemble(unittest.TestCase):
+
+    def setUp(self):
+        from repast4py import parameters
+
+        self.output_dir = tempfile.mkdtemp(prefix='hepb_test_ensemble_')
+        self.saved_params = dict(parameters.params)
+
+    def tearDown(self):
+        from repast4py import parameters
+
+        parameters.params.clear()
+        parameters.params.update(self.saved_params)
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def run_model(self, params, replicates=None):
+        from mpi4py import MPI
+        from hepb_model import hepb_model
+
+        params = json.dumps(params) if replicates is None else [dict(params, **r) for r in replicates]
+        with contextlib.redirect_stdout(io.StringIO()):
+            hepb_model.run(MPI.COMM_WORLD, PROPS, params)
+
+    def test_replicates_match_single_runs(self):
+        replicates = [{'random.seed': 18, 'run.number': 1},
+                      {'random.seed': 7, 'run.number': 2},
+                      {'random.seed': 18, 'run.number': 3, 'viralInfectionRate': 2e-5}]
+        self.run_model(dict(PARAMS, **{'output.directory': self.output_dir}), replicates)
+
+        for i, replicate in enumerate(replicates):
+            single_dir = os.path.join(self.output_dir, f'single_{i}')
+            self.run_model(dict(PARAMS, **replicate, **{'output.directory': single_dir}))
+
+            with self.subTest(replicate=replicate):
+                self.assertEqual(read_stats(os.path.join(self.output_dir, f'run_{i}')), read_stats(single_dir))
+
+    def test_shared_output_directory(self):
+        # As the lines of a UPF, which often share an output.directory
+        shared_dir = os.path.join(self.output_dir, 'shared')
+        own_dir = os.path.join(self.output_dir, 'own')
+        replicates = [{'random.seed': 1, 'output.directory': shared_dir},
+                      {'random.seed': 2, 'output.directory': shared_dir},
+                      {'random.seed': 3, 'output.directory': own_dir}]
+        self.run_model(dict(PARAMS, **{'output.directory': self.output_dir}), replicates)
+
+        for i, run_dir in enumerate([os.path.join(shared_dir, 'run_0'), os.path.join(shared_dir, 'run_1'), own_dir]):
+            with self.subTest(run_dir=run_dir):
+                self.assertEqual(len(read_stats(run_dir).splitlines()), 1 + PARAMS['runTime'])
+
+        self.assertEqual(glob.glob(os.path.join(shared_dir, 'run_*_stats.csv')), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# This file is part of the HepB Model
+#
+# The forked replicates of a fan-out have the stats of normal runs, and their own checkpoints
+#
+
+import contextlib
+import glob
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from conftest import requires_model
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROPS = os.path.join(ROOT_DIR, 'data', 'model_props.yaml')
+
+PARAMS = {'gridWidth': 30, 'gridHeight': 100, 'runTime': 250, 'hepatocyte.engine': 'array'}
+SEEDS = [18, 7]
+
+def read_stats(output_dir:str) -> bytes:
+    fnames = glob.glob(os.path.join(output_dir, 'run_*_stats.csv'))
+    assert len(fnames) == 1, fnames
+    with open(fnames[0], 'rb') as f:
+        return f.read()
+
+@requires_model
+@unittest.skipUnless(hasattr(os, 'fork'), 'the fan-out forks the model')
+class TestFanout(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(prefix='hepb_test_fanout_')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def fanout(self, **params):
+        from mpi4py import MPI
+        from hepb_model import fanout
+
+        params = dict(PARAMS, **params, **{'output.directory': self.output_dir})
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = fanout.run(MPI.COMM_WORLD, PROPS, json.dumps(params), SEEDS, workers=2)
+
+        for result in results:
+            self.assertEqual(result['exit_status'], 0, result['error'])
+
+    def test_replicates_match_normal_runs(self):
+        from mpi4py import MPI
+        from hepb_model import hepb_model
+
+        self.fanout()
+
+        for i, seed in enumerate(SEEDS):
+            single_dir = os.path.join(self.output_dir, f'single_{i}')
+            params = dict(PARAMS, **{'random.seed': seed, 'output.directory': single_dir})
+            with contextlib.redirect_stdout(io.StringIO()):
+                hepb_model.run(MPI.COMM_WORLD, PROPS, json.dumps(params))
+
+            with self.subTest(seed=seed):
+                self.assertEqual(read_stats(os.path.join(self.output_dir, f'run_{i}')), read_stats(single_dir))
+
+    def test_checkpoint_resume(self):
+        self.fanout(**{'checkpoint.interval': 100})
+
+        full = []
+        for i in range(len(SEEDS)):
+            run_dir = os.path.join(self.output_dir, f'run_{i}')
+            full.append(read_stats(run_dir))
+
+            # Each replicate checkpoints to its own folder
+            self.assertEqual(len(glob.glob(os.path.join(run_dir, 'checkpoints', '*.npz'))), 2)
+            for fname in glob.glob(os.path.join(run_dir, 'checkpoints', '*_tick200.npz')):
+                os.remove(fname)
+
+        self.assertNotEqual(full[0], full[1])
+        self.assertEqual(glob.glob(os.path.join(self.output_dir, 'checkpoints', '*.npz')), [])
+
+        # A resumed replicate continues the stats file of the checkpoint and removes its new 
+        #   one, which has another name a second later, while a new run would keep both
+        time.sleep(1)
+        self.fanout(**{'checkpoint.interval': 100, 'checkpoint.resume': True})
+
+        for i in range(len(SEEDS)):
+            with self.subTest(replicate=i):
+                self.assertEqual(read_stats(os.path.join(self.output_dir, f'run_{i}')), full[i])
+
+if __name__ == '__main__':
+    unittest.main()
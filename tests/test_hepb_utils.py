@@ -0,0 +1,168 @@
+# This file is part of the HepB Model
+#
+# The susceptible cell pool and the infection sampler
+#
+
+import unittest
+
+import numpy as np
+
+from conftest import requires_model
+
+@requires_model
+class TestIndexPool(unittest.TestCase):
+
+    def assert_consistent(self, pool, expected:set):
+        items = pool.items[:pool.size]
+        self.assertEqual(set(items.tolist()), expected)
+        self.assertEqual(len(pool), len(expected))
+
+        np.testing.assert_array_equal(pool.positions[items], np.arange(pool.size))
+        for item in range(len(pool.positions)):
+            self.assertEqual(item in pool, item in expected)
+
+    def test_remove(self):
+        from hepb_model.hepb_utils import IndexPool
+
+        pool = IndexPool(10)
+        expected = set(range(10))
+        for item in (3, 9, 0, 4):
+            pool.remove(item)
+            expected.remove(item)
+            self.assert_consistent(pool, expected)
+
+    def test_remove_at(self):
+        from hepb_model.hepb_utils import IndexPool
+
+        rng = np.random.default_rng(1)
+        pool = IndexPool(500)
+        expected = set(range(500))
+
+        while len(pool) > 0:
+            k = int(rng.integers(1, min(len(pool), 40) + 1))
+            chosen = rng.choice(len(pool), k, replace=False)
+            at_chosen = pool.items[chosen].copy()
+
+            selected = pool.remove_at(chosen)
+
+            # The indices at the chosen positions, in the order of the positions
+            np.testing.assert_array_equal(selected, at_chosen)
+            expected -= set(selected.tolist())
+            self.assert_consistent(pool, expected)
+
+    def test_remove_at_tail_and_empty(self):
+        from hepb_model.hepb_utils import IndexPool
+
+        pool = IndexPool(6)
+        np.testing.assert_array_equal(pool.remove_at(np.array([5, 4], dtype=np.int64)), [5, 4])
+        self.assert_consistent(pool, {0, 1, 2, 3})
+
+        self.assertEqual(len(pool.remove_at(np.zeros(0, dtype=np.int64))), 0)
+        self.assert_consistent(pool, {0, 1, 2, 3})
+
+    def test_state(self):
+        from hepb_model.hepb_utils import IndexPool
+
+        pool = IndexPool(20)
+        pool.remove_at(np.array([2, 7, 19], dtype=np.int64))
+
+        restored = IndexPool(20)
+        restored.set_state(pool.get_state())
+        self.assert_consistent(restored, set(pool.items[:pool.size].tolist()))
+
+@requires_model
+class TestSampleInfections(unittest.TestCase):
+
+    TOTAL_CELLS = 1000
+    NOT_SUSCEPTIBLE = 400   # cells 0..399 are not in the pool
+    SELECTED = 120
+    TRIALS = 4000
+
+    def setUp(self):
+        from repast4py import parameters
+        from hepb_model.constants import (ECLIPSED_TO_INFECTED_PHASE_TRANSITION_MIN,
+                                          ECLIPSED_TO_INFECTED_PHASE_TRANSITION_MAX)
+
+        self.saved_params = dict(parameters.params)
+        parameters.params.update({ECLIPSED_TO_INFECTED_PHASE_TRANSITION_MIN: 1,
+                                  ECLIPSED_TO_INFECTED_PHASE_TRANSITION_MAX: 2})
+
+    def tearDown(self):
+        from repast4py import parameters
+
+        parameters.params.clear()
+        parameters.params.update(self.saved_params)
+
+    def sampled_counts(self):
+        """ The number of cells infected in each trial, and how often each cell was infected
+        """
+        from hepb_model.hepb_utils import IndexPool, sample_infections
+        from hepb_model.distributions import Distributions
+
+        distributions = Distributions(np.random.default_rng(2))
+
+        pool = IndexPool(self.TOTAL_CELLS)
+        pool.remove_at(np.arange(self.NOT_SUSCEPTIBLE))
+        state = {name: np.copy(value) for name, value in pool.get_state().items()}
+
+        counts = np.zeros(self.TRIALS, dtype=np.int64)
+        per_cell = np.zeros(self.TOTAL_CELLS, dtype=np.int64)
+        for t in range(self.TRIALS):
+            pool.set_state(state)
+            cells = sample_infections(pool, self.TOTAL_CELLS, self.SELECTED, distributions)
+
+            self.assertEqual(len(set(cells.tolist())), len(cells))
+            self.assertFalse(any(cell in pool for cell in cells))
+
+            counts[t] = len(cells)
+            per_cell[cells] += 1
+
+        distributions.close()
+        return counts, per_cell
+
+    def shuffle_counts(self):
+        """ The reference: the susceptible cells among the first cells of a full shuffle
+        """
+        rng = np.random.default_rng(3)
+        counts = np.zeros(self.TRIALS, dtype=np.int64)
+        per_cell = np.zeros(self.TOTAL_CELLS, dtype=np.int64)
+        for t in range(self.TRIALS):
+            selected = rng.permutation(self.TOTAL_CELLS)[:self.SELECTED]
+            cells = selected[selected >= self.NOT_SUSCEPTIBLE]
+
+            counts[t] = len(cells)
+            per_cell[cells] += 1
+
+        return counts, per_cell
+
+    def test_matches_shuffle_in_distribution(self):
+        counts, per_cell = self.sampled_counts()
+        reference, reference_per_cell = self.shuffle_counts()
+
+        # The hypergeometric mean and variance of the number of susceptible cells selected
+        susceptible = self.TOTAL_CELLS - self.NOT_SUSCEPTIBLE
+        p = susceptible / self.TOTAL_CELLS
+        mean = self.SELECTED * p
+        variance = mean * (1 - p) * (self.TOTAL_CELLS - self.SELECTED) / (self.TOTAL_CELLS - 1)
+        se = np.sqrt(variance / self.TRIALS)
+
+        for values in (counts, reference):
+            self.assertAlmostEqual(values.mean(), mean, delta=5 * se)
+            self.assertAlmostEqual(values.var(), variance, delta=0.15 * variance)
+
+        # The same distribution of the counts, by a two sample chi-square test over the
+        #   central values (p > 0.001 for 11 degrees of freedom)
+        bins = np.arange(int(mean) - 6, int(mean) + 7)
+        a = np.histogram(np.clip(counts, bins[0], bins[-1] - 1), bins)[0]
+        b = np.histogram(np.clip(reference, bins[0], bins[-1] - 1), bins)[0]
+        chi2 = np.sum((a - b) ** 2 / np.maximum(a + b, 1))
+        self.assertLess(chi2, 31.3)
+
+        # Only susceptible cells, each as likely as in the shuffle
+        self.assertEqual(per_cell[:self.NOT_SUSCEPTIBLE].sum(), 0)
+        rate = self.TRIALS * self.SELECTED / self.TOTAL_CELLS
+        for frequencies in (per_cell, reference_per_cell):
+            self.assertLess(np.abs(frequencies[self.NOT_SUSCEPTIBLE:] - rate).max(), 6 * np.sqrt(rate))
+
+if __name__ == '__main__':
+    unittest.main()
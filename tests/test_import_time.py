@@ -0,0 +1,60 @@
+# This file is part of the HepB Model
+#
+# Import time budget of the model, for sweeps of many short runs
+#
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+from conftest import requires_model
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds that importing hepb_model may take over its dependencies
+IMPORT_BUDGET = float(os.environ.get('HEPB_IMPORT_BUDGET', 0.5))
+
+# The model imports these itself, so they are not counted in its import time
+DEPENDENCIES = ['numpy', 'mpi4py.MPI', 'repast4py.core', 'repast4py.context', 'repast4py.network',
+                'repast4py.parameters', 'repast4py.random', 'repast4py.schedule', 'repast4py.space']
+
+# Imported in a new process, as the time of the first import is what a run pays
+IMPORT_SCRIPT = f"""
+import importlib, json, sys
+from time import perf_counter
+
+for module in {DEPENDENCIES!r}:
+    importlib.import_module(module)
+
+start = perf_counter()
+import hepb_model
+print(json.dumps(dict(seconds=perf_counter() - start, modules=sorted(sys.modules))))
+"""
+
+@requires_model
+class TestImportTime(unittest.TestCase):
+
+    def import_model(self) -> dict:
+        out = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=ROOT_DIR, 
+                             capture_output=True, text=True, check=True).stdout
+        return json.loads(out.splitlines()[-1])
+
+    def test_import_budget(self):
+        # The fastest of a few imports, as the first one can be slowed by the disk
+        seconds = min(self.import_model()['seconds'] for _ in range(3))
+        self.assertLessEqual(seconds, IMPORT_BUDGET, 
+                             f'import hepb_model took {seconds:.3f}s, over the budget of {IMPORT_BUDGET}s')
+
+    def test_analysis_modules_not_imported(self):
+        modules = self.import_model()['modules']
+        self.assertNotIn('pandas', modules)
+
+    def test_kernels_not_imported(self):
+        # The numba kernels are imported when a run first needs them
+        modules = self.import_model()['modules']
+        self.assertNotIn('hepb_model.kernels', modules)
+
+if __name__ == '__main__':
+    unittest.main()
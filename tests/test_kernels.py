@@ -0,0 +1,204 @@
+# This file is part of the HepB Model
+#
+# The compiled kernels of the array engine match the Python paths they replace
+#
+
+import contextlib
+import io
+import json
+import os
+import unittest
+
+import numpy as np
+
+from conftest import requires_model
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROPS = os.path.join(ROOT_DIR, 'data', 'model_props.yaml')
+
+SUSCEPTIBLE, ECLIPSED, INFECTED = 0, 1, 2
+
+def reference_infect_with_neighbors(raster, selected, uniforms):
+    """ The object engine neighbor infection (HepatocyteLocal.infect()) on a raster, with
+        the neighbors from GridNghFinder and the two picks from the uniforms.
+    """
+    from hepb_model.kernels import GridNghFinder
+
+    columns, height = raster.shape
+    finder = GridNghFinder(0, 0, columns - 1, height - 1)
+
+    eclipsed = []
+    for k, cell in enumerate(selected):
+        x, y = 1 + cell // height, cell % height
+
+        if raster[x, y] == SUSCEPTIBLE:
+            raster[x, y] = ECLIPSED
+            eclipsed.append((x, y))
+            continue
+
+        nghs = [(nx, ny) for nx, ny, _ in finder.find(x, y) if raster[nx, ny] == SUSCEPTIBLE]
+        if len(nghs) == 0:
+            continue
+
+        for u in uniforms[k]:
+            nx, ny = nghs[int(u * len(nghs))]
+            if raster[nx, ny] == SUSCEPTIBLE:
+                raster[nx, ny] = ECLIPSED
+                eclipsed.append((nx, ny))
+
+    local = [(x - 1) * height + y for x, y in eclipsed if 0 < x < columns - 1]
+    ghosts = [x * height + y for x, y in eclipsed if x == 0 or x == columns - 1]
+
+    return local, ghosts
+
+def reference_step(status, eclipsed_phase_period, first_infectious_status_time, next_production,
+                   virions, interval, tick):
+    """ HepatocyteArray.step() without the event calendar, for the cells of one replicate
+    """
+    due = (status == ECLIPSED) & (eclipsed_phase_period == tick)
+    status[due] = INFECTED
+    eclipsed_phase_period[due] = 0
+    first_infectious_status_time[due] = 1
+    next_production[due] = tick + 1
+
+    producing = np.flatnonzero((status == INFECTED) & (next_production == tick))
+    cycle = np.minimum(first_infectious_status_time[producing], len(virions) - 1)
+    first_infectious_status_time[producing] += 1
+    next_production[producing] = tick + interval[cycle]
+
+    return int(due.sum()), int(virions[cycle].sum())
+
+@requires_model
+class TestInfectWithNeighbors(unittest.TestCase):
+
+    def random_raster(self, rng, columns:int, height:int, ghosts:bool):
+        from hepb_model.kernels import NO_CELL
+
+        raster = rng.choice(np.array([SUSCEPTIBLE, ECLIPSED, INFECTED], dtype=np.int8),
+                            size=(columns + 2, height), p=[0.6, 0.2, 0.2])
+        if not ghosts:
+            raster[0] = NO_CELL
+            raster[-1] = NO_CELL
+
+        return raster
+
+    def test_matches_object_engine(self):
+        from hepb_model.kernels import infect_with_neighbors
+
+        for seed in range(20):
+            rng = np.random.default_rng(seed)
+            columns, height = int(rng.integers(1, 6)), int(rng.integers(1, 12))
+            raster = self.random_raster(rng, columns, height, ghosts=seed % 2 == 0)
+
+            n = int(rng.integers(1, columns * height + 1))
+            selected = rng.choice(columns * height, size=n, replace=False).astype(np.int64)
+            uniforms = rng.random((n, 2))
+
+            expected_raster = raster.copy()
+            expected_local, expected_ghosts = reference_infect_with_neighbors(expected_raster, selected, uniforms)
+
+            local, ghosts = infect_with_neighbors(raster, selected, uniforms, SUSCEPTIBLE, ECLIPSED)
+
+            with self.subTest(seed=seed):
+                np.testing.assert_array_equal(raster, expected_raster)
+                self.assertEqual(local.tolist(), expected_local)
+                self.assertEqual(ghosts.tolist(), expected_ghosts)
+                # A cell picked twice is eclipsed once
+                self.assertEqual(len(np.unique(local)), len(local))
+
+    def test_no_neighbors_outside_the_grid(self):
+        from hepb_model.kernels import infect_with_neighbors, NO_CELL
+
+        # One infected cell in the corner of a grid of one column, with no ghost columns
+        raster = np.full((3, 2), NO_CELL, dtype=np.int8)
+        raster[1] = [INFECTED, SUSCEPTIBLE]
+
+        local, ghosts = infect_with_neighbors(raster, np.array([0]), np.array([[0.0, 0.99]]), SUSCEPTIBLE, ECLIPSED)
+
+        self.assertEqual(local.tolist(), [1])
+        self.assertEqual(ghosts.tolist(), [])
+        self.assertEqual(raster[1].tolist(), [INFECTED, ECLIPSED])
+        self.assertTrue(np.all(raster[[0, 2]] == NO_CELL))
+
+@requires_model
+class TestStepReplicates(unittest.TestCase):
+
+    def test_matches_array_step(self):
+        from hepb_model.kernels import step_replicates
+
+        rng = np.random.default_rng(5)
+        replicates, cells, tick = 4, 500, 10
+        virions = rng.integers(0, 100, size=6)
+        interval = rng.integers(1, 5, size=6)
+
+        status = rng.integers(0, 3, size=(replicates, cells)).astype(np.int8)
+        eclipsed_phase_period = np.where(status == ECLIPSED, rng.integers(tick, tick + 3, size=status.shape), 0)
+        first_infectious_status_time = np.where(status == INFECTED, rng.integers(1, 10, size=status.shape), 0)
+        next_production = np.where(status == INFECTED, rng.integers(tick, tick + 3, size=status.shape), 0)
+        state = [status, eclipsed_phase_period, first_infectious_status_time, next_production]
+
+        expected = [a.copy() for a in state]
+        expected_counts = [reference_step(*[a[r] for a in expected], virions, interval, tick) for r in range(replicates)]
+
+        became_infected = np.zeros(replicates, dtype=np.int64)
+        produced = np.zeros(replicates, dtype=np.int64)
+        step_replicates(*state, virions, interval, tick, ECLIPSED, INFECTED, became_infected, produced)
+
+        for a, b in zip(state, expected):
+            np.testing.assert_array_equal(a, b)
+        self.assertEqual(list(zip(became_infected.tolist(), produced.tolist())), expected_counts)
+        self.assertTrue(np.all(became_infected > 0) and np.all(produced > 0))
+
+@requires_model
+class TestNeighborInfection(unittest.TestCase):
+
+    TICKS = [100, 200, 300]
+    PARAMS = {'gridWidth': 30, 'gridHeight': 100, 'runTime': 300, 'infect.neighbors': True,
+              'stats.in.memory': True, 'stats.result': 'summary', 'stats.result.ticks': TICKS}
+
+    def setUp(self):
+        from repast4py import parameters
+
+        self.saved_params = dict(parameters.params)
+
+    def tearDown(self):
+        from repast4py import parameters
+
+        parameters.params.clear()
+        parameters.params.update(self.saved_params)
+
+    def summaries(self, engine:str, partition:str) -> dict:
+        """ The stats columns at the TICKS of a run of each seed, shape (seeds, ticks)
+        """
+        from mpi4py import MPI
+        from hepb_model import hepb_model
+
+        columns = {}
+        for seed in range(1, 31):
+            params = dict(self.PARAMS, **{'hepatocyte.engine': engine, 'space.partition': partition,
+                                          'random.seed': seed})
+            with contextlib.redirect_stdout(io.StringIO()):
+                hepb_model.run(MPI.COMM_WORLD, PROPS, json.dumps(params))
+
+            for name, values in json.loads(hepb_model.get()).items():
+                columns.setdefault(name, []).append(values)
+
+        return {name: np.array(values) for name, values in columns.items()}
+
+    def test_same_distribution_as_object_engine(self):
+        # The engines draw their random numbers differently, so compare the distributions
+        array = self.summaries('array', 'index')
+        reference = self.summaries('object', 'grid')
+
+        for name in ['susceptible', 'eclipsed', 'infected', 'viral_load_log']:
+            a = array[name]
+            b = reference[name]
+
+            # The means at each tick within 4 standard errors of their difference
+            se = np.sqrt(a.var(axis=0, ddof=1) / len(a) + b.var(axis=0, ddof=1) / len(b))
+            with self.subTest(column=name):
+                self.assertTrue(np.all(np.abs(a.mean(axis=0) - b.mean(axis=0)) <= 4 * se + 1e-9),
+                                f'{a.mean(axis=0)} against {b.mean(axis=0)}, se {se}')
+
+if __name__ == '__main__':
+    unittest.main()
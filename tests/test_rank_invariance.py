@@ -0,0 +1,70 @@
+# This file is part of the HepB Model
+#
+# With rank.invariant a seed has the same stats on 1 and 2 ranks
+#
+# The 2 rank runs are launched with mpirun, or the HEPB_MPIRUN launcher with the
+# HEPB_MPIRUN_ARGS arguments, eg HEPB_MPIRUN_ARGS="--oversubscribe".
+#
+
+import glob
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from conftest import requires_model
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROPS = os.path.join(ROOT_DIR, 'data', 'model_props.yaml')
+
+MPIRUN = os.environ.get('HEPB_MPIRUN', 'mpirun')
+MPIRUN_ARGS = shlex.split(os.environ.get('HEPB_MPIRUN_ARGS', ''))
+
+PARAMS = {'gridWidth': 40, 'gridHeight': 100, 'runTime': 200, 'random.seed': 18, 'rank.invariant': True}
+
+@requires_model
+@unittest.skipUnless(shutil.which(MPIRUN) is not None, f'{MPIRUN} is needed for the 2 rank runs')
+class TestRankInvariance(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(prefix='hepb_test_ranks_')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def run_model(self, params:dict, ranks:int) -> str:
+        """ The stats file of a run on the ranks
+        """
+        output_dir = os.path.join(self.output_dir, f'{params["hepatocyte.engine"]}_{ranks}')
+        params = dict(params, **{'output.directory': output_dir})
+
+        cmd = [sys.executable, '-m', 'hepb_model', PROPS, json.dumps(params)]
+        if ranks > 1:
+            cmd = [MPIRUN, '-n', str(ranks)] + MPIRUN_ARGS + cmd
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT_DIR, env.get('PYTHONPATH')]))
+
+        # mpirun forwards its stdin to rank 0, which can stall the run when stdin is not a terminal
+        proc = subprocess.run(cmd, cwd=ROOT_DIR, env=env, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+        self.assertEqual(proc.returncode, 0, proc.stdout + proc.stderr)
+
+        with open(glob.glob(os.path.join(output_dir, 'run_*_stats.csv'))[0]) as f:
+            return f.read()
+
+    def assert_same_stats_on_ranks(self, **params):
+        params = dict(PARAMS, **params)
+        self.assertEqual(self.run_model(params, 2), self.run_model(params, 1))
+
+    def test_object(self):
+        self.assert_same_stats_on_ranks(**{'hepatocyte.engine': 'object'})
+
+    def test_array(self):
+        self.assert_same_stats_on_ranks(**{'hepatocyte.engine': 'array', 'space.partition': 'index'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# This file is part of the HepB Model
+#
+# The treatment variants of a scenario tree have the stats of full runs
+#
+
+import contextlib
+import glob
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from conftest import requires_model
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROPS = os.path.join(ROOT_DIR, 'data', 'model_props.yaml')
+
+PARAMS = {'gridWidth': 30, 'gridHeight': 100, 'runTime': 250, 'random.seed': 18}
+
+VARIANTS = [{'isTreatmentUsed': False},
+            {'isTreatmentUsed': True, 'startOfTreatmentAt': 120},
+            {'isTreatmentUsed': True, 'startOfTreatmentAt': 160, 'reduceProductionRate': 0.5}]
+
+def read_stats(output_dir:str) -> str:
+    with open(glob.glob(os.path.join(output_dir, 'run_*_stats.csv'))[0]) as f:
+        return f.read()
+
+@requires_model
+class TestScenarioTree(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(prefix='hepb_test_tree_')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def assert_variants_match_full_runs(self, engine:str):
+        from mpi4py import MPI
+        from hepb_model import hepb_model, scenario_tree
+
+        params = dict(PARAMS, **{'hepatocyte.engine': engine, 'output.directory': self.output_dir})
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            scenario_tree.run(MPI.COMM_WORLD, PROPS, json.dumps(params), VARIANTS, None)
+
+            for i, variant in enumerate(VARIANTS):
+                full_dir = os.path.join(self.output_dir, f'full_{i}')
+                hepb_model.run(MPI.COMM_WORLD, PROPS, json.dumps(dict(params, **variant, **{'output.directory': full_dir})))
+
+                branched = read_stats(os.path.join(self.output_dir, 'seed_18', f'variant_{i}'))
+                with self.subTest(variant=variant):
+                    self.assertEqual(branched, read_stats(full_dir))
+
+    def test_array(self):
+        self.assert_variants_match_full_runs('array')
+
+    def test_object(self):
+        self.assert_variants_match_full_runs('object')
+
+    def test_cohort(self):
+        self.assert_variants_match_full_runs('cohort')
+
+if __name__ == '__main__':
+    unittest.main()
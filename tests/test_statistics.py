@@ -0,0 +1,187 @@
+# This file is part of the HepB Model
+#
+# The stats files and results written by Statistics
+#
+
+import csv
+import glob
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from conftest import requires_model, requires_pyarrow
+
+# run, tick, susceptible, eclipsed, infected, viral load: a zero viral load, a viral load of 1
+ROWS = [(8, float(t), 4000 - t, t // 2, t // 3, [0, 1, 250, 10 ** 6][t % 4]) for t in range(1, 251)]
+
+def expected_csv_rows() -> list:
+    """ The rows as the original model wrote them, with str() of each value
+    """
+    rows = []
+    for run, tick, susceptible, eclipsed, infected, viral_load in ROWS:
+        viral_load_log = np.log10(viral_load).item() if viral_load > 0 else 0
+        rows.append([str(v) for v in (run, tick, susceptible, eclipsed, infected, viral_load_log)])
+    return rows
+
+@requires_model
+class TestStatistics(unittest.TestCase):
+
+    def setUp(self):
+        from repast4py import parameters
+
+        self.output_dir = tempfile.mkdtemp(prefix='hepb_test_stats_')
+
+        self.saved_params = dict(parameters.params)
+        parameters.params.clear()
+        parameters.params.update({'output.directory': self.output_dir, 'stats.output.file': 'stats.csv',
+                                  'stats.flush.interval': 100})
+
+    def tearDown(self):
+        from repast4py import parameters
+
+        parameters.params.clear()
+        parameters.params.update(self.saved_params)
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def record(self, stats, rows=ROWS):
+        for run, tick, *counts in rows:
+            stats.record_stats(tick, run, *counts)
+
+    def stats_fname(self) -> str:
+        fnames = glob.glob(os.path.join(self.output_dir, 'run_*_stats.*'))
+        self.assertEqual(len(fnames), 1)
+        return fnames[0]
+
+    def read_csv(self) -> list:
+        with open(self.stats_fname(), newline='') as f:
+            return list(csv.reader(f))
+
+    def assert_columns(self, columns:dict, zero_viral_load:float=-0.0):
+        """ The columns have the values of ROWS, with the viral_load_log of a zero viral load
+        """
+        for i, name in enumerate(['run', 'tick', 'susceptible', 'eclipsed', 'infected']):
+            np.testing.assert_array_equal(columns[name], [row[i] for row in ROWS])
+
+        viral_loads = np.array([row[5] for row in ROWS], dtype=np.float64)
+        expected = np.where(viral_loads > 0, np.log10(np.maximum(viral_loads, 1)), zero_viral_load)
+        np.testing.assert_array_equal(columns['viral_load_log'], expected)
+        np.testing.assert_array_equal(np.signbit(columns['viral_load_log']), np.signbit(expected))
+
+    def test_csv(self):
+        from hepb_model.model_statistics import Statistics, STATS_HEADER
+
+        stats = Statistics()
+
+        # The rows are written every flush interval
+        self.record(stats, ROWS[:150])
+        self.assertEqual(len(self.read_csv()), 1 + 100)
+
+        self.record(stats, ROWS[150:])
+        stats.close()
+
+        rows = self.read_csv()
+        self.assertEqual(rows[0], STATS_HEADER)
+        self.assertEqual(rows[1:], expected_csv_rows())
+        self.assertIsNone(Statistics.getInstance())
+
+    def test_csv_unbuffered_close(self):
+        from hepb_model.model_statistics import Statistics
+
+        stats = Statistics(flush_interval=0)
+        self.record(stats)
+        self.assertEqual(len(self.read_csv()), 1)
+
+        stats.close()
+        self.assertEqual(self.read_csv()[1:], expected_csv_rows())
+
+    @requires_pyarrow
+    def test_parquet(self):
+        from repast4py import parameters
+        import pyarrow.parquet as pq
+        from hepb_model.model_statistics import Statistics, STATS_COLUMNS, STATS_HEADER
+
+        parameters.params['stats.output.file'] = 'stats.parquet'
+        stats = Statistics()
+        self.record(stats)
+
+        # The rows so far are checkpointed every flush interval
+        self.assertTrue(os.path.exists(stats.checkpoint_fname))
+        stats.close()
+        self.assertFalse(os.path.exists(stats.checkpoint_fname))
+
+        table = pq.read_table(self.stats_fname())
+        self.assertEqual(table.column_names, STATS_HEADER)
+        columns = {name: table.column(header).to_numpy() for (name, _), header in zip(STATS_COLUMNS, STATS_HEADER)}
+
+        # A zero viral load is written as 0.0
+        self.assert_columns(columns, zero_viral_load=0.0)
+
+    @requires_pyarrow
+    def test_arrow(self):
+        from repast4py import parameters
+        import pyarrow.feather as feather
+        from hepb_model.model_statistics import Statistics
+
+        parameters.params['stats.output.file'] = 'stats.arrow'
+        stats = Statistics()
+        self.record(stats)
+        stats.close()
+
+        table = feather.read_table(self.stats_fname())
+        self.assertEqual(table.num_rows, len(ROWS))
+        np.testing.assert_array_equal(table.column('susceptible').to_numpy(), [row[2] for row in ROWS])
+
+    def test_memory(self):
+        from repast4py import parameters
+        from hepb_model.model_statistics import Statistics, decode_stats
+
+        parameters.params.update({'stats.in.memory': True, 'stats.result': 'payload'})
+        stats = Statistics()
+        self.record(stats)
+        self.assert_columns(stats.rows())
+
+        payload = stats.result()
+        stats.close()
+
+        self.assertEqual(os.listdir(self.output_dir), [])
+        self.assert_columns(decode_stats(payload))
+
+    def test_summary(self):
+        from repast4py import parameters
+        from hepb_model.model_statistics import Statistics
+
+        parameters.params.update({'stats.in.memory': True, 'stats.result': 'summary'})
+        stats = Statistics()
+        self.record(stats)
+
+        summary = json.loads(stats.result())
+        self.assertEqual(summary['tick'], [250.0])
+        self.assertEqual(summary['susceptible'], [4000 - 250])
+
+        parameters.params['stats.result.ticks'] = [1, 3, 100]
+        summary = json.loads(stats.result())
+        self.assertEqual(summary['tick'], [1.0, 3.0, 100.0])
+        self.assertEqual(summary['viral_load_log'], [0.0, 6.0, 0.0])
+        stats.close()
+
+    def test_encode_decode(self):
+        from hepb_model.model_statistics import Statistics, STATS_COLUMNS, encode_stats, decode_stats
+
+        stats = Statistics(flush_interval=0, in_memory=True)
+        self.record(stats)
+        rows = stats.rows()
+        stats.close()
+
+        decoded = decode_stats(encode_stats(rows))
+        self.assertEqual(list(decoded), [name for name, _ in STATS_COLUMNS])
+        for name, dtype in STATS_COLUMNS:
+            self.assertEqual(decoded[name].dtype, dtype)
+            np.testing.assert_array_equal(decoded[name], rows[name])
+        self.assert_columns(decoded)
+
+if __name__ == '__main__':
+    unittest.main()
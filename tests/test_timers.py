@@ -0,0 +1,149 @@
+# This file is part of the HepB Model
+#
+# The step phase timings, on 1 rank and aggregated across 2 ranks
+#
+# The 2 rank run is launched with mpirun, or the HEPB_MPIRUN launcher with the
+# HEPB_MPIRUN_ARGS arguments, eg HEPB_MPIRUN_ARGS="--oversubscribe".
+#
+
+import contextlib
+import csv
+import glob
+import io
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from conftest import requires_model
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROPS = os.path.join(ROOT_DIR, 'data', 'model_props.yaml')
+
+MPIRUN = os.environ.get('HEPB_MPIRUN', 'mpirun')
+MPIRUN_ARGS = shlex.split(os.environ.get('HEPB_MPIRUN_ARGS', ''))
+
+PARAMS = {'gridWidth': 40, 'gridHeight': 100, 'runTime': 200, 'random.seed': 18, 'phase.timers': True}
+
+def read_timings(output_dir:str) -> dict:
+    """ The rows of the timings file, by phase
+    """
+    fnames = glob.glob(os.path.join(output_dir, 'run_*_timings.csv'))
+    assert len(fnames) == 1, fnames
+    with open(fnames[0], newline='') as f:
+        return {row['phase']: row for row in csv.DictReader(f)}
+
+@requires_model
+class TestPhaseTimers(unittest.TestCase):
+
+    def tearDown(self):
+        from hepb_model.timers import PhaseTimers
+
+        if PhaseTimers.getInstance() is not None:
+            PhaseTimers.getInstance().close()
+
+    def test_lap(self):
+        from hepb_model.timers import PhaseTimers
+
+        timers = PhaseTimers(['a', 'b'])
+        t = timers.now()
+        for _ in range(3):
+            t = timers.lap('a', t)
+            t = timers.lap('b', t)
+
+        self.assertIs(PhaseTimers.getInstance(), timers)
+        self.assertEqual(timers.calls, {'a': 3, 'b': 3})
+        self.assertTrue(all(total >= 0 for total in timers.totals.values()))
+
+    def test_summary_on_one_rank(self):
+        from mpi4py import MPI
+        from hepb_model.timers import PhaseTimers
+
+        timers = PhaseTimers(['a', 'b'])
+        timers.totals['a'] = 2.0
+        timers.calls['a'] = 4
+
+        rows = timers.summary(MPI.COMM_SELF)
+
+        # One rank has no imbalance, nor does a phase with no time
+        self.assertEqual(rows, [['a', 4, 2.0, 2.0, 2.0, 1.0, 0], ['b', 0, 0.0, 0.0, 0.0, 1.0, 0]])
+
+@requires_model
+class TestPhaseTimingsFile(unittest.TestCase):
+
+    def setUp(self):
+        from repast4py import parameters
+
+        self.output_dir = tempfile.mkdtemp(prefix='hepb_test_timers_')
+        self.saved_params = dict(parameters.params)
+
+    def tearDown(self):
+        from repast4py import parameters
+
+        parameters.params.clear()
+        parameters.params.update(self.saved_params)
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def test_timings_file(self):
+        from mpi4py import MPI
+        from hepb_model import hepb_model
+        from hepb_model.timers import STEP_PHASES
+
+        params = dict(PARAMS, **{'checkpoint.interval': 50, 'output.directory': self.output_dir})
+        with contextlib.redirect_stdout(io.StringIO()):
+            hepb_model.run(MPI.COMM_WORLD, PROPS, json.dumps(params))
+
+        rows = read_timings(self.output_dir)
+
+        # Every phase is timed at each tick, and the checkpoint at each checkpoint
+        self.assertEqual(list(rows), STEP_PHASES)
+        for phase, row in rows.items():
+            with self.subTest(phase=phase):
+                calls = PARAMS['runTime'] // 50 if phase == 'checkpoint' else PARAMS['runTime']
+                self.assertEqual(int(row['calls']), calls)
+                self.assertEqual(float(row['min']), float(row['max']))
+                self.assertEqual(float(row['imbalance']), 1.0)
+                self.assertEqual(int(row['max_rank']), 0)
+
+@requires_model
+@unittest.skipUnless(shutil.which(MPIRUN) is not None, f'{MPIRUN} is needed for the 2 rank run')
+class TestPhaseTimingsRanks(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(prefix='hepb_test_timers_')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def test_aggregated_across_ranks(self):
+        from hepb_model.timers import STEP_PHASES
+
+        params = dict(PARAMS, **{'output.directory': self.output_dir})
+        cmd = [MPIRUN, '-n', '2'] + MPIRUN_ARGS + [sys.executable, '-m', 'hepb_model', PROPS, json.dumps(params)]
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT_DIR, env.get('PYTHONPATH')]))
+
+        # mpirun forwards its stdin to rank 0, which can stall the run when stdin is not a terminal
+        proc = subprocess.run(cmd, cwd=ROOT_DIR, env=env, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+        self.assertEqual(proc.returncode, 0, proc.stdout + proc.stderr)
+
+        # Only rank 0 writes the timings
+        rows = read_timings(self.output_dir)
+        self.assertEqual(list(rows), STEP_PHASES)
+
+        for phase, row in rows.items():
+            minimum, mean, maximum = float(row['min']), float(row['mean']), float(row['max'])
+            with self.subTest(phase=phase):
+                self.assertTrue(minimum <= mean <= maximum)
+                self.assertGreaterEqual(float(row['imbalance']), 1.0)
+                self.assertIn(int(row['max_rank']), [0, 1])
+
+        self.assertGreater(float(rows['hepatocyte_step']['max']), 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
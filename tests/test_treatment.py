@@ -0,0 +1,71 @@
+# This file is part of the HepB Model
+#
+# The fraction of the produced virions that the treatment releases
+#
+
+import unittest
+
+import numpy as np
+
+from conftest import requires_model
+
+@requires_model
+class TestTreatment(unittest.TestCase):
+
+    def setUp(self):
+        from repast4py import parameters
+
+        self.saved_params = dict(parameters.params)
+        parameters.params.clear()
+        parameters.params.update({'isTreatmentUsed': True, 'startOfTreatmentAt': 960,
+                                  'reduceProductionRate': 0.9, 'reduceProductionRateController': 0.5})
+
+    def tearDown(self):
+        from repast4py import parameters
+
+        parameters.params.clear()
+        parameters.params.update(self.saved_params)
+
+    def test_reduction_ramp(self):
+        from hepb_model.treatment import Treatment
+
+        treatment = Treatment()
+        self.assertEqual(treatment.reduction(959), 0.0)
+        self.assertAlmostEqual(treatment.reduction(960), 0.9 * 0.5)
+        self.assertAlmostEqual(treatment.reduction(983), 0.9 * 0.5)
+        self.assertAlmostEqual(treatment.reduction(984), 0.9 * 0.75)
+        self.assertAlmostEqual(treatment.reduction(960 + 24 * 30), 0.9, places=6)
+
+    def test_released_fraction(self):
+        from hepb_model.treatment import Treatment
+
+        treatment = Treatment()
+        produced = 100000
+
+        for tick in (960, 984, 1200):
+            released = np.array([treatment.release(tick, produced, seed) for seed in range(200)])
+            expected = 1.0 - treatment.reduction(tick)
+
+            # The mean of 200 binomial draws, within 5 standard errors
+            sd = np.sqrt(expected * (1.0 - expected) / (produced * len(released)))
+            with self.subTest(tick=tick):
+                self.assertAlmostEqual(released.mean() / produced, expected, delta=5 * sd)
+                self.assertTrue(np.all(released <= produced))
+
+    def test_untreated_release_everything(self):
+        from repast4py import parameters
+        from hepb_model.treatment import Treatment
+
+        self.assertEqual(Treatment().release(900, 12345, 1), 12345)
+
+        parameters.params['isTreatmentUsed'] = False
+        self.assertEqual(Treatment().release(2000, 12345, 1), 12345)
+
+    def test_release_is_keyed_on_seed_and_tick(self):
+        from hepb_model.treatment import Treatment
+
+        treatment = Treatment()
+        self.assertEqual(treatment.release(1000, 50000, 7), treatment.release(1000, 50000, 7))
+
+if __name__ == '__main__':
+    unittest.main()